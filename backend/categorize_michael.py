@@ -4,10 +4,18 @@ Lê uma planilha Excel com o formato da Amex e gera uma nova versão categorizad
 """
 
 import pandas as pd
-from openai import OpenAI
+import xlsxwriter
+from openai import OpenAI, AsyncOpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential
+from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from dotenv import load_dotenv
+import asyncio
+import hashlib
 import os
 import json
+import sqlite3
+import time
 
 load_dotenv()
 
@@ -70,28 +78,21 @@ def get_openai_client():
     return OpenAI(api_key=api_key.strip())
 
 
-def categorize_with_ai(client: OpenAI, description: str, original_category: str, notes: str = "") -> str:
-    """Use AI to categorize an expense based on description"""
-    
-    # First try simple mapping
-    if original_category in CATEGORY_MAPPING:
-        mapped = CATEGORY_MAPPING[original_category]
-        # For some categories, we can be more specific based on description
-        if mapped == "Meals & Entertainment - Travel":
-            # Check if it's actually local (no travel context in notes)
-            if notes and ("local" in notes.lower() or "office" in notes.lower()):
-                return "Meals & Entertainment - Local"
-        return mapped
-    
-    # Use AI for complex cases
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""You are an expense categorizer for a venture capital firm.
-Given an expense description and optional notes, categorize it into ONE of these categories:
+def get_async_openai_client():
+    """Initialize async OpenAI client (interactive mode)"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not set")
+    return AsyncOpenAI(api_key=api_key.strip())
+
+
+VALID_CATEGORY_SET = frozenset(VALID_CATEGORIES)
+# lowercase -> nome oficial, para aceitar respostas com outra capitalização
+VALID_CATEGORY_CI = {c.lower(): c for c in VALID_CATEGORIES}
+
+SYSTEM_PROMPT = f"""You are an expense categorizer for a venture capital firm.
+You will receive a JSON list of expenses, each with an index "i", a description "desc",
+the original card category "cat" and optional "notes". Categorize each one into ONE of these categories:
 
 {json.dumps(VALID_CATEGORIES, indent=2)}
 
@@ -107,67 +108,289 @@ Rules:
 9. Gym memberships like Wellhub = "Wellhub Reimbursement"
 10. If unsure, use "Miscellaneous"
 
-Return ONLY the category name, nothing else."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Description: {description}\nOriginal Category: {original_category}\nNotes: {notes}"
-                }
-            ],
-            temperature=0,
-            max_tokens=50
-        )
-        
-        category = response.choices[0].message.content.strip().strip('"\'')
-        
-        # Validate it's a valid category
-        if category in VALID_CATEGORIES:
-            return category
-        
-        # Try to find closest match
-        category_lower = category.lower()
-        for valid in VALID_CATEGORIES:
-            if valid.lower() == category_lower:
-                return valid
-        
-        return "Miscellaneous"
+Return ONLY a JSON object like {{"results": [{{"i": 0, "category": "Airfare"}}]}} with one entry per expense."""
+
+# Despesas por requisição (o prompt do sistema é enviado uma vez por chunk)
+CHUNK_SIZE = 50
+
+# Intervalo entre consultas de status do batch (segundos)
+BATCH_POLL_INTERVAL = 30
+
+# Requisições simultâneas no modo interativo
+AI_CONCURRENCY = 20
+
+# Cache local das categorias já decididas pela IA (descrições se repetem todo mês)
+CATEGORY_CACHE_PATH = os.getenv(
+    "MICHAEL_CATEGORY_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cat_cache.db"),
+)
+
+
+def cache_key(description: str, original_category: str, notes: str) -> str:
+    """Compact key over the normalized inputs"""
+    raw = "\x1f".join(" ".join(v.lower().split()) for v in (description, original_category, notes))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def open_category_cache(path: str = CATEGORY_CACHE_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS c (k TEXT PRIMARY KEY, v TEXT)")
+    return conn
+
+
+def cache_lookup(conn, keys: list) -> dict:
+    """Return {key: category} for the keys already cached"""
+    found = {}
+    unique = list(set(keys))
+    # Respeita o limite de parâmetros do SQLite
+    for i in range(0, len(unique), 500):
+        part = unique[i:i + 500]
+        placeholders = ",".join("?" * len(part))
+        found.update(conn.execute(f"SELECT k, v FROM c WHERE k IN ({placeholders})", part).fetchall())
+    return found
+
+
+def cache_store(conn, items: dict):
+    """Save {key: category}; Miscellaneous is not cached since it is also the error fallback"""
+    rows = [(k, v) for k, v in items.items() if v and v != "Miscellaneous"]
+    if rows:
+        conn.executemany("INSERT OR REPLACE INTO c (k, v) VALUES (?, ?)", rows)
+        conn.commit()
+
+
+def chunk_rows(rows: list, size: int = CHUNK_SIZE) -> list:
+    """Split rows into lists of at most `size` items"""
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def build_chat_body(chunk: list) -> dict:
+    """Build the chat completion payload for a chunk of (idx, description, category, notes) rows"""
+    items = [
+        {"i": i, "desc": description, "cat": original_category, "notes": notes}
+        for i, (_, description, original_category, notes) in enumerate(chunk)
+    ]
+    return {
+        "model": "gpt-4.1",
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Categorize each: {json.dumps(items)}"}
+        ],
+        "temperature": 0,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def validate_category(category: str) -> str:
+    """Return the matching valid category, or Miscellaneous"""
+    category = (category or "").strip().strip('"\'')
+
+    # Validate it's a valid category
+    if category in VALID_CATEGORY_SET:
+        return category
+
+    # Try a case-insensitive match
+    return VALID_CATEGORY_CI.get(category.lower(), "Miscellaneous")
+
+
+def parse_chunk_response(content: str, chunk: list) -> dict:
+    """Map the model's {"results": [...]} answer back to {idx: category}"""
+    results = {idx: "Miscellaneous" for idx, *_ in chunk}
+    try:
+        data = json.loads(content or "{}")
+    except ValueError:
+        print(f"Invalid JSON from AI for a chunk of {len(chunk)} expenses")
+        return results
+
+    for item in data.get("results") or []:
+        i = item.get("i") if isinstance(item, dict) else None
+        if isinstance(i, int) and 0 <= i < len(chunk):
+            results[chunk[i][0]] = validate_category(str(item.get("category") or ""))
+    return results
+
+
+@retry(wait=wait_exponential(multiplier=1, max=30), stop=stop_after_attempt(3), reraise=True)
+async def _complete(client: AsyncOpenAI, body: dict) -> str:
+    """One chat completion, retried with exponential backoff"""
+    response = await client.chat.completions.create(**body)
+    return response.choices[0].message.content
+
+
+async def categorize_with_ai(client: AsyncOpenAI, chunk: list) -> dict:
+    """Use AI to categorize a chunk of expenses in a single request"""
+    try:
+        content = await _complete(client, build_chat_body(chunk))
+        return parse_chunk_response(content, chunk)
         
     except Exception as e:
         print(f"Error with AI categorization: {e}")
-        return "Miscellaneous"
+        return {idx: "Miscellaneous" for idx, *_ in chunk}
+
+
+async def _gather_bounded(coros: list, limit: int = AI_CONCURRENCY) -> list:
+    """asyncio.gather with at most `limit` coroutines in flight"""
+    sem = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with sem:
+            return await coro
+
+    return await tqdm_asyncio.gather(*(run(coro) for coro in coros), desc="AI requests", unit="req")
+
+
+async def categorize_interactive(rows: list) -> dict:
+    """Categorize (idx, description, original_category, notes) rows concurrently"""
+    if not rows:
+        return {}
+    client = get_async_openai_client()
+    chunk_results = await _gather_bounded([
+        categorize_with_ai(client, chunk) for chunk in chunk_rows(rows)
+    ])
+    results = {}
+    for chunk_result in chunk_results:
+        results.update(chunk_result)
+    return results
+
+
+def categorize_with_batch_api(client: OpenAI, rows: list) -> dict:
+    """
+    Categorize (idx, description, original_category, notes) rows with the OpenAI Batch API.
+    Returns {idx: category}; rows without a usable result fall back to Miscellaneous.
+    """
+    if not rows:
+        return {}
 
+    chunks = chunk_rows(rows)
+    lines = [
+        json.dumps({
+            "custom_id": str(n),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_chat_body(chunk),
+        })
+        for n, chunk in enumerate(chunks)
+    ]
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
 
-def process_michael_expenses(input_file: str, output_file: str):
-    """Process Michael's expenses and categorize them"""
+    batch_file = client.files.create(file=("michael_requests.jsonl", payload), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(rows)} expenses in {len(chunks)} requests")
+
+    with tqdm(total=len(chunks), desc=f"batch {batch.id}", unit="req") as progress:
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                progress.update(counts.completed + counts.failed - progress.n)
+            progress.set_postfix_str(batch.status)
+
+    results = {idx: "Miscellaneous" for idx, *_ in rows}
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"Batch {batch.id} finished with status {batch.status}")
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        body = (item.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        if not choices:
+            continue
+        chunk = chunks[int(item["custom_id"])]
+        results.update(parse_chunk_response(choices[0]["message"]["content"], chunk))
+
+    return results
+
+
+def read_input_excel(input_file: str) -> pd.DataFrame:
+    """Read the Amex export with the calamine (Rust) engine when available, else openpyxl"""
+    try:
+        return pd.read_excel(input_file, engine="calamine")
+    except (ImportError, ValueError) as e:
+        # pandas < 2.2 não conhece o engine; python-calamine pode não estar instalado
+        print(f"calamine engine unavailable ({e}), using openpyxl")
+        return pd.read_excel(input_file, engine="openpyxl")
+
+
+def write_excel(df: pd.DataFrame, output_file: str):
+    """Write the DataFrame with xlsxwriter row by row (constant memory), skipping to_excel"""
+    workbook = xlsxwriter.Workbook(output_file, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd",
+    })
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], workbook.add_format({"bold": True}))
+
+    # Converte cada coluna uma única vez (NaN/NaT viram células vazias)
+    columns = [
+        df.iloc[:, i].astype(object).where(df.iloc[:, i].notna(), None).tolist()
+        for i in range(df.shape[1])
+    ]
+    # constant_memory exige escrita em ordem de linha
+    for row_idx, values in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_idx, 0, values)
+    workbook.close()
+
+
+def process_michael_expenses(input_file: str, output_file: str, interactive: bool = False):
+    """Process Michael's expenses and categorize them (Batch API, or concurrent calls if interactive)"""
     
     print(f"Reading {input_file}...")
-    df = pd.read_excel(input_file)
+    df = read_input_excel(input_file)
     
     print(f"Found {len(df)} expenses")
     print(f"Columns: {list(df.columns)}")
     
-    # Initialize OpenAI client
-    client = get_openai_client()
+    # Mapeamento direto primeiro (vetorizado); o resto vai para a IA
+    columns = df.reindex(columns=['Description', 'Category', 'Notes'], fill_value='').astype(str)
+    columns = columns.reset_index(drop=True)
     
-    # Add new category column
-    new_categories = []
+    new_categories = columns['Category'].map(CATEGORY_MAPPING)
+    # Refeições com contexto local/escritório não são de viagem
+    local = (new_categories == "Meals & Entertainment - Travel") & columns['Notes'].str.contains(
+        r'local|office', case=False, na=False
+    )
+    new_categories[local] = "Meals & Entertainment - Local"
     
-    for idx, row in df.iterrows():
-        description = str(row.get('Description', ''))
-        original_category = str(row.get('Category', ''))
-        notes = str(row.get('Notes', ''))
-        
-        new_category = categorize_with_ai(client, description, original_category, notes)
-        new_categories.append(new_category)
+    pending = [
+        (row.Index, row.Description, row.Category, row.Notes)
+        for row in columns[new_categories.isna()].itertuples(index=True, name='R')
+    ]
+    
+    # Categorias já conhecidas de execuções anteriores
+    conn = open_category_cache()
+    try:
+        keys = {row[0]: cache_key(*row[1:]) for row in pending}
+        cached = cache_lookup(conn, list(keys.values()))
+        ai_categories = {pos: cached[key] for pos, key in keys.items() if key in cached}
+        pending = [row for row in pending if keys[row[0]] not in cached]
         
-        print(f"[{idx+1}/{len(df)}] {description[:50]}... -> {new_category}")
+        print(f"{len(df) - len(pending) - len(ai_categories)} mapped directly, "
+              f"{len(ai_categories)} from cache, {len(pending)} sent to AI")
+        if pending:
+            if interactive:
+                fresh = asyncio.run(categorize_interactive(pending))
+            else:
+                fresh = categorize_with_batch_api(get_openai_client(), pending)
+            ai_categories.update(fresh)
+            cache_store(conn, {keys[pos]: category for pos, category in fresh.items()})
+    finally:
+        conn.close()
+    
+    if ai_categories:
+        new_categories.loc[list(ai_categories)] = list(ai_categories.values())
     
     # Add the new category column
-    df['Valor_Category'] = new_categories
+    df['Valor_Category'] = new_categories.to_numpy()
     
     # Save to new file
     print(f"\nSaving categorized expenses to {output_file}...")
-    df.to_excel(output_file, index=False)
+    write_excel(df, output_file)
     
     # Print summary
     print("\n=== Category Summary ===")
@@ -182,12 +405,13 @@ def process_michael_expenses(input_file: str, output_file: str):
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) < 2:
-        print("Usage: python categorize_michael.py <input_file.xlsx>")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Usage: python categorize_michael.py <input_file.xlsx> [--interactive]")
         print("Output will be saved as michael_card.xlsx")
         sys.exit(1)
     
-    input_file = sys.argv[1]
+    input_file = args[0]
     output_file = "michael_card.xlsx"
     
-    process_michael_expenses(input_file, output_file)
+    process_michael_expenses(input_file, output_file, interactive="--interactive" in sys.argv)
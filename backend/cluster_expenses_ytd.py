@@ -0,0 +1,53 @@
+"""
+Script para clusterizar a tabela de despesas YTD no BigQuery
+Tabela: expenses_ytd (ver services/expenses_ytd.py)
+
+Todas as consultas YTD filtram por year e o resumo por tipo agrupa por employee_type;
+o add/undo casam por employee_name. Com a tabela clusterizada nessas colunas o BigQuery
+lê só os blocos do ano pedido em vez da tabela inteira (o equivalente a um índice).
+
+Uso:
+    python cluster_expenses_ytd.py            # define o clustering (vale para dados novos)
+    python cluster_expenses_ytd.py --rewrite  # e regrava as linhas existentes já clusterizadas
+"""
+
+import sys
+
+from services.bigquery_client import get_bigquery_client
+from services.expenses_ytd import FULL_TABLE_ID
+
+# Ordem importa: o filtro mais usado primeiro (máximo de 4 colunas)
+CLUSTERING_FIELDS = ["year", "employee_type", "employee_name"]
+
+
+def main():
+    print("=" * 60)
+    print("CLUSTERING DA TABELA EXPENSES YTD")
+    print("=" * 60)
+
+    client = get_bigquery_client()
+    table = client.get_table(FULL_TABLE_ID)
+    print(f"\n📋 Tabela {FULL_TABLE_ID}: {table.num_rows} linhas")
+    print(f"   → Clustering atual: {table.clustering_fields or 'nenhum'}")
+
+    if table.clustering_fields != CLUSTERING_FIELDS:
+        table.clustering_fields = CLUSTERING_FIELDS
+        table = client.update_table(table, ["clustering_fields"])
+        print(f"✓ Clustering definido: {table.clustering_fields}")
+    else:
+        print("✓ Clustering já está configurado")
+
+    if "--rewrite" in sys.argv:
+        # O reclustering automático é gradual; um UPDATE sem efeito regrava tudo agora
+        print("\n🔄 Regravando linhas existentes...")
+        job = client.query(f"UPDATE `{FULL_TABLE_ID}` SET year = year WHERE TRUE")
+        job.result()
+        print(f"✓ {job.num_dml_affected_rows} linhas regravadas")
+
+    print("\n" + "=" * 60)
+    print("✅ CONCLUÍDO")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
-import pdfplumber
-import pandas as pd
 import re
 from datetime import datetime
 from services.name_normalizer import normalize_name
+from extractors.pdf_text import iter_pdf_lines
+
+# Traços longos viram "-" e o marcador ⧫ é removido, numa única passada
+_NORM_TABLE = str.maketrans({"–": "-", "−": "-", "⧫": None})
 
 def normalize(s: str) -> str:
-    return s.replace("–", "-").replace("−", "-").replace("⧫", "").strip()
+    return s.translate(_NORM_TABLE).strip()
+
+# normalize() + remoção de $ e vírgulas numa única passada
+_AMOUNT_TABLE = str.maketrans({"–": "-", "−": "-", "⧫": None, "$": None, ",": None})
+_PAREN_AMOUNT_RE = re.compile(r"\(\s*(\d+(?:\.\d{2})?)\s*\)")
 
 def clean_amount(token: str):
     """Normaliza $ e negativos: -$123.45, ($123.45)"""
-    t = normalize(token).replace("$", "").replace(",", "").strip()
-    if re.fullmatch(r"\(\s*\d+(?:\.\d{2})?\s*\)", t):
-        t = "-" + t.strip("()").strip()
+    t = token.translate(_AMOUNT_TABLE).strip()
+    m = _PAREN_AMOUNT_RE.fullmatch(t)
+    if m:
+        t = "-" + m.group(1)
     try:
         return float(t)
     except ValueError:
@@ -43,6 +50,25 @@ SKIP_PREFIXES = (
     "FOREIGN", "SPEND", "AMOUNT", "DETAIL", "CONTINUED ON NEXT PAGE",
 )
 
+def _alternation(prefixes):
+    return "|".join(re.escape(p) for p in prefixes)
+
+# Classifica cada linha numa única chamada: o nome do grupo que casou é o tipo da linha
+_KEYWORD_RE = re.compile(
+    f"(?P<fees>{_alternation(FEES_START)})"
+    f"|(?P<interest>{_alternation(INTEREST_START)})"
+    f"|(?P<section>(?:{_alternation(SKIP_SECTIONS)})\\Z)"
+    f"|(?P<end>{_alternation(SECTION_END)})"
+    f"|(?P<skip>{_alternation(SKIP_PREFIXES)})"
+)
+# Tipo de linha que abre uma seção ignorada -> skip_mode
+_SKIP_MODES = {"fees": "fees", "interest": "interest", "section": "payments_credits"}
+_BLOCK_END_KINDS = frozenset(("fees", "interest", "end"))
+
+def line_kind(upper: str):
+    m = _KEYWORD_RE.match(upper)
+    return m.lastgroup if m else None
+
 # Words that look like cardholder names but aren't
 NOT_CARDHOLDER_WORDS = (
     "SUBSCRIPTIONS",
@@ -73,12 +99,8 @@ NOT_CARDHOLDER_WORDS = (
     "ACCOUNT",
 )
 
-def is_page_footer(line: str) -> bool:
-    L = normalize(line)
-    return bool(PAGE_FOOTER_RE.search(L))
-
-def is_cardholder_header(lines, i):
-    line = normalize(lines[i])
+def cardholder_candidate(line: str):
+    """Linha normalizada que parece um nome de titular (sem olhar as linhas seguintes)"""
     if not line or line != line.upper():
         return None
     if not re.fullmatch(r"[A-Z .'\-]+", line):
@@ -89,16 +111,21 @@ def is_cardholder_header(lines, i):
         return None
     
     # Must have at least 2 words (first name + last name)
-    words = line.split()
-    if len(words) < 2:
+    if len(line.split()) < 2:
         return None
-
-    # Only accept as cardholder if followed by "Card Ending" (the actual transaction detail section)
-    # This avoids matching names in the Payments/Credits summary section
-    lookahead = " ".join(normalize(lines[i+k]) for k in range(1, 4) if i+k < len(lines))
-    if "CARD ENDING" in lookahead.upper():
-        return line
-    return None
+    return line
+
+def _scan_headers(normalized, uppers):
+    """
+    headers[i] = nome do titular quando a linha i abre a seção de transações dele.
+    Only accept as cardholder if followed by "Card Ending" (the actual transaction detail section).
+    This avoids matching names in the Payments/Credits summary section.
+    """
+    headers = [None] * len(normalized)
+    for i, line in enumerate(normalized):
+        if cardholder_candidate(line) and "CARD ENDING" in " ".join(uppers[i+1:i+4]):
+            headers[i] = line
+    return headers
 
 def extract_amount_and_clean(desc_block: str):
     block = normalize(desc_block)
@@ -115,24 +142,23 @@ def extract_amount_and_clean(desc_block: str):
 
 def extract_amex(pdf_file) -> dict:
     """Extrai transações de PDF da Amex"""
-    lines = []
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            t = page.extract_text()
-            if t:
-                lines.extend(t.split("\n"))
+    # Pré-processa todas as linhas uma única vez (o lookahead precisa de acesso aleatório)
+    normalized = [normalize(l) for l in iter_pdf_lines(pdf_file)]
+    uppers = [l.upper() for l in normalized]
+    dates = [DATE_RE.match(l) for l in normalized]
+    footers = [bool(PAGE_FOOTER_RE.search(l)) for l in normalized]
+    kinds = [line_kind(u) for u in uppers]
+    headers = _scan_headers(normalized, uppers)
 
     all_cardholders = {}
     current_holder = None
     skip_mode = None
 
-    i, N = 0, len(lines)
+    i, N = 0, len(normalized)
     while i < N:
-        raw = lines[i]
-        line = normalize(raw)
-        upper = line.upper()
+        kind = kinds[i]
 
-        holder = is_cardholder_header(lines, i)
+        holder = headers[i]
         if holder:
             current_holder = holder.title()
             all_cardholders.setdefault(current_holder, [])
@@ -140,28 +166,20 @@ def extract_amex(pdf_file) -> dict:
             i += 1
             continue
 
-        if skip_mode is None and upper.startswith(FEES_START):
-            skip_mode = 'fees'
-            i += 1
-            continue
-        if skip_mode is None and upper.startswith(INTEREST_START):
-            skip_mode = 'interest'
-            i += 1
-            continue
-        # Skip "Payments" and "Credits" sections at the beginning of the statement
-        if skip_mode is None and any(upper == section for section in SKIP_SECTIONS):
-            skip_mode = 'payments_credits'
+        # Fees, interest and the "Payments"/"Credits" summary at the beginning are skipped
+        if skip_mode is None and kind in _SKIP_MODES:
+            skip_mode = _SKIP_MODES[kind]
             i += 1
             continue
 
         if skip_mode is not None:
-            if is_cardholder_header(lines, i) or is_page_footer(line) or any(upper.startswith(x) for x in SECTION_END):
+            if footers[i] or kind == "end":
                 skip_mode = None
             else:
                 i += 1
             continue
 
-        if upper.startswith(SKIP_PREFIXES) or is_page_footer(line):
+        if kind == "skip" or footers[i]:
             i += 1
             continue
 
@@ -170,7 +188,7 @@ def extract_amex(pdf_file) -> dict:
             i += 1
             continue
 
-        m = DATE_RE.match(line)
+        m = dates[i]
         if m:
             date_s, first_desc = m.group(1), m.group(2).strip()
             try:
@@ -181,22 +199,17 @@ def extract_amex(pdf_file) -> dict:
             block_lines = [first_desc] if first_desc else []
             j = i + 1
             while j < N:
-                nxt = normalize(lines[j])
-                up = nxt.upper()
-
-                if is_cardholder_header(lines, j):
-                    break
-                if DATE_RE.match(nxt):
+                if headers[j]:
                     break
-                if up.startswith(FEES_START) or up.startswith(INTEREST_START):
+                if dates[j]:
                     break
-                if any(up.startswith(x) for x in SECTION_END):
+                if kinds[j] in _BLOCK_END_KINDS:
                     break
-                if up.startswith(SKIP_PREFIXES) or is_page_footer(nxt):
+                if kinds[j] == "skip" or footers[j]:
                     j += 1
                     continue
 
-                block_lines.append(nxt)
+                block_lines.append(normalized[j])
                 j += 1
 
             block_text = " ".join([b for b in block_lines if b]).strip()
@@ -1,12 +1,18 @@
-import pdfplumber
-import pandas as pd
 import re
+import os
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
 from services.name_normalizer import normalize_name
+from extractors.pdf_text import iter_pdf_lines
+
+_NBSP_TABLE = str.maketrans({"\u00a0": " "})
 
 def normalize(s: str) -> str:
-    return s.replace("\u00a0", " ").strip() if s else ""
+    return s.translate(_NBSP_TABLE).strip() if s else ""
 
 def parse_brl_number(tok: str):
     """
@@ -76,63 +82,119 @@ def get_cotacao_dolar_ptax(data_iso: str, cache: dict):
     return None
 
 
+# Cotações PTAX já obtidas (data ISO -> taxa), persistidas entre execuções
+PTAX_CACHE_FILE = os.getenv("PTAX_CACHE_FILE", os.path.join(tempfile.gettempdir(), "ptax_cache.json"))
+PTAX_WORKERS = 8
+_ptax_lock = threading.Lock()
+
+
+def _load_ptax_cache() -> dict:
+    try:
+        with open(PTAX_CACHE_FILE, "r", encoding="utf-8") as f:
+            return {k: float(v) for k, v in json.load(f).items() if v}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+PTAX_CACHE = _load_ptax_cache()
+
+
+def _save_ptax_cache():
+    tmp_path = f"{PTAX_CACHE_FILE}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(PTAX_CACHE, f)
+        os.replace(tmp_path, PTAX_CACHE_FILE)
+    except OSError as e:
+        print(f"[WARN] Could not persist PTAX cache: {e}")
+
+
+def get_ptax_rates(dates) -> dict:
+    """
+    Cotação PTAX para cada data distinta.
+    Usa o cache persistido e busca as datas que faltam em paralelo.
+    """
+    dates = {d for d in dates if d}
+    rates = {d: PTAX_CACHE[d] for d in dates if d in PTAX_CACHE}
+    missing = sorted(dates - rates.keys())
+    if not missing:
+        return rates
+
+    with ThreadPoolExecutor(max_workers=min(PTAX_WORKERS, len(missing))) as ex:
+        fetched = dict(zip(missing, ex.map(lambda d: get_cotacao_dolar_ptax(d, {}), missing)))
+    rates.update(fetched)
+
+    # Falhas (None) não são persistidas, para tentar de novo na próxima vez
+    found = {d: r for d, r in fetched.items() if r}
+    if found:
+        with _ptax_lock:
+            PTAX_CACHE.update(found)
+            _save_ptax_cache()
+    return rates
+
+
+# Padrões das linhas do extrato
+MONEY_BR = r"\(?-?\d{1,3}(?:\.\d{3})*,\d{2}\)?"
+MONEY_BR_RE = re.compile(MONEY_BR)
+DATE_PREFIX_RE = re.compile(r"(\d{2}/\d{2})\s+")
+# Resto da linha após a data: descrição + valor USD + valor BRL
+ROW_TAIL_RE = re.compile(rf"(.+?)\s+({MONEY_BR})\s+({MONEY_BR})\s*$")
+MONTH_RE = re.compile(r"M[eê]s:\s*\w+\/(\d{4})", re.IGNORECASE)
+NAME_RE = re.compile(r"Nome:\s*(.+)$", re.IGNORECASE)
+YEAR_RE = re.compile(r"(20\d{2})")
+
+
 def extract_bradesco(pdf_file) -> dict:
     """Extrai transações de PDF do Bradesco"""
-    lines = []
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            txt = page.extract_text()
-            if txt:
-                lines.extend([normalize(l) for l in txt.split("\n")])
-
     # Discover year and cardholder name
     year = None
+    any_year = None
     holder = "Cardholder"
 
-    for l in lines:
-        m_month = re.search(r"M[eê]s:\s*\w+\/(\d{4})", l, flags=re.IGNORECASE)
+    # Uma única passada pelas linhas; as datas são montadas depois que o ano é conhecido
+    rows = []
+    for raw in iter_pdf_lines(pdf_file):
+        l = normalize(raw)
+
+        m_month = MONTH_RE.search(l)
         if m_month:
             year = int(m_month.group(1))
 
-        m_name = re.search(r"^Nome:\s*(.+)$", l, flags=re.IGNORECASE)
+        m_name = NAME_RE.match(l)
         if m_name:
             holder = normalize_name(m_name.group(1).strip())
 
-    if year is None:
-        m_any = re.search(r"(20\d{2})", " ".join(lines))
-        year = int(m_any.group(1)) if m_any else datetime.now().year
-
-    # Parse transactions
-    MONEY_BR = r"\(?-?\d{1,3}(?:\.\d{3})*,\d{2}\)?"
-    row_re = re.compile(
-        rf"^(\d{{2}}/\d{{2}})\s+(.+?)\s+({MONEY_BR})\s+({MONEY_BR})\s*$"
-    )
+        if any_year is None:
+            m_any = YEAR_RE.search(l)
+            if m_any:
+                any_year = int(m_any.group(1))
 
-    txs = []
-    for l in lines:
-        if l.upper().startswith(("DATA HISTÓRICO", "DATA HISTORICO")):
-            continue
-        if l.upper().startswith("TOTAL:"):
+        # Toda linha de transação começa com dd/mm (cabeçalho e "Total:" não)
+        m_date = DATE_PREFIX_RE.match(l)
+        if not m_date:
             continue
+        ddmm = m_date.group(1)
 
-        m = row_re.match(l)
-        if not m:
-            money_matches = list(re.finditer(MONEY_BR, l))
+        m = ROW_TAIL_RE.match(l, m_date.end())
+        if m:
+            desc, usd_raw, brl_raw = m.groups()
+        else:
+            money_matches = list(MONEY_BR_RE.finditer(l, m_date.end()))
             if len(money_matches) < 2:
                 continue
             m_usd, m_brl = money_matches[-2], money_matches[-1]
 
-            m_date = re.match(r"^(\d{2}/\d{2})\s+", l)
-            if not m_date:
-                continue
-            ddmm = m_date.group(1)
-
             desc = l[m_date.end(): m_usd.start()].strip()
-            usd_raw = l[m_usd.start(): m_usd.end()]
-            brl_raw = l[m_brl.start(): m_brl.end()]
-        else:
-            ddmm, desc, usd_raw, brl_raw = m.groups()
+            usd_raw = m_usd.group(0)
+            brl_raw = m_brl.group(0)
+
+        rows.append((ddmm, desc, usd_raw, brl_raw))
 
+    if year is None:
+        year = any_year if any_year is not None else datetime.now().year
+
+    txs = []
+    for ddmm, desc, usd_raw, brl_raw in rows:
         day, month = ddmm.split("/")
         try:
             date_fmt = datetime(year=int(year), month=int(month), day=int(day)).strftime("%Y-%m-%d")
@@ -150,12 +212,12 @@ def extract_bradesco(pdf_file) -> dict:
             "cardholder": holder,
         })
 
-    # Apply PTAX exchange rate
-    fx_cache = {}
+    # Apply PTAX exchange rate (uma consulta por data distinta)
+    fx_rates = get_ptax_rates(tx["date"] for tx in txs)
     transactions = []
     
     for tx in txs:
-        fx_rate = get_cotacao_dolar_ptax(tx["date"], fx_cache) if tx["date"] else None
+        fx_rate = fx_rates.get(tx["date"]) if tx["date"] else None
         
         final_amount = None
         if tx["amount_brl"] and fx_rate and fx_rate > 0:
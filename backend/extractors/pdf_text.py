@@ -0,0 +1,139 @@
+"""
+Extração de texto de PDFs compartilhada pelos extractors.
+
+O padrão é pdfplumber, cuja quebra de linhas é a que os parsers esperam.
+Com PDF_TEXT_BACKEND=pymupdf o texto sai do PyMuPDF (fitz), bem mais rápido;
+o layout das linhas pode diferir em alguns extratos, então é opt-in.
+"""
+
+import multiprocessing
+import os
+import threading
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "pdfplumber").strip().lower()
+
+# PDFs com pelo menos esse número de páginas são extraídos em paralelo (processos)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+
+# Pool de processos compartilhado entre requisições (criado no primeiro PDF grande)
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de workers de extração, criando na primeira chamada"""
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # spawn: o servidor tem várias threads e fork copiaria locks em uso
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    """Encerra os workers do pool (chamado no shutdown da aplicação)"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=True, cancel_futures=True)
+            _pdf_pool = None
+
+
+def _iter_page_texts_pymupdf(pdf_file):
+    import fitz  # PyMuPDF, opcional
+
+    if hasattr(pdf_file, "read"):
+        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
+    else:
+        doc = fitz.open(pdf_file)
+    with doc:
+        for page in doc:
+            yield page.get_text("text", sort=True)
+
+
+def _extract_page_range(args) -> list:
+    """Worker: reabre o PDF (caminho ou bytes) e extrai o texto das páginas [start, stop)"""
+    pdf_source, start, stop = args
+    if isinstance(pdf_source, bytes):
+        pdf_source = BytesIO(pdf_source)
+    texts = []
+    with pdfplumber.open(pdf_source) as pdf:
+        for page in pdf.pages[start:stop]:
+            texts.append(page.extract_text() or "")
+            page.flush_cache()
+    return texts
+
+
+def _iter_page_texts_parallel(pdf_source, page_count: int):
+    # Cada worker abre o PDF uma vez e processa um intervalo contíguo de páginas
+    workers = min(PDF_WORKERS, page_count)
+    size = -(-page_count // workers)
+    ranges = [(pdf_source, start, min(start + size, page_count)) for start in range(0, page_count, size)]
+    # O pool é reaproveitado: sem custo de subir processos (e importar pdfplumber) a cada PDF
+    for texts in get_pdf_pool().map(_extract_page_range, ranges):
+        yield from texts
+
+
+def _pdf_source_for_workers(pdf_file, pdf_bytes):
+    """O que vai para os workers: caminho (reaberto por eles) ou o conteúdo em bytes"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        return pdf_file
+    if pdf_bytes is not None:
+        return pdf_bytes
+    if isinstance(pdf_file, BytesIO):
+        # getvalue() devolve o buffer sem copiar quando ele não foi alterado
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+def _iter_page_texts_pdfplumber(pdf_file, pdf_bytes=None):
+    with pdfplumber.open(pdf_file) as pdf:
+        page_count = len(pdf.pages)
+        parallel = PDF_WORKERS > 1 and page_count >= PDF_PARALLEL_MIN_PAGES
+        if not parallel:
+            for page in pdf.pages:
+                text = page.extract_text() or ""
+                # Libera os objetos de layout da página já processada
+                page.flush_cache()
+                yield text
+            return
+
+    # Caminhos em disco são reabertos pelos workers; arquivos abertos vão como bytes
+    yield from _iter_page_texts_parallel(_pdf_source_for_workers(pdf_file, pdf_bytes), page_count)
+
+
+def iter_page_texts(pdf_file):
+    """
+    Gera o texto de cada página (string vazia quando a página não tem texto).
+    Aceita caminho, bytes ou arquivo aberto em modo binário (ex.: UploadFile.file).
+    """
+    pdf_bytes = None
+    if isinstance(pdf_file, (bytes, bytearray)):
+        # Os bytes originais seguem para os workers sem serem lidos de volta do BytesIO
+        pdf_bytes = bytes(pdf_file)
+        pdf_file = BytesIO(pdf_bytes)
+    if PDF_TEXT_BACKEND == "pymupdf":
+        try:
+            import fitz  # noqa: F401
+        except ImportError:
+            print("[WARN] PyMuPDF not installed, falling back to pdfplumber")
+        else:
+            yield from _iter_page_texts_pymupdf(pdf_file)
+            return
+    yield from _iter_page_texts_pdfplumber(pdf_file, pdf_bytes)
+
+
+def iter_pdf_lines(pdf_file):
+    """Gera as linhas do PDF página a página, sem montar a lista inteira"""
+    for text in iter_page_texts(pdf_file):
+        if text:
+            yield from text.split("\n")
@@ -1,11 +1,15 @@
-import pdfplumber
-import pandas as pd
 import re
 from datetime import datetime
 from services.name_normalizer import normalize_name
+from extractors.pdf_text import iter_pdf_lines
+
+# Traços longos viram "-" e o marcador ⧫ é removido, numa única passada
+_NORM_TABLE = str.maketrans({"–": "-", "−": "-", "⧫": None})
 
 def normalize(s: str) -> str:
-    return s.replace("–", "-").replace("−", "-").replace("⧫", "").strip()
+    return s.translate(_NORM_TABLE).strip()
+
+_AMOUNT_TABLE = str.maketrans({"$": None, ",": None, "–": "-", "−": "-"})
 
 def clean_amount(raw_value):
     """
@@ -13,28 +17,33 @@ def clean_amount(raw_value):
     - remove $ e vírgulas
     - converte parênteses e traços longos (–, −) em valores negativos
     """
-    value = raw_value.strip()
-    value = value.replace("$", "").replace(",", "")
+    # Remove $ e vírgulas e troca traços longos numa única passada
+    value = raw_value.strip().translate(_AMOUNT_TABLE)
     # Parentheses = negative
-    if re.match(r"^\(.*\)$", value):
+    if value.startswith("(") and value.endswith(")"):
         value = "-" + value.strip("()")
-    # Long dash or similar
-    value = value.replace("–", "-").replace("−", "-").strip()
+    value = value.strip()
     try:
         return float(value)
     except ValueError:
         return None
 
 
+TRANSACTION_RE = re.compile(
+    r"(\d{2}-\d{2}-\d{2})\s+(.+?)\s+(\(?-?\$?\d{1,3}(?:,\d{3})*(?:\.\d{2})?\)?)$"
+)
+CARDHOLDER_RE = re.compile(r"^(.*?) TOTAL FOR ACCOUNT ENDING IN \d+.*$", re.IGNORECASE)
+MCC_RE = re.compile(r"MCC:\s*(\d+)")
+ZIP_RE = re.compile(r"MERCHANT ZIP:\s*(\d+)")
+ACCOUNT_RE = re.compile(r"Account Number:\s+Ending in\s+(\d+)")
+
+
 def parse_transaction_line(line):
     """
     Detecta linhas de transações no formato: MM-DD-YY <descrição> <valor>
     Inclui negativos, com ou sem cifrão.
     """
-    match = re.match(
-        r"(\d{2}-\d{2}-\d{2})\s+(.+?)\s+(\(?-?\$?\d{1,3}(?:,\d{3})*(?:\.\d{2})?\)?)$",
-        line.strip()
-    )
+    match = TRANSACTION_RE.match(line.strip())
     if match:
         date_str = match.group(1)
         desc = match.group(2).strip()
@@ -61,58 +70,73 @@ def parse_transaction_line(line):
 def extract_svb(pdf_file) -> dict:
     """Extrai transações de PDF do SVB"""
     all_cardholders = {}
-    lines = []
-
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if text:
-                lines.extend(text.split("\n"))
-
-    cardholder_pattern = re.compile(r"^(.*?) TOTAL FOR ACCOUNT ENDING IN \d+.*$", re.IGNORECASE)
-
-    pending_tx = []
-    pending_idx = []
+    account = None
+
+    # Transações ainda sem titular, cada uma com as (até) 2 linhas seguintes
+    pending = []
+    # Transações já atribuídas cujo contexto MCC/ZIP ainda não tem 2 linhas
+    awaiting_context = []
+
+    def fill_context(tx_item, context_lines):
+        context = " ".join(context_lines)
+        mcc_match = MCC_RE.search(context)
+        zip_match = ZIP_RE.search(context)
+        tx_item["mcc"] = mcc_match.group(1) if mcc_match else ""
+        tx_item["merchant_zip"] = zip_match.group(1) if zip_match else ""
+
+    for line in iter_pdf_lines(pdf_file):
+        # A linha atual é contexto das transações anteriores; só as 2 últimas
+        # pendentes podem ter menos de 2 linhas (as outras já viram 2 linhas depois delas)
+        for _, context_lines in pending[-2:]:
+            if len(context_lines) < 2:
+                context_lines.append(line)
+        if awaiting_context:
+            still_waiting = []
+            for tx_item, context_lines in awaiting_context:
+                context_lines.append(line)
+                if len(context_lines) < 2:
+                    still_waiting.append((tx_item, context_lines))
+                else:
+                    fill_context(tx_item, context_lines)
+            awaiting_context = still_waiting
+
+        if account is None:
+            m = ACCOUNT_RE.search(line)
+            if m:
+                account = m.group(1)
 
-    for i, line in enumerate(lines):
-        holder_match = cardholder_pattern.match(line)
         tx = parse_transaction_line(line)
 
         if tx:
-            pending_tx.append(tx)
-            pending_idx.append(i)
+            pending.append((tx, []))
+            continue
 
-        elif holder_match:
+        # Só procura o titular em linhas que não são transação
+        holder_match = CARDHOLDER_RE.match(line)
+        if holder_match:
             cardholder = holder_match.group(1).strip()
-            if pending_tx:
-                for j, tx_item in enumerate(pending_tx):
-                    idx = pending_idx[j]
-                    next_lines = lines[idx + 1: idx + 3]
-                    context = " ".join(next_lines)
-                    mcc_match = re.search(r"MCC:\s*(\d+)", context)
-                    zip_match = re.search(r"MERCHANT ZIP:\s*(\d+)", context)
-                    tx_item["mcc"] = mcc_match.group(1) if mcc_match else ""
-                    tx_item["merchant_zip"] = zip_match.group(1) if zip_match else ""
-
-                all_cardholders.setdefault(cardholder, []).extend(pending_tx)
-                pending_tx = []
-                pending_idx = []
+            if pending:
+                for tx_item, context_lines in pending:
+                    if len(context_lines) < 2:
+                        awaiting_context.append((tx_item, context_lines))
+                    else:
+                        fill_context(tx_item, context_lines)
 
-    # If no sections per cardholder
-    if pending_tx:
-        acct_match = None
-        for line in lines:
-            m = re.search(r"Account Number:\s+Ending in\s+(\d+)", line)
-            if m:
-                acct_match = m
-                break
+                all_cardholders.setdefault(cardholder, []).extend(tx_item for tx_item, _ in pending)
+                pending = []
+
+    # Fim do arquivo: completa o contexto com o que houver
+    for tx_item, context_lines in awaiting_context:
+        fill_context(tx_item, context_lines)
 
-        if acct_match:
-            holder_name = f"Account {acct_match.group(1)}"
+    # If no sections per cardholder
+    if pending:
+        if account:
+            holder_name = f"Account {account}"
         else:
             holder_name = "All Transactions"
 
-        all_cardholders.setdefault(holder_name, []).extend(pending_tx)
+        all_cardholders.setdefault(holder_name, []).extend(tx_item for tx_item, _ in pending)
 
     # Flatten to return single list with cardholder
     transactions = []
@@ -1,39 +1,49 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from fastapi.responses import StreamingResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from starlette.formparsers import MultiPartParser
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException as StarletteHTTPException
+import anyio.to_thread
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError, field_validator
 from typing import List, Optional
-from datetime import datetime
-import tempfile
+from decimal import Decimal
+import asyncio
+import functools
+import hashlib
+import importlib
+import itertools
+import logging
 import os
+import sys
 import uuid
 import pandas as pd
-from io import BytesIO
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from extractors.svb import extract_svb
-from extractors.amex import extract_amex
-from extractors.bradesco import extract_bradesco
-from services.categorizer import categorize_transactions, EXPENSE_CATEGORIES
-from services.rippling import process_rippling_file, export_rippling_to_excel
-from services.michael import (
-    process_michael_file, categorize_michael_transactions, export_michael_to_excel,
-    get_michael_expenses, get_michael_batches, add_michael_expenses_to_db,
-    update_michael_expense, delete_michael_expense, delete_michael_batch,
-    sync_michael_to_valor, get_michael_summary
-)
-from services.uber import process_uber_csv, upload_new_rows_to_bigquery, get_uber_dashboard_data
+# Extractors (pdfplumber), categorizer/michael/it_subscriptions (OpenAI), rippling e uber
+# são importados dentro dos handlers: o worker só paga o import na primeira requisição que usa
+from services.excel_export import build_workbook, iter_file_chunks, STREAM_CHUNK_SIZE
+from services.extraction_cache import file_digest, get_cached_extraction, store_extraction
+from services.categorization_cache import transactions_key, get_cached_categories, store_categories
 from services.rippling_employees import (
     get_all_employees, get_unique_display_names, add_employee, 
-    update_employee, delete_employee, get_employee_types
+    update_employee, delete_employee, get_employee_types, EmployeeType
 )
 from services.expenses_ytd import (
     get_all_expenses as get_ytd_expenses,
+    iter_expenses as iter_ytd_expenses,
     get_expenses_summary as get_ytd_summary,
     get_expenses_by_employee_type as get_ytd_by_type,
+    get_expenses_bundle as get_ytd_bundle,
     get_expense_categories as get_ytd_categories,
     get_available_years as get_ytd_years,
     add_expenses_to_consolidated,
@@ -41,12 +51,11 @@ from services.expenses_ytd import (
 )
 from services.credit_card_expenses import (
     add_credit_card_expenses,
-    get_credit_card_expenses,
     get_credit_card_batches,
     delete_credit_card_expense,
     delete_credit_card_expenses_batch,
     delete_credit_card_batch,
-    get_all_credit_card_expenses,
+    iter_credit_card_expenses as iter_cc_expenses,
     get_credit_card_summary,
     get_unique_users as get_cc_users,
     get_unique_categories as get_cc_categories,
@@ -56,7 +65,8 @@ from services.credit_card_expenses import (
     update_credit_card_expense,
     sync_to_valor_expenses as sync_cc_to_valor,
     VALID_CREDIT_CARDS,
-    apply_firm_uber_rule
+    apply_firm_uber_rule,
+    parse_credit_card_excel
 )
 from services.rippling_expenses import (
     parse_rippling_file,
@@ -71,8 +81,8 @@ from services.rippling_expenses import (
     normalize_name
 )
 from services.valor_expenses import (
-    get_all_expenses as get_valor_expenses,
-    get_expenses_by_employee as get_valor_by_employee,
+    iter_expenses as iter_valor_expenses,
+    iter_expenses_by_employee as iter_valor_by_employee,
     get_summary as get_valor_summary,
     get_available_years as get_valor_years,
     get_categories as get_valor_categories,
@@ -85,17 +95,142 @@ from services.valor_expenses import (
     fix_category_case,
     export_consolidated_by_category
 )
-from services.it_subscriptions import (
-    get_it_subscriptions,
-    extract_vendors_for_expenses,
-    get_it_subscriptions_summary
-)
+
+logger = logging.getLogger(__name__)
+
+
+def json_default(value):
+    """Tipos que o orjson não serializa sozinho (NUMERIC do BigQuery chega como Decimal)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONResponse(ORJSONResponse):
+    """JSON via orjson; aceita também os escalares numpy que vêm do pandas e Decimal"""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=json_default, option=JSON_OPTIONS)
+
+
+# Uploads até esse tamanho ficam em memória; o padrão do Starlette (1MB) manda quase todo
+# extrato para disco, com uma escrita no threadpool a cada bloco recebido
+UPLOAD_SPOOL_MAX_SIZE = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE", str(16 << 20)))
+MultiPartParser.max_file_size = UPLOAD_SPOOL_MAX_SIZE
+
+# Tamanho máximo do corpo por endpoint de upload (MB)
+MAX_PDF_UPLOAD_MB = int(os.getenv("MAX_PDF_UPLOAD_MB", "50"))
+MAX_SHEET_UPLOAD_MB = int(os.getenv("MAX_SHEET_UPLOAD_MB", "200"))
+UPLOAD_LIMITS_MB = {
+    "/extract": MAX_PDF_UPLOAD_MB,
+    "/export-excel": MAX_PDF_UPLOAD_MB,
+    "/rippling/process": MAX_SHEET_UPLOAD_MB,
+    "/rippling/export": MAX_SHEET_UPLOAD_MB,
+    "/michael/process": MAX_SHEET_UPLOAD_MB,
+    "/uber/preview": MAX_SHEET_UPLOAD_MB,
+    "/uber/upload": MAX_SHEET_UPLOAD_MB,
+    "/credit-card/dashboard/preview-excel": MAX_SHEET_UPLOAD_MB,
+    "/credit-card/dashboard/upload-excel": MAX_SHEET_UPLOAD_MB,
+    "/rippling-expenses/parse": MAX_SHEET_UPLOAD_MB,
+    "/rippling-expenses/upload": MAX_SHEET_UPLOAD_MB,
+}
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Recusa com 413 uploads cujo Content-Length passa do limite do endpoint, antes de
+    ler o corpo (dependências do FastAPI só rodam depois do form já ter sido lido).
+    """
+    def __init__(self, app, limits_mb: dict):
+        self.app = app
+        self.limits = {path: mb * 1024 * 1024 for path, mb in limits_mb.items()}
+        self.details = {path: f"File too large (max {mb} MB)" for path, mb in limits_mb.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"])
+            if limit is not None:
+                length = dict(scope["headers"]).get(b"content-length", b"")
+                if length.isdigit() and int(length) > limit:
+                    response = FastJSONResponse({"detail": self.details[scope["path"]]}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+# Formatos que já são compactados (.xlsx é um zip): gzip só gastaria CPU
+PRECOMPRESSED_MEDIA_TYPES = frozenset({
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/zip",
+    "application/pdf",
+})
+
+
+class _SelectiveGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message):
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            media_type = Headers(raw=message["headers"]).get("content-type", "").split(";")[0].strip()
+            # O GZipResponder repassa sem compactar respostas que já têm Content-Encoding
+            if media_type in PRECOMPRESSED_MEDIA_TYPES:
+                self.content_encoding_set = True
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip das respostas (JSON) exceto as que já vêm compactadas, como as planilhas"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _SelectiveGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Detalhe devolvido nos 500: o texto da exceção vai só para o log
+ERR_INTERNAL = "Erro interno do servidor"
+
+
+def server_error(detail: str) -> HTTPException:
+    """Dentro de um except: registra a exceção atual no log e monta o 500 com `detail` fixo"""
+    logger.exception(detail)
+    return HTTPException(status_code=500, detail=detail)
+
+
+class ErrorHandlingRoute(APIRoute):
+    """
+    Exceções não tratadas de um endpoint viram 500 {"detail": ERR_INTERNAL}, com o
+    traceback no log. Fica na rota (e não num exception_handler global) para a
+    resposta passar pelo CORS.
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            try:
+                return await handler(request)
+            except (StarletteHTTPException, RequestValidationError):
+                raise
+            except Exception:
+                logger.exception("Unhandled error in %s %s", request.method, request.url.path)
+                return FastJSONResponse({"detail": ERR_INTERNAL}, status_code=500)
+
+        return route_handler
+
 
 app = FastAPI(
     title="Expenses Portal API",
     description="API for extracting credit card statement data",
-    version="1.0.0"
+    version="1.0.0",
+    # Todas as respostas JSON (inclusive dicts retornados pelos endpoints) saem via orjson
+    default_response_class=FastJSONResponse
 )
+# Vale para todas as rotas declaradas abaixo
+app.router.route_class = ErrorHandlingRoute
+
+# Adicionado antes do CORS para que a resposta 413 também leve os headers de CORS
+app.add_middleware(UploadSizeLimitMiddleware, limits_mb=UPLOAD_LIMITS_MB)
 
 # CORS - allows requests from frontend
 app.add_middleware(
@@ -106,15 +241,189 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compacta respostas grandes (listas de transações, YTD); nível 1 = pouco custo de CPU.
+# O Vary: Accept-Encoding é adicionado pelo próprio middleware
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=1)
+
+def json_body(model):
+    """
+    Dependência que valida o corpo JSON direto dos bytes (pydantic-core), em vez do
+    json.loads + validação campo a campo do FastAPI. Para as listas grandes de transações.
+    """
+    adapter = TypeAdapter(model)
+    
+    async def parse(request: Request):
+        try:
+            return adapter.validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+            )
+    
+    return parse
+
+
+# Threads para as chamadas bloqueantes (PDF, pandas, OpenAI, BigQuery) - o padrão do anyio é 40
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    # O threadpool do anyio é encerrado pelo próprio servidor; o pool de processos dos PDFs não.
+    # Se nenhum PDF foi extraído neste worker o módulo nem foi importado
+    pdf_text = sys.modules.get("extractors.pdf_text")
+    if pdf_text is not None:
+        await run_in_threadpool(pdf_text.shutdown_pdf_pool)
+
+
+# Trabalho de CPU (PDF, pandas, planilhas) limitado ao número de núcleos; chamadas de
+# rede (BigQuery, OpenAI) continuam limitadas só pelo threadpool
+CPU_CONCURRENCY = int(os.getenv("CPU_CONCURRENCY", str(os.cpu_count() or 1)))
+cpu_semaphore = asyncio.Semaphore(CPU_CONCURRENCY)
+
+
+async def run_cpu_bound(func, *args):
+    """Roda func no threadpool com no máximo CPU_CONCURRENCY execuções simultâneas"""
+    async with cpu_semaphore:
+        return await run_in_threadpool(func, *args)
+
+
+async def service_response(func, *args, error_status: int = 400, **kwargs) -> FastJSONResponse:
+    """
+    Despacho comum dos endpoints de escrita: roda a função de serviço no threadpool e
+    devolve o dict dela; {"success": False, "error": ...} vira HTTPException(error_status)
+    """
+    result = await run_in_threadpool(func, *args, **kwargs)
+    if not result["success"]:
+        raise HTTPException(status_code=error_status, detail=result.get("error", "Erro desconhecido"))
+    return FastJSONResponse(content=result)
+
+
+# Extractor de PDF por tipo de cartão (módulo, função); também define os cartões válidos
+EXTRACTORS = {
+    "svb": ("extractors.svb", "extract_svb"),
+    "amex": ("extractors.amex", "extract_amex"),
+    "bradesco": ("extractors.bradesco", "extract_bradesco"),
+}
+VALID_CARDS = frozenset(EXTRACTORS)
+INVALID_CARD_DETAIL = f"Invalid card type. Use: {', '.join(EXTRACTORS)}"
+
+
+@functools.cache
+def get_extractor(card: str):
+    """Importa o extractor (e o pdfplumber) no primeiro PDF desse cartão"""
+    module_name, func_name = EXTRACTORS[card]
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+async def extract_with_cache(file: UploadFile, card: str, then=None):
+    """
+    Roda o extractor no upload, reaproveitando o resultado de um PDF idêntico já extraído.
+    Com `then`, retorna (result, then(result)): num cache miss a gravação do cache em disco
+    roda em paralelo com `then` (ex.: montar a planilha), em vez de antes dele.
+    """
+    digest = await run_in_threadpool(file_digest, file.file)
+    result = await run_in_threadpool(get_cached_extraction, card, digest)
+    if result is not None:
+        return result if then is None else (result, await run_cpu_bound(then, result))
+    
+    result = await run_cpu_bound(get_extractor(card), file.file)
+    store = run_in_threadpool(store_extraction, card, digest, result)
+    if then is None:
+        await store
+        return result
+    _, output = await asyncio.gather(store, run_cpu_bound(then, result))
+    return result, output
+
+
+def stream_json_list(key: str, rows, fields: dict):
+    """
+    Gera {**fields, key: [...], "total": n} em blocos de ~STREAM_CHUNK_SIZE: as linhas
+    são serializadas conforme `rows` avança, sem montar a lista nem o JSON inteiro em
+    memória. Um bloco por vez (e não por linha) evita um salto de thread e um envio
+    ASGI para cada linha.
+    """
+    head = orjson.dumps(fields, default=json_default, option=JSON_OPTIONS)
+    buffer = bytearray(head[:-1] + (b',"' if len(fields) else b'"') + key.encode() + b'":[')
+    count = 0
+    for row in rows:
+        if count:
+            buffer += b","
+        buffer += orjson.dumps(row, default=json_default, option=JSON_OPTIONS)
+        count += 1
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b'],"total":' + str(count).encode() + b"}"
+    yield bytes(buffer)
+
+
+async def json_list_response(key: str, rows, fields: dict) -> StreamingResponse:
+    """
+    StreamingResponse de stream_json_list com o primeiro bloco já montado (no threadpool):
+    listas de até um bloco saem inteiras, e erro na primeira página do BigQuery ainda
+    vira 500 em vez de um 200 com o JSON cortado.
+    """
+    chunks = stream_json_list(key, rows, fields)
+    first = await run_in_threadpool(next, chunks)
+    return StreamingResponse(itertools.chain((first,), chunks), media_type="application/json")
+
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def xlsx_response(output, filename: str) -> StreamingResponse:
+    """Envia a planilha em blocos de 64KB e fecha o arquivo depois da resposta"""
+    return StreamingResponse(
+        iter_file_chunks(output),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        background=BackgroundTask(output.close)
+    )
+
+
+# Respostas estáticas serializadas uma única vez
+ROOT_BODY = orjson.dumps({"message": "Expenses Portal API", "status": "running"})
+HEALTH_BODY = orjson.dumps({"status": "healthy"})
+# Tipos de funcionário e categorias do YTD são listas fixas no código
+EMPLOYEE_TYPES_BODY = orjson.dumps({"types": get_employee_types()})
+YTD_CATEGORIES_BODY = orjson.dumps({"categories": get_ytd_categories()})
+# Listas fixas no código só mudam a cada deploy
+STATIC_MAX_AGE = 3600
+# Dados do banco: o navegador sempre revalida, mas sem mudança recebe 304 sem corpo
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def etag_response(request: Request, body: bytes, cache_control: str) -> Response:
+    """JSON com ETag forte (hash do corpo); If-None-Match igual responde 304 sem corpo"""
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@functools.cache
+def categories_body() -> bytes:
+    """Lista de categorias serializada na primeira chamada (o categorizer importa o OpenAI)"""
+    from services.categorizer import EXPENSE_CATEGORIES
+    return orjson.dumps({"categories": EXPENSE_CATEGORIES})
+
 
 @app.get("/")
 def root():
-    return {"message": "Expenses Portal API", "status": "running"}
+    return Response(ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 def health():
-    return {"status": "healthy"}
+    return Response(HEALTH_BODY, media_type="application/json")
 
 
 @app.post("/extract")
@@ -134,35 +443,15 @@ async def extract_pdf(
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
     # Validate card type
-    valid_cards = ["svb", "amex", "bradesco"]
-    if card_type.lower() not in valid_cards:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Invalid card type. Use: {', '.join(valid_cards)}"
-        )
+    card = card_type.lower()
+    if card not in VALID_CARDS:
+        raise HTTPException(status_code=400, detail=INVALID_CARD_DETAIL)
     
     try:
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        # Extract data based on card type
-        card = card_type.lower()
-        if card == "svb":
-            result = extract_svb(tmp_path)
-        elif card == "amex":
-            result = extract_amex(tmp_path)
-        elif card == "bradesco":
-            result = extract_bradesco(tmp_path)
-        else:
-            raise HTTPException(status_code=400, detail="Card type not supported")
-        
-        # Remove temporary file
-        os.unlink(tmp_path)
+        # Extract data based on card type, reading the upload directly (no temp file)
+        result = await extract_with_cache(file, card)
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "filename": file.filename,
             "card_type": card_type,
@@ -171,15 +460,36 @@ async def extract_pdf(
             "transactions": result["transactions"]
         })
         
-    except Exception as e:
-        # Remove temporary file in case of error
-        if 'tmp_path' in locals():
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-        
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    except Exception:
+        raise server_error("Error processing PDF")
+
+
+def build_cardholder_workbook(result: dict):
+    """Builds the /export-excel workbook from an extraction result"""
+    # Group transactions by cardholder (object dtype keeps None as blank cells)
+    df = pd.DataFrame(result["transactions"], columns=["date", "description", "amount", "cardholder"], dtype=object)
+    df = df.where(df.notna(), None)
+    df["cardholder"] = df["cardholder"].fillna("Unknown")
+    by_cardholder = df.groupby("cardholder", sort=False)
+    
+    # Summary tab by user, then one tab per cardholder
+    amounts = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
+    totals = amounts.groupby(df["cardholder"], sort=False).agg(["size", "sum"])
+    summary_rows = list(zip(totals.index, totals["size"].tolist(), totals["sum"].round(2).tolist()))
+    
+    sheets = [("Summary", ("Cardholder", "Total Transactions", "Total Amount (USD)"), summary_rows,
+               ("string", "number", "number"))]
+    for holder, txs in by_cardholder:
+        # Limit sheet name to 31 characters
+        sheet_name = holder[:31] if holder else "Unknown"
+        sheets.append((
+            sheet_name,
+            ("Date", "Description", "Amount (USD)"),
+            txs[["date", "description", "amount"]].itertuples(index=False, name=None),
+            ("string", "string", "number")
+        ))
+    
+    return build_workbook(sheets)
 
 
 @app.post("/export-excel")
@@ -194,87 +504,19 @@ async def export_excel(
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
-    valid_cards = ["svb", "amex", "bradesco"]
-    if card_type.lower() not in valid_cards:
-        raise HTTPException(status_code=400, detail=f"Invalid card type")
+    card = card_type.lower()
+    if card not in VALID_CARDS:
+        raise HTTPException(status_code=400, detail=INVALID_CARD_DETAIL)
     
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        card = card_type.lower()
-        if card == "svb":
-            result = extract_svb(tmp_path)
-        elif card == "amex":
-            result = extract_amex(tmp_path)
-        elif card == "bradesco":
-            result = extract_bradesco(tmp_path)
-        
-        os.unlink(tmp_path)
-        
-        # Group transactions by cardholder
-        by_cardholder = {}
-        for tx in result["transactions"]:
-            holder = tx.get("cardholder", "Unknown")
-            if holder not in by_cardholder:
-                by_cardholder[holder] = []
-            by_cardholder[holder].append(tx)
-        
-        # Create Excel in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Summary tab by user
-            summary_data = []
-            for holder, txs in by_cardholder.items():
-                total = sum(tx.get("amount") or 0 for tx in txs)
-                summary_data.append({
-                    "Cardholder": holder,
-                    "Total Transactions": len(txs),
-                    "Total Amount (USD)": round(total, 2)
-                })
-            
-            df_summary = pd.DataFrame(summary_data)
-            df_summary.to_excel(writer, sheet_name="Summary", index=False)
-            
-            # One tab per cardholder
-            for holder, txs in by_cardholder.items():
-                df = pd.DataFrame(txs)
-                
-                # Select and rename columns
-                columns_map = {
-                    "date": "Date",
-                    "description": "Description", 
-                    "amount": "Amount (USD)"
-                }
-                
-                df_export = pd.DataFrame()
-                for old_col, new_col in columns_map.items():
-                    if old_col in df.columns:
-                        df_export[new_col] = df[old_col]
-                
-                # Limit sheet name to 31 characters
-                sheet_name = holder[:31] if holder else "Unknown"
-                df_export.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        output.seek(0)
+        result, output = await extract_with_cache(file, card, then=build_cardholder_workbook)
         
         filename = file.filename.replace('.pdf', '_by_user.xlsx')
         
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return xlsx_response(output, filename)
         
-    except Exception as e:
-        if 'tmp_path' in locals():
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-        raise HTTPException(status_code=500, detail=f"Error generating Excel: {str(e)}")
+    except Exception:
+        raise server_error("Error generating Excel")
 
 
 # Pydantic models for categorization
@@ -311,36 +553,48 @@ class MichaelCategorizeRequest(BaseModel):
     transactions: List[MichaelTransaction]
 
 
-@app.post("/categorize", response_model=CategorizeResponse)
-async def categorize_expenses(request: CategorizeRequest):
+# Schema só documentado: a resposta sai direto, sem revalidar a lista de transações
+@app.post("/categorize", responses={200: {"model": CategorizeResponse}})
+async def categorize_expenses(request: CategorizeRequest = Depends(json_body(CategorizeRequest))):
     """
     Categorize transactions using AI.
     
     - **transactions**: List of transactions with description field
     """
     try:
-        # Convert to list of dicts
-        transactions_list = [tx.model_dump() for tx in request.transactions]
+        # Models are flat: reuse each instance's field dict instead of re-serializing with model_dump
+        transactions_list = [vars(tx) for tx in request.transactions]
         
-        # Categorize using OpenAI
-        categorized = categorize_transactions(transactions_list)
+        from services.categorizer import categorize_transactions_async, EXPENSE_CATEGORIES
         
-        return CategorizeResponse(
-            success=True,
-            transactions=categorized,
-            categories=EXPENSE_CATEGORIES
-        )
+        # Same transactions categorized in the last minutes: reuse the result
+        cache_key = transactions_key(request.transactions)
+        cached = get_cached_categories(cache_key)
+        if cached is not None:
+            for tx, category in zip(transactions_list, cached):
+                tx["ai_category"] = category
+            categorized = transactions_list
+        else:
+            # Categorize using OpenAI
+            categorized = await categorize_transactions_async(transactions_list)
+            store_categories(cache_key, [tx.get("ai_category") for tx in categorized])
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error categorizing: {str(e)}")
+        return FastJSONResponse(content={
+            "success": True,
+            "transactions": categorized,
+            "categories": EXPENSE_CATEGORIES
+        })
+        
+    except Exception:
+        raise server_error("Error categorizing")
 
 
 @app.get("/categories")
-async def get_categories():
+async def get_categories(request: Request):
     """
     Get list of available expense categories.
     """
-    return {"categories": EXPENSE_CATEGORIES}
+    return etag_response(request, categories_body(), f"public, max-age={STATIC_MAX_AGE}")
 
 
 # Model for export with categories
@@ -357,83 +611,71 @@ class ExportWithCategoriesRequest(BaseModel):
 
 
 @app.post("/export-excel-with-categories")
-async def export_excel_with_categories(request: ExportWithCategoriesRequest):
+async def export_excel_with_categories(
+    request: ExportWithCategoriesRequest = Depends(json_body(ExportWithCategoriesRequest))
+):
     """
     Export transactions to Excel with AI categories included.
     Creates tabs per user and includes the AI category column.
     """
     try:
-        transactions_list = [tx.model_dump() for tx in request.transactions]
-        
-        # Group transactions by cardholder
-        by_cardholder = {}
-        for tx in transactions_list:
-            holder = tx.get("cardholder") or "Unknown"
-            if holder not in by_cardholder:
-                by_cardholder[holder] = []
-            by_cardholder[holder].append(tx)
-        
-        # Create Excel in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Summary tab by user
-            summary_data = []
-            for holder, txs in by_cardholder.items():
-                total = sum(tx.get("amount") or 0 for tx in txs)
-                categorized_count = len([tx for tx in txs if tx.get("ai_category")])
-                summary_data.append({
-                    "Cardholder": holder,
-                    "Total Transactions": len(txs),
-                    "Categorized": categorized_count,
-                    "Total Amount (USD)": round(total, 2)
-                })
-            
-            df_summary = pd.DataFrame(summary_data)
-            df_summary.to_excel(writer, sheet_name="Summary", index=False)
-            
+        # Build the frame column by column straight from the models (no per-row dicts)
+        columns = ["date", "description", "cardholder", "ai_category", "amount"]
+        data = {col: [getattr(tx, col) for tx in request.transactions] for col in columns}
+        # Fill categories left blank with the ones /categorize just produced for these transactions
+        if not all(data["ai_category"]):
+            cached = get_cached_categories(transactions_key(request.transactions))
+            if cached is not None:
+                data["ai_category"] = [value or category for value, category in zip(data["ai_category"], cached)]
+        # Cardholders and categories repeat across rows: intern them so each distinct value is
+        # one object, hashed once for the groupby and the workbook's shared-string table
+        for col in ("cardholder", "ai_category"):
+            data[col] = [sys.intern(value) if value else value for value in data[col]]
+        df = pd.DataFrame(data, columns=columns, dtype=object)
+        
+        # Group transactions by cardholder (object dtype keeps None as blank cells)
+        df = df.where(df.notna(), None)
+        holders = df["cardholder"].where(df["cardholder"].astype(bool), "Unknown")
+        by_cardholder = df.groupby(holders, sort=False)
+        
+        # Summary tab by user
+        totals = pd.DataFrame({
+            "amount": pd.to_numeric(df["amount"], errors="coerce").fillna(0),
+            "categorized": df["ai_category"].astype(bool),
+        }).groupby(holders, sort=False).agg(
+            count=("amount", "size"), categorized=("categorized", "sum"), total=("amount", "sum")
+        )
+        summary_rows = list(zip(
+            totals.index, totals["count"].tolist(), totals["categorized"].tolist(), totals["total"].round(2).tolist()
+        ))
+        
+        sheets = [
+            ("Summary", ("Cardholder", "Total Transactions", "Categorized", "Total Amount (USD)"), summary_rows,
+             ("string", "number", "number", "number")),
             # All transactions tab with categories
-            all_data = []
-            for tx in transactions_list:
-                all_data.append({
-                    "Date": tx.get("date", ""),
-                    "Description": tx.get("description", ""),
-                    "Cardholder": tx.get("cardholder", ""),
-                    "Category": tx.get("ai_category", ""),
-                    "Amount (USD)": tx.get("amount", 0)
-                })
-            
-            df_all = pd.DataFrame(all_data)
-            df_all.to_excel(writer, sheet_name="All Transactions", index=False)
-            
-            # One tab per cardholder
-            for holder, txs in by_cardholder.items():
-                data = []
-                for tx in txs:
-                    data.append({
-                        "Date": tx.get("date", ""),
-                        "Description": tx.get("description", ""),
-                        "Category": tx.get("ai_category", ""),
-                        "Amount (USD)": tx.get("amount", 0)
-                    })
-                
-                df = pd.DataFrame(data)
-                
-                # Limit sheet name to 31 characters
-                sheet_name = holder[:31] if holder else "Unknown"
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        output.seek(0)
+            ("All Transactions", ("Date", "Description", "Cardholder", "Category", "Amount (USD)"),
+             df.itertuples(index=False, name=None), ("string", "string", "string", "string", "number")),
+        ]
+        
+        # One tab per cardholder
+        for holder, txs in by_cardholder:
+            # Limit sheet name to 31 characters
+            sheet_name = holder[:31] if holder else "Unknown"
+            sheets.append((
+                sheet_name,
+                ("Date", "Description", "Category", "Amount (USD)"),
+                txs[["date", "description", "ai_category", "amount"]].itertuples(index=False, name=None),
+                ("string", "string", "string", "number")
+            ))
+        
+        output = await run_cpu_bound(build_workbook, sheets)
         
         filename = f"{request.filename}_with_categories.xlsx"
         
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return xlsx_response(output, filename)
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating Excel: {str(e)}")
+    except Exception:
+        raise server_error("Error generating Excel")
 
 
 # ==================== RIPPLING ENDPOINTS ====================
@@ -449,10 +691,10 @@ async def process_rippling(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV ou Excel (.xlsx/.xls)")
     
     try:
-        content = await file.read()
-        result = process_rippling_file(content, file.filename)
+        from services.rippling import process_rippling_file
+        result = await run_cpu_bound(process_rippling_file, file.file, file.filename)
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "filename": file.filename,
             **result
@@ -460,8 +702,8 @@ async def process_rippling(file: UploadFile = File(...)):
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao processar arquivo")
 
 
 @app.post("/rippling/export")
@@ -474,23 +716,17 @@ async def export_rippling(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV ou Excel (.xlsx/.xls)")
     
     try:
-        content = await file.read()
-        data = process_rippling_file(content, file.filename)
-        excel_content = export_rippling_to_excel(data)
-        
-        output = BytesIO(excel_content)
+        from services.rippling import process_rippling_file, export_rippling_to_excel
+        data = await run_cpu_bound(process_rippling_file, file.file, file.filename)
+        output = await run_cpu_bound(export_rippling_to_excel, data)
         export_filename = file.filename.rsplit('.', 1)[0] + '_report.xlsx'
         
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={export_filename}"}
-        )
+        return xlsx_response(output, export_filename)
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar Excel: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao gerar Excel")
 
 
 # ==================== MICHAEL CREDIT CARD ENDPOINTS ====================
@@ -505,10 +741,10 @@ async def process_michael(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV ou Excel (.xlsx/.xls)")
     
     try:
-        content = await file.read()
-        result = process_michael_file(content, file.filename)
+        from services.michael import process_michael_file
+        result = await run_cpu_bound(process_michael_file, file.file, file.filename)
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "filename": file.filename,
             **result
@@ -516,51 +752,51 @@ async def process_michael(file: UploadFile = File(...)):
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao processar arquivo")
 
 
 @app.post("/michael/categorize")
-async def categorize_michael(request: MichaelCategorizeRequest):
+async def categorize_michael(request: MichaelCategorizeRequest = Depends(json_body(MichaelCategorizeRequest))):
     """
     Categoriza transações do Michael usando AI.
     """
     try:
-        transactions = [t.model_dump() for t in request.transactions]
-        print(f"[DEBUG] Received {len(transactions)} transactions for categorization")
-        if transactions:
-            print(f"[DEBUG] First tx: extended_details[:50]='{transactions[0].get('extended_details', '')[:50] if transactions[0].get('extended_details') else ''}', amex_category='{transactions[0].get('amex_category', '')}'")
+        # Modelos planos: usa o dict de campos de cada um, sem model_dump
+        transactions = [vars(t) for t in request.transactions]
+        if transactions and logger.isEnabledFor(logging.DEBUG):
+            first = transactions[0]
+            logger.debug(
+                "Received %d transactions for categorization; first tx: extended_details='%.50s', amex_category='%s'",
+                len(transactions), first.get('extended_details') or '', first.get('amex_category') or ''
+            )
         
-        categorized = categorize_michael_transactions(transactions)
+        from services.michael import categorize_michael_transactions_async
+        categorized = await categorize_michael_transactions_async(transactions)
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "transactions": categorized
         })
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao categorizar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao categorizar")
 
 
 @app.post("/michael/export")
-async def export_michael(request: MichaelCategorizeRequest):
+async def export_michael(request: MichaelCategorizeRequest = Depends(json_body(MichaelCategorizeRequest))):
     """
     Exporta transações categorizadas do Michael para Excel.
     """
     try:
-        transactions = [t.model_dump() for t in request.transactions]
-        excel_content = export_michael_to_excel(transactions)
+        transactions = [vars(t) for t in request.transactions]
+        from services.michael import export_michael_to_excel
+        output = await run_cpu_bound(export_michael_to_excel, transactions)
         
-        output = BytesIO(excel_content)
+        return xlsx_response(output, "michael_categorized.xlsx")
         
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=michael_categorized.xlsx"}
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar Excel: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao gerar Excel")
 
 
 # =====================================================
@@ -589,75 +825,83 @@ class MichaelExpensesBatchInput(BaseModel):
 async def get_michael_expenses_endpoint(year: int = None, limit: int = 1000):
     """Get all Michael expenses."""
     try:
+        from services.michael import get_michael_expenses
         expenses = get_michael_expenses(year=year, limit=limit)
-        return {"expenses": expenses, "count": len(expenses)}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content={"expenses": expenses, "count": len(expenses)})
+    except Exception:
+        raise server_error("Error fetching expenses")
 
 @app.get("/michael-expenses/batches")
 async def get_michael_batches_endpoint():
     """Get all Michael expense batches."""
     try:
+        from services.michael import get_michael_batches
         batches = get_michael_batches()
-        return {"batches": batches}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content={"batches": batches})
+    except Exception:
+        raise server_error("Error fetching batches")
 
 @app.get("/michael-expenses/summary")
 async def get_michael_summary_endpoint(year: int = None):
     """Get Michael expenses summary."""
     try:
+        from services.michael import get_michael_summary
         summary = get_michael_summary(year=year)
-        return summary
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=summary)
+    except Exception:
+        raise server_error("Error fetching summary")
 
 @app.post("/michael-expenses")
-async def add_michael_expenses_endpoint(data: MichaelExpensesBatchInput):
+async def add_michael_expenses_endpoint(data: MichaelExpensesBatchInput = Depends(json_body(MichaelExpensesBatchInput))):
     """Add batch of Michael expenses."""
     try:
-        expenses = [exp.model_dump() for exp in data.expenses]
+        expenses = [vars(exp) for exp in data.expenses]
+        from services.michael import add_michael_expenses_to_db
         result = add_michael_expenses_to_db(expenses)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Error adding expenses")
 
 @app.put("/michael-expenses/{expense_id}")
 async def update_michael_expense_endpoint(expense_id: str, updates: MichaelExpenseUpdate):
     """Update a Michael expense."""
     try:
         updates_dict = {k: v for k, v in updates.model_dump().items() if v is not None}
+        from services.michael import update_michael_expense
         result = update_michael_expense(expense_id, updates_dict)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Error updating expense")
 
 @app.delete("/michael-expenses/{expense_id}")
 async def delete_michael_expense_endpoint(expense_id: str):
     """Delete a Michael expense."""
     try:
+        from services.michael import delete_michael_expense
         result = delete_michael_expense(expense_id)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Error deleting expense")
 
 @app.delete("/michael-expenses/batches/{batch_id}")
 async def delete_michael_batch_endpoint(batch_id: str):
     """Delete a Michael expense batch."""
     try:
+        from services.michael import delete_michael_batch
         result = delete_michael_batch(batch_id)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Error deleting batch")
 
 @app.post("/michael-expenses/sync")
 async def sync_michael_to_valor_endpoint(expense_ids: Optional[List[str]] = None):
     """Sync Michael expenses to consolidated expenses."""
     try:
+        from services.michael import sync_michael_to_valor
         result = sync_michael_to_valor(expense_ids)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Error syncing to valor")
 
 
 # =====================================================
@@ -671,11 +915,11 @@ async def uber_preview(file: UploadFile = File(...)):
     Compara com a base existente no BigQuery.
     """
     try:
-        content = await file.read()
-        result = process_uber_csv(content, file.filename)
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar CSV: {str(e)}")
+        from services.uber import process_uber_csv
+        result = await run_cpu_bound(process_uber_csv, file.file, file.filename)
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Erro ao processar CSV")
 
 
 @app.post("/uber/upload")
@@ -687,7 +931,6 @@ async def uber_upload(file: UploadFile = File(...), projects: str = Form(default
     """
     try:
         import json
-        content = await file.read()
         
         # Parse projects JSON
         projects_map = {}
@@ -696,10 +939,11 @@ async def uber_upload(file: UploadFile = File(...), projects: str = Form(default
         except json.JSONDecodeError:
             projects_map = {}
         
-        result = upload_new_rows_to_bigquery(content, projects_map)
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao fazer upload: {str(e)}")
+        from services.uber import upload_new_rows_to_bigquery
+        result = await run_in_threadpool(upload_new_rows_to_bigquery, file.file, projects_map)
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Erro ao fazer upload")
 
 
 @app.get("/uber/dashboard")
@@ -708,10 +952,11 @@ async def uber_dashboard():
     Retorna dados agregados para o dashboard do Uber.
     """
     try:
-        result = get_uber_dashboard_data()
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar dados: {str(e)}")
+        from services.uber import get_uber_dashboard_data
+        result = await run_in_threadpool(get_uber_dashboard_data)
+        return FastJSONResponse(content=result)
+    except Exception:
+        raise server_error("Erro ao buscar dados")
 
 
 class UberExpenseUpdate(BaseModel):
@@ -740,13 +985,13 @@ async def update_uber_expense_endpoint(trip_id: str, updates: UberExpenseUpdate)
         result = update_uber_expense(trip_id, updates_dict)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("errors", "Erro desconhecido"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao atualizar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao atualizar")
 
 
 @app.delete("/uber/expense/{trip_id}")
@@ -758,13 +1003,13 @@ async def delete_uber_expense_endpoint(trip_id: str):
         result = delete_uber_expense(trip_id)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("errors", "Erro desconhecido"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao deletar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao deletar")
 
 
 class UberExpensesBatchDelete(BaseModel):
@@ -780,13 +1025,13 @@ async def delete_uber_expenses_batch_endpoint(request: UberExpensesBatchDelete):
         result = delete_uber_expenses_batch(request.trip_ids)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("errors", "Erro desconhecido"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao deletar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao deletar")
 
 
 @app.post("/uber/sync-to-valor")
@@ -798,118 +1043,96 @@ async def resync_uber_to_valor_endpoint():
         result = resync_all_uber_to_valor()
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("error", "Erro desconhecido"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao sincronizar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao sincronizar")
 
 
 # =====================================================
 # RIPPLING EMPLOYEES ENDPOINTS
 # =====================================================
 
+# Modelos só de entrada: campos extras ignorados, instâncias imutáveis
+INPUT_MODEL_CONFIG = ConfigDict(extra="ignore", frozen=True)
+
+
 class EmployeeCreate(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     rippling_name: str
     display_name: str
-    employee_type: str
+    employee_type: EmployeeType
 
 class EmployeeUpdate(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     rippling_name: Optional[str] = None
     display_name: Optional[str] = None
-    employee_type: Optional[str] = None
+    employee_type: Optional[EmployeeType] = None
 
 
 @app.get("/rippling/employees")
-async def list_employees():
-    """Lista todos os mapeamentos de funcionários"""
-    try:
-        employees = get_all_employees()
-        return JSONResponse(content={
-            "success": True,
-            "employees": employees,
-            "total": len(employees)
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar funcionários: {str(e)}")
+async def list_employees(limit: Optional[int] = None, offset: int = 0):
+    """Lista os mapeamentos de funcionários (todos, ou uma página com limit/offset)"""
+    employees, total = await run_in_threadpool(get_all_employees, limit, offset)
+    return FastJSONResponse(content={
+        "success": True,
+        "employees": employees,
+        "total": total,
+        "limit": limit,
+        "offset": offset
+    })
 
 
 @app.get("/rippling/employees/unique")
-async def list_unique_employees():
+async def list_unique_employees(request: Request):
     """Lista funcionários únicos (agrupados por display_name)"""
-    try:
-        employees = get_unique_display_names()
-        return JSONResponse(content={
-            "success": True,
-            "employees": employees,
-            "total": len(employees)
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar funcionários: {str(e)}")
+    employees = await run_in_threadpool(get_unique_display_names)
+    body = orjson.dumps({
+        "success": True,
+        "employees": employees,
+        "total": len(employees)
+    }, default=json_default, option=JSON_OPTIONS)
+    return etag_response(request, body, REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/rippling/employees/types")
-async def list_employee_types():
+async def list_employee_types(request: Request):
     """Lista tipos de funcionários válidos"""
-    return JSONResponse(content={
-        "types": get_employee_types()
-    })
+    return etag_response(request, EMPLOYEE_TYPES_BODY, f"public, max-age={STATIC_MAX_AGE}")
 
 
 @app.post("/rippling/employees")
 async def create_employee(employee: EmployeeCreate):
     """Adiciona um novo mapeamento de funcionário"""
-    try:
-        result = add_employee(
-            rippling_name=employee.rippling_name,
-            display_name=employee.display_name,
-            employee_type=employee.employee_type
-        )
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result["error"])
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao adicionar funcionário: {str(e)}")
+    return await service_response(
+        add_employee,
+        rippling_name=employee.rippling_name,
+        display_name=employee.display_name,
+        employee_type=employee.employee_type
+    )
 
 
 @app.put("/rippling/employees/{employee_id}")
 async def update_employee_endpoint(employee_id: str, employee: EmployeeUpdate):
     """Atualiza um mapeamento existente"""
-    try:
-        result = update_employee(
-            id=employee_id,
-            rippling_name=employee.rippling_name,
-            display_name=employee.display_name,
-            employee_type=employee.employee_type
-        )
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result["error"])
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao atualizar funcionário: {str(e)}")
+    return await service_response(
+        update_employee,
+        id=employee_id,
+        rippling_name=employee.rippling_name,
+        display_name=employee.display_name,
+        employee_type=employee.employee_type
+    )
 
 
 @app.delete("/rippling/employees/{employee_id}")
 async def delete_employee_endpoint(employee_id: str):
     """Remove um mapeamento de funcionário"""
-    try:
-        result = delete_employee(employee_id)
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result["error"])
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao remover funcionário: {str(e)}")
+    return await service_response(delete_employee, employee_id)
 
 
 # =====================================================
@@ -917,125 +1140,104 @@ async def delete_employee_endpoint(employee_id: str):
 # =====================================================
 
 @app.get("/expenses/ytd")
-async def list_expenses_ytd(year: int = None):
-    """Lista todas as despesas YTD por funcionário"""
-    try:
-        expenses = get_ytd_expenses(year)
-        return JSONResponse(content={
-            "success": True,
-            "expenses": expenses,
-            "total": len(expenses),
-            "year": year
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar despesas: {str(e)}")
+async def list_expenses_ytd(
+    year: int = None, limit: Optional[int] = None, offset: int = 0
+):
+    """Lista as despesas YTD por funcionário (todas, ou uma página com limit/offset)"""
+    if limit is None:
+        # Lista completa: a consulta roda antes (erro vira 500) e as linhas vão em blocos
+        rows = await run_in_threadpool(iter_ytd_expenses, year)
+        return await json_list_response(
+            "expenses", rows, {"success": True, "year": year, "limit": None, "offset": offset}
+        )
+    expenses, total = await run_in_threadpool(get_ytd_expenses, year, limit, offset)
+    return FastJSONResponse(content={
+        "success": True,
+        "expenses": expenses,
+        "total": total,
+        "year": year,
+        "limit": limit,
+        "offset": offset
+    })
 
 
 @app.get("/expenses/ytd/summary")
 async def get_expenses_ytd_summary(year: int = None):
     """Retorna resumo consolidado das despesas"""
-    try:
-        summary = get_ytd_summary(year)
-        return JSONResponse(content={
-            "success": True,
-            "summary": summary,
-            "year": year
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar resumo: {str(e)}")
+    summary = await run_in_threadpool(get_ytd_summary, year)
+    return FastJSONResponse(content={
+        "success": True,
+        "summary": summary,
+        "year": year
+    })
 
 
 @app.get("/expenses/ytd/by-type")
 async def get_expenses_ytd_by_type(year: int = None):
     """Retorna despesas agrupadas por tipo de funcionário"""
-    try:
-        by_type = get_ytd_by_type(year)
-        return JSONResponse(content={
-            "success": True,
-            "by_type": by_type,
-            "year": year
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar por tipo: {str(e)}")
+    by_type = await run_in_threadpool(get_ytd_by_type, year)
+    return FastJSONResponse(content={
+        "success": True,
+        "by_type": by_type,
+        "year": year
+    })
+
+
+@app.get("/expenses/ytd/bundle")
+async def get_expenses_ytd_bundle(year: int = None):
+    """
+    Despesas, resumo, por tipo, categorias e anos numa única chamada
+    (uma consulta ao BigQuery em vez das quatro dos endpoints separados)
+    """
+    bundle = await run_in_threadpool(get_ytd_bundle, year)
+    return FastJSONResponse(content={
+        "success": True,
+        **bundle,
+        "total": len(bundle["expenses"]),
+        "year": year
+    })
 
 
 @app.get("/expenses/ytd/categories")
-async def get_expense_categories_list():
+async def get_expense_categories_list(request: Request):
     """Retorna lista de categorias de despesas"""
-    return JSONResponse(content={
-        "categories": get_ytd_categories()
-    })
+    return etag_response(request, YTD_CATEGORIES_BODY, f"public, max-age={STATIC_MAX_AGE}")
 
 
 @app.get("/expenses/ytd/years")
-async def get_expense_years():
+async def get_expense_years(request: Request):
     """Retorna lista de anos disponíveis"""
-    return JSONResponse(content={
-        "years": get_ytd_years()
-    })
+    body = orjson.dumps({"years": await run_in_threadpool(get_ytd_years)})
+    return etag_response(request, body, REVALIDATE_CACHE_CONTROL)
 
 
 class ConsolidatedExpenseTransaction(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     employee_name: str
     category: str
     amount: float
 
 
 class AddToConsolidatedRequest(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     transactions: List[ConsolidatedExpenseTransaction]
     year: int
 
 
 @app.post("/expenses/ytd/add")
-async def add_to_consolidated(request: AddToConsolidatedRequest):
+async def add_to_consolidated(request: AddToConsolidatedRequest = Depends(json_body(AddToConsolidatedRequest))):
     """Adiciona transações categorizadas ao banco consolidado"""
-    try:
-        # Converter para formato esperado pela função
-        transactions = [
-            {
-                "employee_name": t.employee_name,
-                "category": t.category,
-                "amount": t.amount
-            }
-            for t in request.transactions
-        ]
-        
-        result = add_expenses_to_consolidated(transactions, request.year)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Erro desconhecido"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao adicionar despesas: {str(e)}")
+    # O serviço lê employee_name/category/amount direto dos modelos (sem cópia em dicts)
+    return await service_response(add_expenses_to_consolidated, request.transactions, request.year, error_status=500)
 
 
 @app.post("/expenses/ytd/undo")
-async def undo_from_consolidated(request: AddToConsolidatedRequest):
+async def undo_from_consolidated(request: AddToConsolidatedRequest = Depends(json_body(AddToConsolidatedRequest))):
     """Desfaz/subtrai transações do banco consolidado (undo)"""
-    try:
-        # Converter para formato esperado pela função
-        transactions = [
-            {
-                "employee_name": t.employee_name,
-                "category": t.category,
-                "amount": t.amount
-            }
-            for t in request.transactions
-        ]
-        
-        result = undo_expenses_from_consolidated(transactions, request.year)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Erro desconhecido"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao desfazer despesas: {str(e)}")
+    # O serviço lê employee_name/category/amount direto dos modelos (sem cópia em dicts)
+    return await service_response(undo_expenses_from_consolidated, request.transactions, request.year, error_status=500)
 
 
 # =====================================================
@@ -1053,100 +1255,73 @@ async def list_valor_expenses(
     limit: int = 5000
 ):
     """List all expenses from valor_expenses table with optional filters"""
-    try:
-        expenses = get_valor_expenses(year=year, month=month, name=name, category=category, 
-                                       start_date=start_date, end_date=end_date, limit=limit)
-        return JSONResponse(content={
-            "success": True,
-            "expenses": expenses,
-            "total": len(expenses)
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching expenses: {str(e)}")
+    # A consulta roda antes (erro vira 500) e as linhas vão sendo enviadas
+    rows = await run_in_threadpool(
+        iter_valor_expenses, year=year, month=month, name=name, category=category,
+        start_date=start_date, end_date=end_date, limit=limit
+    )
+    return await json_list_response("expenses", rows, {"success": True})
 
 
 @app.get("/valor-expenses/by-employee")
 async def list_valor_by_employee(year: int = None, start_date: str = None, end_date: str = None):
     """Get expenses aggregated by employee and category (for pivot table view)"""
-    try:
-        expenses = get_valor_by_employee(year=year, start_date=start_date, end_date=end_date)
-        return JSONResponse(content={
-            "success": True,
-            "expenses": expenses,
-            "total": len(expenses)
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching expenses by employee: {str(e)}")
+    rows = await run_in_threadpool(iter_valor_by_employee, year=year, start_date=start_date, end_date=end_date)
+    return await json_list_response("expenses", rows, {"success": True})
 
 
 @app.get("/valor-expenses/summary")
 async def get_valor_expenses_summary(year: int = None):
     """Get summary statistics"""
-    try:
-        summary = get_valor_summary(year=year)
-        return JSONResponse(content={
-            "success": True,
-            "summary": summary
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching summary: {str(e)}")
+    summary = await run_in_threadpool(get_valor_summary, year=year)
+    return FastJSONResponse(content={
+        "success": True,
+        "summary": summary
+    })
 
 
 @app.get("/valor-expenses/years")
-async def get_valor_expense_years():
+async def get_valor_expense_years(request: Request):
     """Get list of available years"""
-    try:
-        years = get_valor_years()
-        return JSONResponse(content={"years": years})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching years: {str(e)}")
+    years = await run_in_threadpool(get_valor_years)
+    return etag_response(request, orjson.dumps({"years": years}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/valor-expenses/categories")
-async def get_valor_expense_categories():
+async def get_valor_expense_categories(request: Request):
     """Get list of unique categories"""
-    try:
-        categories = get_valor_categories()
-        return JSONResponse(content={"categories": categories})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
+    categories = await run_in_threadpool(get_valor_categories)
+    return etag_response(request, orjson.dumps({"categories": categories}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/valor-expenses/names")
-async def get_valor_expense_names():
+async def get_valor_expense_names(request: Request):
     """Get list of unique employee names"""
-    try:
-        names = get_valor_names()
-        return JSONResponse(content={"names": names})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching names: {str(e)}")
+    names = await run_in_threadpool(get_valor_names)
+    return etag_response(request, orjson.dumps({"names": names}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/valor-expenses/vendors")
-async def get_valor_expense_vendors():
+async def get_valor_expense_vendors(request: Request):
     """Get list of unique vendors"""
-    try:
-        vendors = get_valor_vendors()
-        return JSONResponse(content={"vendors": vendors})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching vendors: {str(e)}")
+    vendors = await run_in_threadpool(get_valor_vendors)
+    return etag_response(request, orjson.dumps({"vendors": vendors}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/valor-expenses/monthly/{year}")
 async def get_valor_monthly_breakdown(year: int, name: str = None):
     """Get monthly breakdown of expenses"""
-    try:
-        monthly = get_valor_monthly(year=year, name=name)
-        return JSONResponse(content={
-            "success": True,
-            "monthly": monthly,
-            "year": year
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching monthly breakdown: {str(e)}")
+    monthly = await run_in_threadpool(get_valor_monthly, year=year, name=name)
+    return FastJSONResponse(content={
+        "success": True,
+        "monthly": monthly,
+        "year": year
+    })
 
 
 class ValorExpenseItem(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     name: str
     amount: float
     category: str
@@ -1155,43 +1330,27 @@ class ValorExpenseItem(BaseModel):
 
 
 class AddValorExpensesRequest(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     expenses: List[ValorExpenseItem]
 
 
 @app.post("/valor-expenses")
-async def add_valor_expense_items(request: AddValorExpensesRequest):
+async def add_valor_expense_items(request: AddValorExpensesRequest = Depends(json_body(AddValorExpensesRequest))):
     """Add new expenses to valor_expenses table"""
-    try:
-        expenses = [exp.dict() for exp in request.expenses]
-        result = add_valor_expenses(expenses)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding expenses: {str(e)}")
+    expenses = request.model_dump()["expenses"]
+    return await service_response(add_valor_expenses, expenses, error_status=500)
 
 
 @app.delete("/valor-expenses/{expense_id}")
 async def delete_valor_expense_item(expense_id: str):
     """Delete a single expense by ID"""
-    try:
-        result = delete_valor_expense(expense_id)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expense: {str(e)}")
+    return await service_response(delete_valor_expense, expense_id, error_status=500)
 
 
 class ValorExpenseUpdate(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     name: Optional[str] = None
     amount: Optional[float] = None
     category: Optional[str] = None
@@ -1202,24 +1361,14 @@ class ValorExpenseUpdate(BaseModel):
 @app.put("/valor-expenses/{expense_id}")
 async def update_valor_expense_item(expense_id: str, updates: ValorExpenseUpdate):
     """Update a valor expense by ID"""
-    try:
-        from services.valor_expenses import update_expense
-        
-        updates_dict = {k: v for k, v in updates.model_dump().items() if v is not None}
+    from services.valor_expenses import update_expense
         
-        if not updates_dict:
-            raise HTTPException(status_code=400, detail="No fields to update")
+    updates_dict = {k: v for k, v in updates.model_dump().items() if v is not None}
         
-        result = update_expense(expense_id, updates_dict)
+    if not updates_dict:
+        raise HTTPException(status_code=400, detail="No fields to update")
         
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating expense: {str(e)}")
+    return await service_response(update_expense, expense_id, updates_dict, error_status=500)
 
 
 class ValorExpensesBatchDelete(BaseModel):
@@ -1229,123 +1378,89 @@ class ValorExpensesBatchDelete(BaseModel):
 @app.post("/valor-expenses/delete-batch")
 async def delete_valor_expenses_batch(request: ValorExpensesBatchDelete):
     """Delete multiple valor expenses by IDs in a single query"""
-    try:
-        from services.valor_expenses import delete_expenses_batch
-        
-        result = delete_expenses_batch(request.expense_ids)
+    from services.valor_expenses import delete_expenses_batch
         
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expenses: {str(e)}")
+    return await service_response(delete_expenses_batch, request.expense_ids, error_status=500)
 
 
 # ==================== CREDIT CARD EXPENSES (Intermediate Table) ====================
 
 class CreditCardTransaction(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     employee_name: str
     category: str
     amount: float
-    description: Optional[str] = None
-    transaction_date: Optional[str] = None
+    description: Optional[str] = ""
+    transaction_date: Optional[str] = ""
+
+    @field_validator("description", "transaction_date", mode="before")
+    @classmethod
+    def _none_as_empty(cls, value):
+        return value or ""
 
 
 class AddCreditCardRequest(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     transactions: List[CreditCardTransaction]
     year: int
     source: str = "AMEX"
 
 
 @app.post("/credit-card/expenses")
-async def add_cc_expenses(request: AddCreditCardRequest):
+async def add_cc_expenses(request: AddCreditCardRequest = Depends(json_body(AddCreditCardRequest))):
     """Add credit card expenses to intermediate table and sync to consolidated"""
-    try:
-        transactions = [
-            {
-                "employee_name": t.employee_name,
-                "category": t.category,
-                "amount": t.amount,
-                "description": t.description or "",
-                "transaction_date": t.transaction_date or ""
-            }
-            for t in request.transactions
-        ]
+    transactions = request.model_dump()["transactions"]
         
-        result = add_credit_card_expenses(transactions, request.year, request.source)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding expenses: {str(e)}")
+    return await service_response(add_credit_card_expenses, transactions, request.year, request.source, error_status=500)
 
 
 @app.get("/credit-card/expenses")
 async def get_cc_expenses(year: Optional[int] = None, batch_id: Optional[str] = None):
     """Get credit card expenses from intermediate table"""
-    try:
-        result = get_credit_card_expenses(year, batch_id)
-        expenses = result.get("expenses", []) if isinstance(result, dict) else result
-        return JSONResponse(content={"success": True, "expenses": expenses})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching expenses: {str(e)}")
+    # batch_id é aceito por compatibilidade; os lotes são por cartão e a lista não filtra por ele
+    rows = await run_in_threadpool(iter_cc_expenses, year=year)
+    return await json_list_response("expenses", rows, {"success": True})
 
 
 @app.get("/credit-card/batches")
 async def get_cc_batches(year: Optional[int] = None):
     """Get credit card expense batches (grouped submissions)"""
-    try:
-        result = get_credit_card_batches(year)
-        batches = result.get("batches", []) if isinstance(result, dict) else result
-        return JSONResponse(content={"success": True, "batches": batches})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching batches: {str(e)}")
+    result = await run_in_threadpool(get_credit_card_batches, year)
+    batches = result.get("batches", []) if isinstance(result, dict) else result
+    return FastJSONResponse(content={"success": True, "batches": batches})
 
 
 @app.delete("/credit-card/expenses/{expense_id}")
 async def delete_cc_expense(expense_id: str):
     """Delete a single expense and subtract from consolidated"""
-    try:
-        result = delete_credit_card_expense(expense_id)
+    result = await run_in_threadpool(delete_credit_card_expense, expense_id)
         
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
-                              detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expense: {str(e)}")
+    if result["success"]:
+        return FastJSONResponse(content=result)
+    else:
+        raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
+                          detail=result.get("error", "Unknown error"))
 
 
 @app.delete("/credit-card/batches/{batch_id}")
 async def delete_cc_batch(batch_id: str):
     """Delete all expenses from a batch and subtract from consolidated"""
-    try:
-        result = delete_credit_card_batch(batch_id)
+    result = await run_in_threadpool(delete_credit_card_batch, batch_id)
         
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
-                              detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting batch: {str(e)}")
+    if result["success"]:
+        return FastJSONResponse(content=result)
+    else:
+        raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
+                          detail=result.get("error", "Unknown error"))
 
 
 # ==================== CREDIT CARD DASHBOARD (New Endpoints) ====================
 
 class CreditCardExpenseNew(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     date: str  # YYYY-MM-DD
     credit_card: str  # Amex, SVB, Bradesco
     description: Optional[str] = ""
@@ -1354,8 +1469,19 @@ class CreditCardExpenseNew(BaseModel):
     amount: float
     comments: Optional[str] = ""
 
+    @field_validator("description", "comments", mode="before")
+    @classmethod
+    def _none_as_empty(cls, value):
+        return value or ""
+
+
+# Lista do add-batch (corpo é uma lista, sem modelo em volta): dump num passo só
+CC_EXPENSES_ADAPTER = TypeAdapter(List[CreditCardExpenseNew])
+
 
 class CreditCardExpenseUpdate(BaseModel):
+    model_config = INPUT_MODEL_CONFIG
+    
     date: Optional[str] = None
     credit_card: Optional[str] = None
     description: Optional[str] = None
@@ -1374,116 +1500,63 @@ async def get_cc_dashboard(
     category: Optional[str] = None
 ):
     """Get credit card expenses for dashboard with filters"""
-    try:
-        expenses = get_all_credit_card_expenses(
+    # Consultas independentes: rodam ao mesmo tempo no threadpool
+    rows, summary = await asyncio.gather(
+        run_in_threadpool(
+            iter_cc_expenses,
             year=year,
             credit_card=credit_card,
             user=user,
             category=category
-        )
-        summary = get_credit_card_summary()
+        ),
+        run_in_threadpool(get_credit_card_summary)
+    )
         
-        return JSONResponse(content={
-            "success": True,
-            "expenses": expenses,
-            "summary": summary,
-            "valid_cards": VALID_CREDIT_CARDS
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching dashboard: {str(e)}")
+    return await json_list_response(
+        "expenses", rows, {"success": True, "summary": summary, "valid_cards": VALID_CREDIT_CARDS}
+    )
 
 
 @app.get("/credit-card/dashboard/summary")
 async def get_cc_dashboard_summary():
     """Get credit card summary statistics"""
-    try:
-        summary = get_credit_card_summary()
-        return JSONResponse(content={"success": True, **summary})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching summary: {str(e)}")
+    summary = await run_in_threadpool(get_credit_card_summary)
+    return FastJSONResponse(content={"success": True, **summary})
 
 
 @app.get("/credit-card/dashboard/users")
-async def get_cc_dashboard_users():
+async def get_cc_dashboard_users(request: Request):
     """Get unique users from credit card expenses"""
-    try:
-        users = get_cc_users()
-        return JSONResponse(content={"success": True, "users": users})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching users: {str(e)}")
+    users = await run_in_threadpool(get_cc_users)
+    return etag_response(request, orjson.dumps({"success": True, "users": users}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/credit-card/dashboard/categories")
-async def get_cc_dashboard_categories():
+async def get_cc_dashboard_categories(request: Request):
     """Get unique categories from credit card expenses"""
-    try:
-        categories = get_cc_categories()
-        return JSONResponse(content={"success": True, "categories": categories})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
+    categories = await run_in_threadpool(get_cc_categories)
+    return etag_response(request, orjson.dumps({"success": True, "categories": categories}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.get("/credit-card/dashboard/years")
-async def get_cc_dashboard_years():
+async def get_cc_dashboard_years(request: Request):
     """Get available years from credit card expenses"""
-    try:
-        years = get_cc_years()
-        return JSONResponse(content={"success": True, "years": years})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching years: {str(e)}")
+    years = await run_in_threadpool(get_cc_years)
+    return etag_response(request, orjson.dumps({"success": True, "years": years}), REVALIDATE_CACHE_CONTROL)
 
 
 @app.post("/credit-card/dashboard/add")
 async def add_cc_dashboard_expense(expense: CreditCardExpenseNew):
     """Add a single credit card expense"""
-    try:
-        result = add_credit_card_expense(
-            date=expense.date,
-            credit_card=expense.credit_card,
-            description=expense.description or "",
-            user=expense.user,
-            category=expense.category,
-            amount=expense.amount,
-            comments=expense.comments or ""
-        )
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding expense: {str(e)}")
+    return await service_response(add_credit_card_expense, **expense.model_dump())
 
 
 @app.post("/credit-card/dashboard/add-batch")
-async def add_cc_dashboard_batch(expenses: List[CreditCardExpenseNew]):
+async def add_cc_dashboard_batch(expenses: List[CreditCardExpenseNew] = Depends(json_body(List[CreditCardExpenseNew]))):
     """Add multiple credit card expenses at once"""
-    try:
-        expense_list = [
-            {
-                "date": e.date,
-                "credit_card": e.credit_card,
-                "description": e.description or "",
-                "user": e.user,
-                "category": e.category,
-                "amount": e.amount,
-                "comments": e.comments or ""
-            }
-            for e in expenses
-        ]
+    expense_list = CC_EXPENSES_ADAPTER.dump_python(expenses)
         
-        result = add_credit_card_expenses_batch(expense_list)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding expenses: {str(e)}")
+    return await service_response(add_credit_card_expenses_batch, expense_list)
 
 
 @app.post("/credit-card/dashboard/preview-excel")
@@ -1496,100 +1569,17 @@ async def preview_cc_excel(
     Returns parsed data for editing before confirmation.
     Required columns: Date, Card, Description, User, Category, Amount, Comments
     """
-    import pandas as pd
-    from io import BytesIO
-    
     try:
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Normalize column names
-        df.columns = [col.strip().lower() for col in df.columns]
-        
-        required_columns = ['date', 'card', 'description', 'user', 'category', 'amount', 'comments']
-        missing_cols = [col for col in required_columns if col not in df.columns]
-        if missing_cols:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Missing required columns: {', '.join(missing_cols)}. Expected columns: Date, Card, Description, User, Category, Amount, Comments"
-            )
-        
-        expenses = []
-        errors = []
+        expenses, errors = await run_cpu_bound(parse_credit_card_excel, file.file, credit_card)
         
-        for idx, row in df.iterrows():
-            try:
-                # Parse date
-                date_val = row.get('date')
-                if pd.isna(date_val):
-                    errors.append(f"Row {idx+2}: Missing date")
-                    continue
-                
-                if isinstance(date_val, str):
-                    try:
-                        dt = datetime.strptime(date_val, "%Y-%m-%d")
-                    except:
-                        try:
-                            dt = datetime.strptime(date_val, "%m/%d/%Y")
-                        except:
-                            dt = datetime.strptime(date_val, "%d/%m/%Y")
-                else:
-                    dt = pd.to_datetime(date_val)
-                
-                date_str = dt.strftime("%Y-%m-%d")
-                
-                # Get card
-                card_val = row.get('card', '')
-                if pd.isna(card_val) or str(card_val).strip() == '':
-                    card = credit_card
-                else:
-                    card = str(card_val).strip()
-                
-                if card not in VALID_CREDIT_CARDS:
-                    errors.append(f"Row {idx+2}: Invalid card '{card}'")
-                    continue
-                
-                # Get amount
-                amount = row.get('amount', 0)
-                if pd.isna(amount):
-                    amount = 0
-                amount = float(amount)
-                
-                # Get other fields
-                description = str(row.get('description', '')) if not pd.isna(row.get('description')) else ''
-                user = str(row.get('user', '')) if not pd.isna(row.get('user')) else ''
-                category = str(row.get('category', '')) if not pd.isna(row.get('category')) else ''
-                comments = str(row.get('comments', '')) if not pd.isna(row.get('comments')) else ''
-                
-                # Apply Firm Uber rule
-                if 'UBER' in description.upper() and user == 'Doug Smith':
-                    category = 'Firm Uber'
-                
-                expenses.append({
-                    "id": str(idx),  # Temporary ID for frontend
-                    "date": date_str,
-                    "credit_card": card,
-                    "description": description,
-                    "user": user,
-                    "category": category,
-                    "amount": amount,
-                    "comments": comments
-                })
-                
-            except Exception as e:
-                errors.append(f"Row {idx+2}: {str(e)}")
-        
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "expenses": expenses,
             "total_rows": len(expenses),
             "parse_errors": errors if errors else None
         })
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing Excel file: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/credit-card/dashboard/upload-excel")
@@ -1601,102 +1591,17 @@ async def upload_cc_excel(
     Upload Excel file with credit card expenses.
     Required columns (in order): Date, Card, Description, User, Category, Amount, Comments
     """
-    import pandas as pd
-    from io import BytesIO
-    
     try:
-        # Read Excel file
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Normalize column names (case insensitive, strip whitespace)
-        df.columns = [col.strip().lower() for col in df.columns]
-        
-        # Required columns in expected order
-        required_columns = ['date', 'card', 'description', 'user', 'category', 'amount', 'comments']
-        
-        # Validate columns exist
-        missing_cols = [col for col in required_columns if col not in df.columns]
-        if missing_cols:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Missing required columns: {', '.join(missing_cols)}. Expected columns: Date, Card, Description, User, Category, Amount, Comments"
-            )
-        
-        expenses = []
-        errors = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Parse date
-                date_val = row.get('date')
-                if pd.isna(date_val):
-                    errors.append(f"Row {idx+2}: Missing date")
-                    continue
-                
-                # Handle different date formats
-                if isinstance(date_val, str):
-                    try:
-                        dt = datetime.strptime(date_val, "%Y-%m-%d")
-                    except:
-                        try:
-                            dt = datetime.strptime(date_val, "%m/%d/%Y")
-                        except:
-                            dt = datetime.strptime(date_val, "%d/%m/%Y")
-                else:
-                    dt = pd.to_datetime(date_val)
-                
-                date_str = dt.strftime("%Y-%m-%d")
-                
-                # Get card from Excel (override form parameter if provided in Excel)
-                card_val = row.get('card', '')
-                if pd.isna(card_val) or str(card_val).strip() == '':
-                    card = credit_card  # Use form default
-                else:
-                    card = str(card_val).strip()
-                
-                # Validate card
-                if card not in VALID_CREDIT_CARDS:
-                    errors.append(f"Row {idx+2}: Invalid card '{card}'. Valid cards: {', '.join(VALID_CREDIT_CARDS)}")
-                    continue
-                
-                # Get amount
-                amount = row.get('amount', 0)
-                if pd.isna(amount):
-                    amount = 0
-                amount = float(amount)
-                
-                # Get other fields
-                description = str(row.get('description', '')) if not pd.isna(row.get('description')) else ''
-                user = str(row.get('user', '')) if not pd.isna(row.get('user')) else ''
-                category = str(row.get('category', '')) if not pd.isna(row.get('category')) else ''
-                comments = str(row.get('comments', '')) if not pd.isna(row.get('comments')) else ''
-                
-                # Apply Firm Uber rule: UBER + Doug Smith = Firm Uber
-                if 'UBER' in description.upper() and user == 'Doug Smith':
-                    category = 'Firm Uber'
-                
-                expenses.append({
-                    "date": date_str,
-                    "credit_card": card,
-                    "description": description,
-                    "user": user,
-                    "category": category,
-                    "amount": amount,
-                    "comments": comments
-                })
-                
-            except Exception as e:
-                errors.append(f"Row {idx+2}: {str(e)}")
+        expenses, errors = await run_cpu_bound(parse_credit_card_excel, file.file, credit_card)
         
         if not expenses:
             raise HTTPException(status_code=400, detail=f"No valid expenses found. Errors: {errors}")
         
         # Add to database
-        result = add_credit_card_expenses_batch(expenses)
+        result = await run_in_threadpool(add_credit_card_expenses_batch, expenses)
         
         if result["success"]:
-            return JSONResponse(content={
+            return FastJSONResponse(content={
                 "success": True,
                 "added_count": result.get("added_count", 0),
                 "parse_errors": errors if errors else None,
@@ -1705,94 +1610,56 @@ async def upload_cc_excel(
             })
         else:
             raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing Excel file: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.put("/credit-card/dashboard/{expense_id}")
 async def update_cc_dashboard_expense(expense_id: str, updates: CreditCardExpenseUpdate):
     """Update a credit card expense"""
-    try:
-        update_dict = {}
-        if updates.date is not None:
-            update_dict["date"] = updates.date
-        if updates.credit_card is not None:
-            update_dict["credit_card"] = updates.credit_card
-        if updates.description is not None:
-            update_dict["description"] = updates.description
-        if updates.user is not None:
-            update_dict["user"] = updates.user
-        if updates.category is not None:
-            update_dict["category"] = updates.category
-        if updates.amount is not None:
-            update_dict["amount"] = updates.amount
-        if updates.comments is not None:
-            update_dict["comments"] = updates.comments
-        if updates.project is not None:
-            update_dict["project"] = updates.project
-        
-        result = update_credit_card_expense(expense_id, update_dict)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating expense: {str(e)}")
+    update_dict = {}
+    if updates.date is not None:
+        update_dict["date"] = updates.date
+    if updates.credit_card is not None:
+        update_dict["credit_card"] = updates.credit_card
+    if updates.description is not None:
+        update_dict["description"] = updates.description
+    if updates.user is not None:
+        update_dict["user"] = updates.user
+    if updates.category is not None:
+        update_dict["category"] = updates.category
+    if updates.amount is not None:
+        update_dict["amount"] = updates.amount
+    if updates.comments is not None:
+        update_dict["comments"] = updates.comments
+    if updates.project is not None:
+        update_dict["project"] = updates.project
+        
+    return await service_response(update_credit_card_expense, expense_id, update_dict)
 
 
 @app.delete("/credit-card/dashboard/{expense_id}")
 async def delete_cc_dashboard_expense(expense_id: str):
     """Delete a credit card expense"""
-    try:
-        result = delete_credit_card_expense(expense_id)
+    result = await run_in_threadpool(delete_credit_card_expense, expense_id)
         
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
-                              detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expense: {str(e)}")
+    if result["success"]:
+        return FastJSONResponse(content=result)
+    else:
+        raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
+                          detail=result.get("error", "Unknown error"))
 
 
 @app.post("/credit-card/dashboard/delete-batch")
 async def delete_cc_dashboard_batch(expense_ids: List[str]):
     """Delete multiple credit card expenses at once"""
-    try:
-        result = delete_credit_card_expenses_batch(expense_ids)
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expenses: {str(e)}")
+    return await service_response(delete_credit_card_expenses_batch, expense_ids, error_status=500)
 
 
 @app.post("/credit-card/dashboard/sync-to-valor")
 async def sync_cc_dashboard_to_valor():
     """Sync all unsynced credit card expenses to valor_expenses"""
-    try:
-        result = sync_cc_to_valor()
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error syncing to valor: {str(e)}")
+    return await service_response(sync_cc_to_valor, error_status=500)
 
 
 @app.post("/credit-card/dashboard/apply-firm-uber-rule")
@@ -1802,33 +1669,13 @@ async def apply_firm_uber_rule_endpoint():
     If description contains 'UBER' and user is 'Doug Smith', set category to 'Firm Uber'.
     This category won't be synced to consolidated expenses.
     """
-    try:
-        result = apply_firm_uber_rule()
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error applying rule: {str(e)}")
+    return await service_response(apply_firm_uber_rule, error_status=500)
 
 
 @app.post("/valor/fix-credit-card-vendors")
 async def fix_credit_card_vendors():
     """Clear vendor field for all Credit Card expenses in valor_expenses (they should not have vendor)"""
-    try:
-        result = clear_vendor_for_credit_card_expenses()
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fixing vendors: {str(e)}")
+    return await service_response(clear_vendor_for_credit_card_expenses, error_status=500)
 
 
 @app.post("/valor/fix-category-case")
@@ -1837,17 +1684,7 @@ async def fix_valor_category_case():
     Fix category case issues in valor_expenses.
     Converts lowercase categories like 'airfare' to proper case 'Airfare'.
     """
-    try:
-        result = fix_category_case()
-        
-        if result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fixing category case: {str(e)}")
+    return await service_response(fix_category_case, error_status=500)
 
 
 @app.get("/valor/export-by-category/{year}")
@@ -1859,18 +1696,10 @@ async def export_valor_by_category(year: int):
     - One sheet per category with all transactions
     - All Transactions sheet with everything
     """
-    try:
-        excel_buffer = export_consolidated_by_category(year)
-        
-        return StreamingResponse(
-            excel_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename=Consolidated_Expenses_{year}_by_Category.xlsx"
-            }
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error exporting: {str(e)}")
+    # Consulta + montagem do workbook (openpyxl) fora do event loop
+    output = await run_cpu_bound(export_consolidated_by_category, year)
+        
+    return xlsx_response(output, f"Consolidated_Expenses_{year}_by_Category.xlsx")
 
 
 # ===========================================
@@ -1890,10 +1719,8 @@ async def parse_rippling_file_preview(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be .xlsx, .xls or .csv")
     
     try:
-        content = await file.read()
-        
-        # Parse arquivo
-        transactions = parse_rippling_file(content, file.filename)
+        # Parse arquivo (lido direto do upload, que o Starlette já mantém em arquivo temporário)
+        transactions = await run_cpu_bound(parse_rippling_file, file.file, file.filename)
         
         if not transactions:
             raise HTTPException(status_code=400, detail="No transactions found in file")
@@ -1949,7 +1776,7 @@ async def parse_rippling_file_preview(file: UploadFile = File(...)):
                 "is_duplicate": is_duplicate,
             })
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "transactions": preview_data,
             "total": len(preview_data),
@@ -1960,8 +1787,8 @@ async def parse_rippling_file_preview(file: UploadFile = File(...)):
             
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing file: {str(e)}")
+    except Exception:
+        raise server_error("Error parsing file")
 
 
 @app.post("/rippling-expenses/upload")
@@ -1977,10 +1804,8 @@ async def upload_rippling_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be .xlsx, .xls or .csv")
     
     try:
-        content = await file.read()
-        
-        # Parse arquivo
-        transactions = parse_rippling_file(content, file.filename)
+        # Parse arquivo (lido direto do upload, que o Starlette já mantém em arquivo temporário)
+        transactions = await run_cpu_bound(parse_rippling_file, file.file, file.filename)
         
         if not transactions:
             raise HTTPException(status_code=400, detail="No transactions found in file")
@@ -1989,14 +1814,14 @@ async def upload_rippling_file(file: UploadFile = File(...)):
         result = upload_rippling_expenses(transactions)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
             
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    except Exception:
+        raise server_error("Error processing file")
 
 
 @app.post("/rippling-expenses/confirm")
@@ -2017,14 +1842,14 @@ async def confirm_rippling_upload(request: Request):
         result = upload_rippling_expenses(transactions, year=year)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
             
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading transactions: {str(e)}")
+    except Exception:
+        raise server_error("Error uploading transactions")
 
 
 @app.get("/rippling-expenses")
@@ -2032,9 +1857,9 @@ async def get_rippling_expenses_list(batch_id: Optional[str] = None, year: Optio
     """Get Rippling expenses, optionally filtered by batch, year, or date range"""
     try:
         expenses = get_rippling_expenses(batch_id=batch_id, year=year, limit=limit, start_date=start_date, end_date=end_date)
-        return JSONResponse(content={"expenses": expenses, "count": len(expenses)})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching expenses: {str(e)}")
+        return FastJSONResponse(content={"expenses": expenses, "count": len(expenses)})
+    except Exception:
+        raise server_error("Error fetching expenses")
 
 
 @app.get("/rippling-expenses/batches")
@@ -2042,9 +1867,9 @@ async def get_rippling_batches_list():
     """Get list of Rippling upload batches"""
     try:
         batches = get_rippling_batches()
-        return JSONResponse(content={"batches": batches})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching batches: {str(e)}")
+        return FastJSONResponse(content={"batches": batches})
+    except Exception:
+        raise server_error("Error fetching batches")
 
 
 @app.get("/rippling-expenses/summary")
@@ -2052,9 +1877,9 @@ async def get_rippling_expenses_summary(year: Optional[int] = None):
     """Get summary of Rippling expenses"""
     try:
         summary = get_rippling_summary(year=year)
-        return JSONResponse(content=summary)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching summary: {str(e)}")
+        return FastJSONResponse(content=summary)
+    except Exception:
+        raise server_error("Error fetching summary")
 
 
 @app.delete("/rippling-expenses/batches/{batch_id}")
@@ -2064,14 +1889,14 @@ async def delete_rippling_expenses_batch(batch_id: str):
         result = delete_rippling_batch(batch_id)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
                               detail=result.get("error", "Unknown error"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting batch: {str(e)}")
+    except Exception:
+        raise server_error("Error deleting batch")
 
 
 @app.delete("/rippling-expenses/{expense_id}")
@@ -2081,14 +1906,14 @@ async def delete_single_rippling_expense(expense_id: str):
         result = delete_rippling_expense(expense_id)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
                               detail=result.get("error", "Unknown error"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting expense: {str(e)}")
+    except Exception:
+        raise server_error("Error deleting expense")
 
 
 @app.put("/rippling-expenses/{expense_id}")
@@ -2099,14 +1924,14 @@ async def update_single_rippling_expense(expense_id: str, request: Request):
         result = update_rippling_expense(expense_id, body)
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=404 if "not found" in result.get("error", "").lower() else 500, 
                               detail=result.get("error", "Unknown error"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating expense: {str(e)}")
+    except Exception:
+        raise server_error("Error updating expense")
 
 
 @app.post("/rippling/sync-to-valor")
@@ -2118,13 +1943,13 @@ async def resync_rippling_to_valor_endpoint():
         result = resync_all_rippling_to_valor()
         
         if result["success"]:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             raise HTTPException(status_code=500, detail=result.get("error", "Erro desconhecido"))
     except HTTPException:
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao sincronizar: {str(e)}")
+    except Exception:
+        raise server_error("Erro ao sincronizar")
 
 
 # ===========================================
@@ -2135,20 +1960,22 @@ async def resync_rippling_to_valor_endpoint():
 async def get_it_subscriptions_endpoint(year: int = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
     """Get all IT Subscriptions expenses for a given year or date range"""
     try:
+        from services.it_subscriptions import get_it_subscriptions
         expenses = get_it_subscriptions(year, start_date, end_date)
-        return JSONResponse(content={"expenses": expenses})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching IT subscriptions: {str(e)}")
+        return FastJSONResponse(content={"expenses": expenses})
+    except Exception:
+        raise server_error("Error fetching IT subscriptions")
 
 
 @app.get("/it-subscriptions/summary")
 async def get_it_subscriptions_summary_endpoint(year: int = None):
     """Get summary statistics for IT Subscriptions"""
     try:
+        from services.it_subscriptions import get_it_subscriptions_summary
         summary = get_it_subscriptions_summary(year)
-        return JSONResponse(content=summary)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching IT subscriptions summary: {str(e)}")
+        return FastJSONResponse(content=summary)
+    except Exception:
+        raise server_error("Error fetching IT subscriptions summary")
 
 
 @app.post("/it-subscriptions/extract-vendors")
@@ -2158,16 +1985,17 @@ async def extract_vendors_endpoint(request: Request):
         body = await request.json()
         expense_ids = body.get("expense_ids", None)
         
+        from services.it_subscriptions import extract_vendors_for_expenses
         results = extract_vendors_for_expenses(expense_ids)
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True,
             "results": results,
             "processed_count": len(results),
             "updated_count": len([r for r in results if r["status"] == "updated"])
         })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error extracting vendors: {str(e)}")
+    except Exception:
+        raise server_error("Error extracting vendors")
 
 
 if __name__ == "__main__":
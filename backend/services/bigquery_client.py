@@ -3,8 +3,13 @@ BigQuery client factory - works both locally and in Cloud Run
 """
 
 import os
+import threading
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
 from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 
 # Configurações
 PROJECT_ID = "automatic-bond-462415-h6"
@@ -13,24 +18,52 @@ DATASET_ID = "finance"
 # Path para credenciais locais
 SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), "..", "credentials", "bq-service-account.json")
 
+# Conexões HTTP mantidas abertas para a API do BigQuery. O padrão do requests (10) fica
+# abaixo do threadpool da API; acima disso as conexões extras são abertas e descartadas
+BQ_HTTP_POOL_SIZE = int(os.getenv("BQ_HTTP_POOL_SIZE", "64"))
 
-def get_bigquery_client() -> bigquery.Client:
+# Cliente compartilhado por todas as requisições (thread-safe para queries)
+_client = None
+_client_lock = threading.Lock()
+
+
+def _load_credentials():
     """
-    Cria cliente BigQuery.
     - Em ambiente local: usa arquivo de credenciais
     - No Cloud Run: usa Application Default Credentials
     """
     # Verifica se existe arquivo de credenciais local
     if os.path.exists(SERVICE_ACCOUNT_FILE):
-        credentials = service_account.Credentials.from_service_account_file(
+        return service_account.Credentials.from_service_account_file(
             SERVICE_ACCOUNT_FILE,
             scopes=["https://www.googleapis.com/auth/bigquery"]
         )
-        return bigquery.Client(credentials=credentials, project=PROJECT_ID)
     
     # Se não existe, usa ADC (Application Default Credentials)
     # Funciona automaticamente no Cloud Run
-    return bigquery.Client(project=PROJECT_ID)
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    return credentials
+
+
+def _create_client() -> bigquery.Client:
+    credentials = _load_credentials()
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=BQ_HTTP_POOL_SIZE, pool_maxsize=BQ_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return bigquery.Client(project=PROJECT_ID, credentials=credentials, _http=session)
+
+
+def get_bigquery_client() -> bigquery.Client:
+    """
+    Retorna o cliente BigQuery do processo, criando na primeira chamada.
+    Credenciais, token e conexões HTTP são reaproveitados entre requisições.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
 
 
 # Alias para compatibilidade
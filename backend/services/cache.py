@@ -0,0 +1,40 @@
+"""
+Memoização em memória com tempo de vida, para consultas de lookup que mudam pouco
+(anos disponíveis, listas de filtros). Cada worker tem a sua cópia; quem grava
+chama .cache_clear() da função para invalidar na hora.
+"""
+
+import functools
+import threading
+import time
+
+
+def ttl_cache(ttl: float):
+    """
+    Decorator: guarda o resultado por `ttl` segundos, um por combinação de argumentos.
+    Exceções não são guardadas. A função decorada ganha .cache_clear().
+    """
+    def decorator(func):
+        entries = {}
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            with lock:
+                entry = entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            value = func(*args, **kwargs)
+            with lock:
+                entries[key] = (now + ttl, value)
+            return value
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
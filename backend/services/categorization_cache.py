@@ -0,0 +1,53 @@
+"""
+Cache curto (LRU com TTL, em memória) das categorias geradas pelo /categorize.
+A chave é o hash (blake2b) da lista de (description, amount, cardholder), então um novo
+"Categorize" das mesmas transações não chama o OpenAI de novo e o export com categorias
+consegue completar as que vierem vazias.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import orjson
+
+# Tempo de vida de cada resultado (segundos) e número máximo de resultados; 0 desliga
+CATEGORIZATION_CACHE_TTL = int(os.getenv("CATEGORIZATION_CACHE_TTL", "600"))
+CATEGORIZATION_CACHE_SIZE = int(os.getenv("CATEGORIZATION_CACHE_SIZE", "64"))
+
+_cache: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def transactions_key(transactions: Iterable) -> str:
+    """Hash das transações (objetos com description/amount/cardholder), na ordem recebida"""
+    fields = [(tx.description, tx.amount, tx.cardholder) for tx in transactions]
+    return hashlib.blake2b(orjson.dumps(fields)).hexdigest()
+
+
+def get_cached_categories(key: str) -> Optional[List[str]]:
+    """Categorias na mesma ordem das transações, ou None se não houver (ou já expirou)"""
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires_at, categories = entry
+        if expires_at < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return categories
+
+
+def store_categories(key: str, categories: List[str]):
+    # Resultado com categoria vazia pode ser falha do LLM: não fica preso no cache
+    if CATEGORIZATION_CACHE_TTL <= 0 or CATEGORIZATION_CACHE_SIZE <= 0 or not all(categories):
+        return
+    with _lock:
+        _cache[key] = (time.monotonic() + CATEGORIZATION_CACHE_TTL, categories)
+        _cache.move_to_end(key)
+        while len(_cache) > CATEGORIZATION_CACHE_SIZE:
+            _cache.popitem(last=False)
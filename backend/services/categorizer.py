@@ -4,9 +4,11 @@ AI Categorization service using OpenAI (optimized version)
 
 import os
 import json
+import asyncio
 from typing import List, Dict, Optional
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,6 +30,20 @@ def get_openai_client():
         _openai_client = OpenAI(api_key=api_key)
     return _openai_client
 
+
+_async_openai_client = None
+
+def get_async_openai_client():
+    """Get or create the async OpenAI client (used for concurrent batches)"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            print("[ERROR] OPENAI_API_KEY environment variable is not set!")
+            raise ValueError("OPENAI_API_KEY not configured")
+        _async_openai_client = AsyncOpenAI(api_key=api_key.strip())
+    return _async_openai_client
+
 # -----------------------------
 # 1. CONSTANTES E CONFIGURAÇÃO
 # -----------------------------
@@ -436,6 +452,52 @@ Example: ["Airfare", "Meals & Entertainment - Travel", "", "IT Subscriptions"]
 # 3. LLM CATEGORIZATION
 # -----------------------------
 
+LLM_MODEL = "gpt-4.1"
+LLM_BATCH_SIZE = 25
+# Máximo de chamadas simultâneas ao modelo na versão async
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+
+def build_llm_request(batch_descriptions: List[str]) -> Dict:
+    """Parâmetros da chamada de chat completion para um batch"""
+    return {
+        "model": LLM_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are an expense categorization assistant. You respond ONLY with valid JSON arrays."
+            },
+            {
+                "role": "user",
+                "content": build_llm_prompt(batch_descriptions)
+            }
+        ],
+        "temperature": 0.1,
+        "max_tokens": 2000,
+    }
+
+
+def parse_llm_batch(result_text: str, expected: int) -> List[str]:
+    """Lê o array JSON retornado pelo modelo, ajustando para `expected` itens"""
+    batch_categories = json.loads(result_text.strip())
+
+    if not isinstance(batch_categories, list):
+        raise ValueError("Model response is not a JSON array")
+
+    # Ajusta tamanho se vier errado
+    if len(batch_categories) != expected:
+        print(
+            f"[WARN] LLM returned {len(batch_categories)} items for "
+            f"{expected} descriptions. Adjusting..."
+        )
+        # Trunca ou completa com vazio
+        if len(batch_categories) > expected:
+            batch_categories = batch_categories[:expected]
+        else:
+            batch_categories += [""] * (expected - len(batch_categories))
+    return batch_categories
+
+
 def categorize_with_llm(descriptions: List[str]) -> List[str]:
     """
     Chama o modelo para categorizar uma lista de descrições.
@@ -444,50 +506,15 @@ def categorize_with_llm(descriptions: List[str]) -> List[str]:
     if not descriptions:
         return []
 
-    batch_size = 25
     all_categories: List[str] = []
 
-    for i in range(0, len(descriptions), batch_size):
-        batch_descriptions = descriptions[i:i + batch_size]
-        batch_prompt = build_llm_prompt(batch_descriptions)
+    for i in range(0, len(descriptions), LLM_BATCH_SIZE):
+        batch_descriptions = descriptions[i:i + LLM_BATCH_SIZE]
 
         try:
             openai_client = get_openai_client()
-            response = openai_client.chat.completions.create(
-                model="gpt-4.1",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expense categorization assistant. You respond ONLY with valid JSON arrays."
-                    },
-                    {
-                        "role": "user",
-                        "content": batch_prompt
-                    }
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )    
-
-            result_text = response.choices[0].message.content.strip()
-
-            # Em teoria, com response_format=json_array já vem 100% válido
-            batch_categories = json.loads(result_text)
-
-            if not isinstance(batch_categories, list):
-                raise ValueError("Model response is not a JSON array")
-
-            # Ajusta tamanho se vier errado
-            if len(batch_categories) != len(batch_descriptions):
-                print(
-                    f"[WARN] LLM returned {len(batch_categories)} items for "
-                    f"{len(batch_descriptions)} descriptions. Adjusting..."
-                )
-                # Trunca ou completa com vazio
-                if len(batch_categories) > len(batch_descriptions):
-                    batch_categories = batch_categories[:len(batch_descriptions)]
-                else:
-                    batch_categories += [""] * (len(batch_descriptions) - len(batch_categories))
+            response = openai_client.chat.completions.create(**build_llm_request(batch_descriptions))
+            batch_categories = parse_llm_batch(response.choices[0].message.content, len(batch_descriptions))
 
         except Exception as e:
             import traceback
@@ -496,29 +523,57 @@ def categorize_with_llm(descriptions: List[str]) -> List[str]:
             batch_categories = [""] * len(batch_descriptions)
 
         all_categories.extend(batch_categories)
-        print(f"Categorized batch {i // batch_size + 1}: {len(batch_categories)} items")
+        print(f"Categorized batch {i // LLM_BATCH_SIZE + 1}: {len(batch_categories)} items")
 
     return all_categories
 
 
-# -----------------------------
-# 4. API PÚBLICA
-# -----------------------------
+@retry(wait=wait_exponential(multiplier=1, max=30), stop=stop_after_attempt(3), reraise=True)
+async def _complete_async(client: AsyncOpenAI, batch_descriptions: List[str]) -> str:
+    """One chat completion, retried with exponential backoff"""
+    response = await client.chat.completions.create(**build_llm_request(batch_descriptions))
+    return response.choices[0].message.content
 
-def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
+
+async def categorize_with_llm_async(
+    descriptions: List[str],
+    batch_size: int = LLM_BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY
+) -> List[str]:
     """
-    Categorize a list of transactions using rule-based logic + OpenAI.
+    Mesmo contrato de categorize_with_llm, mas os batches vão ao modelo em paralelo
+    (no máximo `concurrency` ao mesmo tempo). A ordem do resultado é a da entrada.
+    """
+    if not descriptions:
+        return []
 
-    Args:
-        transactions: List of transaction dicts with 'description' field
+    client = get_async_openai_client()
+    semaphore = asyncio.Semaphore(concurrency)
 
-    Returns:
-        List of transactions with added 'ai_category' field
-    """
-    if not transactions:
-        return transactions
+    async def run_batch(batch_no: int, batch_descriptions: List[str]) -> List[str]:
+        async with semaphore:
+            try:
+                result_text = await _complete_async(client, batch_descriptions)
+                batch_categories = parse_llm_batch(result_text, len(batch_descriptions))
+            except Exception as e:
+                print(f"[ERROR] LLM batch categorization failed: {type(e).__name__}: {e}")
+                batch_categories = [""] * len(batch_descriptions)
+        print(f"Categorized batch {batch_no}: {len(batch_categories)} items")
+        return batch_categories
+
+    results = await asyncio.gather(*(
+        run_batch(i // batch_size + 1, descriptions[i:i + batch_size])
+        for i in range(0, len(descriptions), batch_size)
+    ))
+    return [category for batch in results for category in batch]
 
-    # 1ª passada: regras determinísticas
+
+# -----------------------------
+# 4. API PÚBLICA
+# -----------------------------
+
+def apply_rule_categories(transactions: List[Dict]) -> List[int]:
+    """1ª passada: regras determinísticas. Retorna os índices que precisam do LLM"""
     uncategorized_indices: List[int] = []
 
     for i, tx in enumerate(transactions):
@@ -535,15 +590,11 @@ def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
         f"Rule-based: {len(transactions) - len(uncategorized_indices)} categorized, "
         f"{len(uncategorized_indices)} need AI"
     )
+    return uncategorized_indices
 
-    if not uncategorized_indices:
-        return transactions
-
-    # 2ª passada: chama LLM só para os não categorizados
-    descriptions_for_llm = [transactions[i].get("description", "") or "" for i in uncategorized_indices]
-    llm_raw_categories = categorize_with_llm(descriptions_for_llm)
 
-    # 3ª passada: aplica categorias, com normalização + sanity checks
+def apply_llm_categories(transactions: List[Dict], uncategorized_indices: List[int], llm_raw_categories: List[str]):
+    """3ª passada: aplica categorias do LLM, com normalização + sanity checks"""
     for idx, tx_index in enumerate(uncategorized_indices):
         raw_cat = llm_raw_categories[idx] if idx < len(llm_raw_categories) else ""
         normalized = normalize_category(raw_cat)
@@ -563,6 +614,51 @@ def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
 
         transactions[tx_index]["ai_category"] = normalized or ""
 
+
+def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
+    """
+    Categorize a list of transactions using rule-based logic + OpenAI.
+
+    Args:
+        transactions: List of transaction dicts with 'description' field
+
+    Returns:
+        List of transactions with added 'ai_category' field
+    """
+    if not transactions:
+        return transactions
+
+    uncategorized_indices = apply_rule_categories(transactions)
+    if not uncategorized_indices:
+        return transactions
+
+    # 2ª passada: chama LLM só para os não categorizados
+    descriptions_for_llm = [transactions[i].get("description", "") or "" for i in uncategorized_indices]
+    apply_llm_categories(transactions, uncategorized_indices, categorize_with_llm(descriptions_for_llm))
+
+    return transactions
+
+
+async def categorize_transactions_async(
+    transactions: List[Dict],
+    batch_size: int = LLM_BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY
+) -> List[Dict]:
+    """
+    Same as categorize_transactions, but the LLM batches run concurrently
+    (bounded by `concurrency`) instead of one after another.
+    """
+    if not transactions:
+        return transactions
+
+    uncategorized_indices = await asyncio.to_thread(apply_rule_categories, transactions)
+    if not uncategorized_indices:
+        return transactions
+
+    descriptions_for_llm = [transactions[i].get("description", "") or "" for i in uncategorized_indices]
+    llm_raw_categories = await categorize_with_llm_async(descriptions_for_llm, batch_size, concurrency)
+    apply_llm_categories(transactions, uncategorized_indices, llm_raw_categories)
+
     return transactions
 
 
@@ -10,9 +10,14 @@ import io
 import json
 import uuid
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+
+import orjson
+import pandas as pd
 
 from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
+from .cache import ttl_cache
+from .valor_expenses import clear_lookup_caches as clear_valor_lookup_caches
 
 # BigQuery configuration
 CREDIT_CARD_TABLE = "credit_card_expenses"
@@ -20,21 +25,49 @@ VALOR_TABLE = "valor_expenses"
 FULL_CC_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{CREDIT_CARD_TABLE}"
 FULL_VALOR_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{VALOR_TABLE}"
 
+# Summary and dashboard filter lists are cached; the functions that write call
+# clear_lookup_caches() (and the valor one when valor_expenses changes too)
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL", "300"))
+
 # Valid credit cards
 VALID_CREDIT_CARDS = ["Amex", "SVB", "Bradesco"]
+# For membership checks (the list keeps the display order for responses and messages)
+VALID_CREDIT_CARDS_SET = frozenset(VALID_CREDIT_CARDS)
+
+# Columns expected in uploaded Excel files
+EXCEL_REQUIRED_COLUMNS = ['date', 'card', 'description', 'user', 'category', 'amount', 'comments']
 
 
 # get_bigquery_client is now imported from bigquery_client module
 
 
-def get_all_credit_card_expenses(
+def _expense_from_row(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "date": row.date.isoformat() if row.date else None,
+        "credit_card": row.credit_card,
+        "description": row.description,
+        "user": row.user,
+        "category": row.category,
+        "amount": float(row.amount) if row.amount else 0,
+        "year": row.year,
+        "month": row.month,
+        "synced_to_valor": row.synced_to_valor or False,
+        "comments": row.comments or "",
+        "project": row.project or ""
+    }
+
+
+def iter_credit_card_expenses(
     year: Optional[int] = None,
     credit_card: Optional[str] = None,
     user: Optional[str] = None,
     category: Optional[str] = None
-) -> List[Dict[str, Any]]:
+) -> Iterator[Dict[str, Any]]:
     """
-    Get all credit card expenses with optional filters.
+    Run the filtered query and return an iterator over the expenses,
+    converted as BigQuery pages are fetched.
     """
     client = get_bigquery_client()
     
@@ -67,28 +100,22 @@ def get_all_credit_card_expenses(
     """
     
     job_config = bigquery.QueryJobConfig(query_parameters=params) if params else None
-    result = client.query(query, job_config=job_config).result()
-    
-    return [
-        {
-            "id": row.id,
-            "created_at": row.created_at.isoformat() if row.created_at else None,
-            "date": row.date.isoformat() if row.date else None,
-            "credit_card": row.credit_card,
-            "description": row.description,
-            "user": row.user,
-            "category": row.category,
-            "amount": float(row.amount) if row.amount else 0,
-            "year": row.year,
-            "month": row.month,
-            "synced_to_valor": row.synced_to_valor or False,
-            "comments": row.comments or "",
-            "project": row.project or ""
-        }
-        for row in result
-    ]
+    return map(_expense_from_row, client.query(query, job_config=job_config).result())
 
 
+def get_all_credit_card_expenses(
+    year: Optional[int] = None,
+    credit_card: Optional[str] = None,
+    user: Optional[str] = None,
+    category: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get all credit card expenses with optional filters.
+    """
+    return list(iter_credit_card_expenses(year, credit_card, user, category))
+
+
+@ttl_cache(LOOKUP_CACHE_TTL)
 def get_credit_card_summary() -> Dict[str, Any]:
     """Get summary statistics for credit card expenses."""
     client = get_bigquery_client()
@@ -140,6 +167,7 @@ def get_credit_card_summary() -> Dict[str, Any]:
     }
 
 
+@ttl_cache(LOOKUP_CACHE_TTL)
 def get_unique_users() -> List[str]:
     """Get list of unique users from credit card expenses."""
     client = get_bigquery_client()
@@ -155,6 +183,7 @@ def get_unique_users() -> List[str]:
     return [row.user for row in result]
 
 
+@ttl_cache(LOOKUP_CACHE_TTL)
 def get_unique_categories() -> List[str]:
     """Get list of unique categories from credit card expenses."""
     client = get_bigquery_client()
@@ -170,6 +199,7 @@ def get_unique_categories() -> List[str]:
     return [row.category for row in result]
 
 
+@ttl_cache(LOOKUP_CACHE_TTL)
 def get_available_years() -> List[int]:
     """Get list of years with credit card expenses."""
     client = get_bigquery_client()
@@ -185,6 +215,12 @@ def get_available_years() -> List[int]:
     return [row.year for row in result]
 
 
+def clear_lookup_caches():
+    """Invalidate the cached summary and filter lists (call after writing to credit_card_expenses)"""
+    for cached in (get_credit_card_summary, get_unique_users, get_unique_categories, get_available_years):
+        cached.cache_clear()
+
+
 def add_credit_card_expense(
     date: str,
     credit_card: str,
@@ -208,7 +244,7 @@ def add_credit_card_expense(
         return {"success": False, "error": "Invalid date format. Use YYYY-MM-DD"}
     
     # Validate credit card
-    if credit_card not in VALID_CREDIT_CARDS:
+    if credit_card not in VALID_CREDIT_CARDS_SET:
         return {"success": False, "error": f"Invalid credit card. Use: {', '.join(VALID_CREDIT_CARDS)}"}
     
     expense_id = str(uuid.uuid4())
@@ -243,6 +279,7 @@ def add_credit_card_expense(
             job_config=job_config
         )
         load_job.result()
+        clear_lookup_caches()
         
         return {"success": True, "id": expense_id, "expense": row}
         
@@ -258,22 +295,25 @@ def add_credit_card_expenses_batch(expenses: List[Dict[str, Any]]) -> Dict[str,
     
     rows_to_insert = []
     errors = []
+    # Same insertion timestamp for the whole batch
+    created_at = datetime.utcnow().isoformat()
+    parse_date = datetime.strptime
     
     for i, exp in enumerate(expenses):
         try:
             date = exp.get("date")
-            dt = datetime.strptime(date, "%Y-%m-%d")
+            dt = parse_date(date, "%Y-%m-%d")
             year = dt.year
             month = dt.month
             
             credit_card = exp.get("credit_card")
-            if credit_card not in VALID_CREDIT_CARDS:
+            if credit_card not in VALID_CREDIT_CARDS_SET:
                 errors.append(f"Row {i+1}: Invalid credit card '{credit_card}'")
                 continue
             
             rows_to_insert.append({
                 "id": str(uuid.uuid4()),
-                "created_at": datetime.utcnow().isoformat(),
+                "created_at": created_at,
                 "date": date,
                 "credit_card": credit_card,
                 "description": exp.get("description", "") or "",
@@ -292,8 +332,8 @@ def add_credit_card_expenses_batch(expenses: List[Dict[str, Any]]) -> Dict[str,
         return {"success": False, "error": "No valid expenses to add", "errors": errors}
     
     try:
-        ndjson_data = "\n".join(json.dumps(row) for row in rows_to_insert)
-        json_file = io.BytesIO(ndjson_data.encode('utf-8'))
+        # All rows in one load job (one request, atomic); NDJSON serialized by orjson
+        json_file = io.BytesIO(b"".join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows_to_insert))
         
         job_config = bigquery.LoadJobConfig(
             source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
@@ -306,6 +346,7 @@ def add_credit_card_expenses_batch(expenses: List[Dict[str, Any]]) -> Dict[str,
             job_config=job_config
         )
         load_job.result()
+        clear_lookup_caches()
         
         return {
             "success": True,
@@ -317,6 +358,89 @@ def add_credit_card_expenses_batch(expenses: List[Dict[str, Any]]) -> Dict[str,
         return {"success": False, "error": str(e), "errors": errors}
 
 
+# Formatos aceitos para datas digitadas como texto, na ordem de tentativa
+EXCEL_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y")
+
+
+def _parse_excel_dates(values: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Converte a coluna de datas (datas do Excel ou texto em EXCEL_DATE_FORMATS).
+    Retorna (datas, máscara das células preenchidas que não viraram data).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, pd.Series(False, index=values.index)
+    is_text = values.map(type) == str
+    text = values.where(is_text)
+    dates = pd.to_datetime(values.where(~is_text), errors='coerce')
+    for fmt in EXCEL_DATE_FORMATS:
+        dates = dates.fillna(pd.to_datetime(text, format=fmt, errors='coerce'))
+    return dates, values.notna() & dates.isna()
+
+
+def parse_credit_card_excel(file_content, default_card: str = "SVB") -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Parse an uploaded Excel file (bytes or file object) into credit card expenses.
+    Required columns: Date, Card, Description, User, Category, Amount, Comments
+    Returns (expenses, row_errors). Raises ValueError if required columns are missing.
+    """
+    if isinstance(file_content, (bytes, bytearray)):
+        file_content = io.BytesIO(file_content)
+    df = pd.read_excel(file_content)
+    
+    # Normalize column names (case insensitive, strip whitespace)
+    df.columns = [col.strip().lower() for col in df.columns]
+    
+    # Validate columns exist
+    missing_cols = [col for col in EXCEL_REQUIRED_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(
+            f"Missing required columns: {', '.join(missing_cols)}. Expected columns: Date, Card, Description, User, Category, Amount, Comments"
+        )
+    
+    # Vetorizado por coluna; cada linha gera no máximo um erro (data, depois cartão, depois valor)
+    row_errors = pd.Series(None, index=df.index, dtype=object)
+    
+    dates, bad_dates = _parse_excel_dates(df['date'])
+    row_errors[df['date'].isna()] = "Missing date"
+    row_errors[bad_dates] = "Invalid date '" + df['date'][bad_dates].astype(str) + "'"
+    
+    # Card from Excel overrides the default when present
+    card_text = df['card'].astype(str).str.strip()
+    cards = card_text.where(df['card'].notna() & (card_text != ''), default_card)
+    bad_cards = row_errors.isna() & ~cards.isin(VALID_CREDIT_CARDS_SET)
+    row_errors[bad_cards] = (
+        "Invalid card '" + cards[bad_cards] + f"'. Valid cards: {', '.join(VALID_CREDIT_CARDS)}"
+    )
+    
+    amounts = pd.to_numeric(df['amount'], errors='coerce')
+    bad_amounts = row_errors.isna() & amounts.isna() & df['amount'].notna()
+    row_errors[bad_amounts] = "Invalid amount '" + df['amount'][bad_amounts].astype(str) + "'"
+    
+    description, user, category, comments = (
+        df[col].fillna('').astype(str) for col in ('description', 'user', 'category', 'comments')
+    )
+    # Apply Firm Uber rule: UBER + Doug Smith = Firm Uber
+    firm_uber = description.str.upper().str.contains('UBER', regex=False) & (user == 'Doug Smith')
+    category = category.mask(firm_uber, 'Firm Uber')
+    
+    valid = row_errors.isna()
+    expenses = pd.DataFrame({
+        "id": df.index.astype(str),  # Temporary ID for the preview (ignored on insert)
+        "date": dates.dt.strftime("%Y-%m-%d"),
+        "credit_card": cards,
+        "description": description,
+        "user": user,
+        "category": category,
+        "amount": amounts.fillna(0).astype(float),
+        "comments": comments
+    }, index=df.index)[valid].to_dict(orient="records")
+    
+    failed = row_errors[~valid]
+    errors = [f"Row {idx+2}: {message}" for idx, message in failed.items()]
+    
+    return expenses, errors
+
+
 def update_credit_card_expense(
     expense_id: str,
     updates: Dict[str, Any]
@@ -365,7 +489,7 @@ def update_credit_card_expense(
             except:
                 return {"success": False, "error": "Invalid date format"}
         elif field == "credit_card":
-            if value not in VALID_CREDIT_CARDS:
+            if value not in VALID_CREDIT_CARDS_SET:
                 return {"success": False, "error": f"Invalid credit card. Use: {', '.join(VALID_CREDIT_CARDS)}"}
             set_clauses.append(f"credit_card = @credit_card")
             params.append(bigquery.ScalarQueryParameter("credit_card", "STRING", value))
@@ -389,6 +513,7 @@ def update_credit_card_expense(
         
         job_config = bigquery.QueryJobConfig(query_parameters=params)
         client.query(query, job_config=job_config).result()
+        clear_lookup_caches()
         
         # Always update valor_expenses using cc_{id} pattern (sync)
         valor_updated = False
@@ -433,6 +558,7 @@ def update_credit_card_expense(
             
             valor_config = bigquery.QueryJobConfig(query_parameters=valor_params)
             result = client.query(valor_update_query, job_config=valor_config).result()
+            clear_valor_lookup_caches()
             valor_updated = True
         
         return {"success": True, "id": expense_id, "valor_updated": valor_updated}
@@ -470,6 +596,7 @@ def delete_credit_card_expense(expense_id: str) -> Dict[str, Any]:
             WHERE id = @id
         """
         client.query(delete_query, job_config=job_config).result()
+        clear_lookup_caches()
         
         # If synced, also delete from valor_expenses
         valor_deleted = False
@@ -491,6 +618,7 @@ def delete_credit_card_expense(expense_id: str) -> Dict[str, Any]:
                 ]
                 valor_config = bigquery.QueryJobConfig(query_parameters=valor_params)
                 client.query(valor_query, job_config=valor_config).result()
+                clear_valor_lookup_caches()
                 valor_deleted = True
             except Exception as e:
                 print(f"Warning: Could not delete from valor_expenses: {e}")
@@ -515,16 +643,19 @@ def delete_credit_card_expenses_batch(expense_ids: List[str]) -> Dict[str, Any]:
     
     client = get_bigquery_client()
     
+    # IDs go as a single array parameter for both the lookup and the delete
+    ids_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", expense_ids)]
+    )
+    
     try:
         # Get all expenses to check which are synced
-        placeholders = ", ".join([f"'{id}'" for id in expense_ids])
-        
         query = f"""
             SELECT id, date, user, category, amount, synced_to_valor
             FROM `{FULL_CC_TABLE_ID}`
-            WHERE id IN ({placeholders})
+            WHERE id IN UNNEST(@ids)
         """
-        expenses = list(client.query(query).result())
+        expenses = list(client.query(query, job_config=ids_config).result())
         
         if not expenses:
             return {"success": True, "deleted_count": 0, "valor_deleted_count": 0}
@@ -535,36 +666,48 @@ def delete_credit_card_expenses_batch(expense_ids: List[str]) -> Dict[str, Any]:
         # Delete all from credit_card_expenses in one query
         delete_query = f"""
             DELETE FROM `{FULL_CC_TABLE_ID}`
-            WHERE id IN ({placeholders})
+            WHERE id IN UNNEST(@ids)
         """
-        client.query(delete_query).result()
+        delete_job = client.query(delete_query, job_config=ids_config)
+        delete_job.result()
+        clear_lookup_caches()
         
-        # Delete synced ones from valor_expenses
+        # Delete synced ones from valor_expenses: same match as the single delete
+        # (name, date, amount, category), one STRUCT per expense in a single parameter
         valor_deleted_count = 0
         if synced_expenses:
-            # Build OR conditions for each expense
-            conditions = []
-            for exp in synced_expenses:
-                date_str = exp.date.strftime('%Y-%m-%d') if hasattr(exp.date, 'strftime') else str(exp.date)
-                conditions.append(
-                    f"(name = '{exp.user}' AND date = '{date_str}' AND amount = {exp.amount} AND category = '{exp.category}')"
+            valor_rows = bigquery.ArrayQueryParameter("rows", "STRUCT", [
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("name", "STRING", exp.user),
+                    bigquery.ScalarQueryParameter("date", "DATE", exp.date),
+                    bigquery.ScalarQueryParameter("amount", "FLOAT64", exp.amount),
+                    bigquery.ScalarQueryParameter("category", "STRING", exp.category),
                 )
-            
-            if conditions:
-                valor_query = f"""
-                    DELETE FROM `{FULL_VALOR_TABLE_ID}`
-                    WHERE source LIKE 'Credit Card%'
-                    AND ({' OR '.join(conditions)})
-                """
-                try:
-                    client.query(valor_query).result()
-                    valor_deleted_count = len(synced_expenses)
-                except Exception as e:
-                    print(f"Warning: Could not delete from valor_expenses: {e}")
+                for exp in synced_expenses
+            ])
+            valor_query = f"""
+                DELETE FROM `{FULL_VALOR_TABLE_ID}` v
+                WHERE v.source LIKE 'Credit Card%'
+                AND EXISTS (
+                    SELECT 1 FROM UNNEST(@rows) r
+                    WHERE r.name = v.name AND r.date = v.date
+                    AND r.amount = v.amount AND r.category = v.category
+                )
+            """
+            try:
+                valor_job = client.query(
+                    valor_query, job_config=bigquery.QueryJobConfig(query_parameters=[valor_rows])
+                )
+                valor_job.result()
+                clear_valor_lookup_caches()
+                valor_deleted_count = valor_job.num_dml_affected_rows or 0
+            except Exception as e:
+                print(f"Warning: Could not delete from valor_expenses: {e}")
         
         return {
             "success": True,
-            "deleted_count": len(expenses),
+            "deleted_count": delete_job.num_dml_affected_rows or 0,
             "valor_deleted_count": valor_deleted_count
         }
         
@@ -650,6 +793,7 @@ def sync_to_valor_expenses() -> Dict[str, Any]:
             
             client.query(merge_query).result()
             total_synced += len(batch)
+        clear_valor_lookup_caches()
         
         # Mark all as synced in credit_card_expenses
         cc_ids = [row.id for row in result]
@@ -664,6 +808,8 @@ def sync_to_valor_expenses() -> Dict[str, Any]:
                 WHERE id IN ({ids_str})
             """
             client.query(update_query).result()
+        # O resumo conta as sincronizadas (totals.synced)
+        clear_lookup_caches()
         
         return {
             "success": True,
@@ -714,7 +860,7 @@ def add_credit_card_expenses(transactions: list, year: int, source: str = "AMEX"
     for tx in transactions:
         expenses.append({
             "date": tx.get("transaction_date", f"{year}-01-01"),
-            "credit_card": source if source in VALID_CREDIT_CARDS else "Amex",
+            "credit_card": source if source in VALID_CREDIT_CARDS_SET else "Amex",
             "description": tx.get("description", ""),
             "user": tx.get("employee_name", ""),
             "category": tx.get("category", ""),
@@ -743,6 +889,7 @@ def apply_firm_uber_rule() -> Dict[str, Any]:
         """
         
         result = client.query(query).result()
+        clear_lookup_caches()
         
         # Count how many were updated
         count_query = f"""
@@ -0,0 +1,119 @@
+"""
+Geração de planilhas tabulares (cabeçalho + linhas) para os endpoints de exportação.
+"""
+
+import os
+import tempfile
+
+try:
+    import xlsxwriter
+except ImportError:  # opcional: sem ele usamos openpyxl em modo write-only
+    xlsxwriter = None
+
+# "xlsxwriter" (padrão, mais rápido) ou "openpyxl" (write-only, usa lxml quando instalado)
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "xlsxwriter").strip().lower()
+
+# Até esse tamanho a planilha fica em memória; acima disso vai para disco
+SPOOL_MAX_SIZE = 8 << 20
+# Tamanho dos blocos enviados ao cliente
+STREAM_CHUNK_SIZE = 64 << 10
+
+WORKBOOK_OPTIONS = {
+    # Cada linha vai para o arquivo temporário da aba assim que é escrita
+    "constant_memory": True,
+    # Descrições de extrato são texto, nunca fórmulas ou links
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+}
+
+
+def _unique_sheet_name(name: str, used: set) -> str:
+    """Nomes de aba são únicos (sem diferenciar maiúsculas) e limitados a 31 caracteres"""
+    candidate = name[:31]
+    n = 1
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate = name[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def iter_file_chunks(f, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Lê o arquivo em blocos fixos (iterar o arquivo direto quebraria por linhas)"""
+    return iter(lambda: f.read(chunk_size), b"")
+
+
+def _write_typed_rows(ws, rows, column_types):
+    """
+    Escreve as linhas com o método de escrita escolhido uma vez por coluna
+    ("string" / "number"), sem a checagem de tipo célula a célula do write().
+    None vira célula vazia; valores fora do tipo declarado caem no write().
+    """
+    writers = {"string": ws.write_string, "number": ws.write_number}
+    column_writers = [writers.get(t, ws.write) for t in column_types]
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, value in enumerate(row):
+            if value is None:
+                continue
+            try:
+                column_writers[col_idx](row_idx, col_idx, value)
+            except TypeError:
+                ws.write(row_idx, col_idx, value)
+
+
+def _write_xlsxwriter(output, sheets):
+    wb = xlsxwriter.Workbook(output, WORKBOOK_OPTIONS)
+    header_format = wb.add_format({"bold": True})
+    used_names = set()
+
+    for sheet_name, header, rows, *column_types in sheets:
+        ws = wb.add_worksheet(_unique_sheet_name(sheet_name, used_names))
+        ws.write_row(0, 0, header, header_format)
+        if column_types:
+            _write_typed_rows(ws, rows, column_types[0])
+            continue
+        for row_idx, row in enumerate(rows, start=1):
+            ws.write_row(row_idx, 0, row)
+
+    wb.close()
+
+
+def _write_openpyxl(output, sheets):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    # write_only: as linhas vão direto para o XML da aba, sem montar a árvore de células
+    wb = Workbook(write_only=True)
+    bold = Font(bold=True)
+    used_names = set()
+
+    for sheet_name, header, rows, *_ in sheets:
+        ws = wb.create_sheet(_unique_sheet_name(sheet_name, used_names))
+        header_cells = []
+        for value in header:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = bold
+            header_cells.append(cell)
+        ws.append(header_cells)
+        for row in rows:
+            ws.append(row)
+
+    wb.save(output)
+
+
+def build_workbook(sheets) -> tempfile.SpooledTemporaryFile:
+    """
+    Monta o .xlsx a partir de (nome_da_aba, cabeçalho, linhas[, tipos_das_colunas]).
+    As linhas são escritas em streaming (xlsxwriter constant_memory ou openpyxl
+    write-only): precisam vir em ordem e só a linha atual fica em memória.
+    Retorna um SpooledTemporaryFile posicionado no início; quem chama fecha.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+    if EXCEL_ENGINE == "openpyxl" or xlsxwriter is None:
+        _write_openpyxl(output, sheets)
+    else:
+        _write_xlsxwriter(output, sheets)
+    output.seek(0)
+    return output
@@ -3,14 +3,27 @@ Expenses YTD service - 2025 YTD Expenses consolidated view
 """
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from collections import defaultdict
+from operator import attrgetter
 import os
 
 from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
+from .cache import ttl_cache
 
 # Configurações BigQuery
 TABLE_ID = "expenses_ytd_2025"
 FULL_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+RIPPLING_EMPLOYEES_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.rippling_employees"
+
+# (employee_name, category, amount) de cada transação recebida
+_transaction_fields = attrgetter("employee_name", "category", "amount")
+
+# Linhas por página ao percorrer a tabela YTD em streaming
+EXPENSES_PAGE_SIZE = 500
+
+# Anos disponíveis mudam só quando entra o primeiro registro de um ano novo
+YEARS_CACHE_TTL = int(os.getenv("YEARS_CACHE_TTL", "3600"))
 
 # Todas as categorias de despesas
 EXPENSE_CATEGORIES = [
@@ -46,6 +59,8 @@ EXPENSE_CATEGORIES = [
     "Venue - Event",
     "Wellhub Reimbursement",
 ]
+# Só essas categorias têm coluna na tabela; as demais não entram no consolidado
+_EXPENSE_CATEGORY_SET = frozenset(EXPENSE_CATEGORIES)
 
 
 # get_bigquery_client is now imported from bigquery_client module
@@ -64,65 +79,109 @@ def field_name_to_category(field_name: str) -> str:
     return field_name
 
 
-def get_all_expenses(year: int = None) -> List[Dict[str, Any]]:
-    """Busca todos os dados de despesas YTD"""
-    client = get_bigquery_client()
-    
-    # Construir lista de campos
-    category_fields = [category_to_field_name(cat) for cat in EXPENSE_CATEGORIES]
+def _expenses_query(year: int = None, paged: bool = False) -> str:
+    # Campos de categoria já como FLOAT64 sem NULL: o Python recebe floats prontos
+    category_fields = [
+        f"COALESCE(CAST({f} AS FLOAT64), 0) AS {f}" for f in map(category_to_field_name, EXPENSE_CATEGORIES)
+    ]
     
     where_clause = f"WHERE year = {year}" if year else ""
     
-    query = f"""
+    # Com paginação o total vem na própria consulta (janela sobre todas as linhas do filtro)
+    total_column = ", COUNT(*) OVER () AS total_count" if paged else ""
+    page_clause = "LIMIT @limit OFFSET @offset" if paged else ""
+    
+    return f"""
         SELECT 
             employee_name,
             employee_type,
             year,
             {', '.join(category_fields)},
-            total_expenses
+            COALESCE(CAST(total_expenses AS FLOAT64), 0) AS total_expenses
+            {total_column}
         FROM `{FULL_TABLE_ID}`
         {where_clause}
         ORDER BY employee_name
+        {page_clause}
+    """
+
+
+# Posição dos campos de categoria na linha de _expenses_query (depois de nome, tipo e ano)
+_CATEGORY_SLICE = slice(3, 3 + len(EXPENSE_CATEGORIES))
+
+
+def _expense_from_row(row) -> Dict[str, Any]:
+    return {
+        "employee_name": row.employee_name,
+        "employee_type": row.employee_type,
+        "year": row.year,
+        "total": row.total_expenses,
+        "categories": dict(zip(EXPENSE_CATEGORIES, row.values()[_CATEGORY_SLICE]))
+    }
+
+
+def iter_expenses(year: int = None) -> Iterator[Dict[str, Any]]:
+    """
+    Executa a consulta (erros sobem aqui) e devolve um iterador das despesas YTD:
+    as páginas do BigQuery são buscadas e convertidas conforme o iterador avança.
+    """
+    result = get_bigquery_client().query(_expenses_query(year)).result(page_size=EXPENSES_PAGE_SIZE)
+    return map(_expense_from_row, result)
+
+
+def get_all_expenses(
+    year: int = None, limit: Optional[int] = None, offset: int = 0
+) -> Tuple[List[Dict[str, Any]], int]:
     """
+    Busca os dados de despesas YTD (todos, ou uma página com limit/offset).
+    Retorna (despesas, total de registros do filtro). Erros da consulta sobem (viram 500 na API).
+    """
+    client = get_bigquery_client()
     
-    try:
-        result = client.query(query).result()
-        expenses = []
-        for row in result:
-            expense = {
-                "employee_name": row.employee_name,
-                "employee_type": row.employee_type,
-                "year": row.year,
-                "total": float(row.total_expenses) if row.total_expenses else 0.0,
-                "categories": {}
-            }
-            
-            for cat in EXPENSE_CATEGORIES:
-                field_name = category_to_field_name(cat)
-                val = getattr(row, field_name, 0.0)
-                expense["categories"][cat] = float(val) if val else 0.0
-            
-            expenses.append(expense)
-        
-        return expenses
-    except Exception as e:
-        print(f"[ERROR] Failed to fetch expenses: {e}")
-        return []
+    if limit is None:
+        expenses = list(iter_expenses(year))
+        return expenses, len(expenses)
+    
+    params = [
+        bigquery.ScalarQueryParameter("limit", "INT64", limit),
+        bigquery.ScalarQueryParameter("offset", "INT64", offset),
+    ]
+    result = client.query(
+        _expenses_query(year, paged=True), job_config=bigquery.QueryJobConfig(query_parameters=params)
+    ).result()
+    expenses = []
+    total = None
+    for row in result:
+        expenses.append(_expense_from_row(row))
+        if total is None:
+            total = row.total_count
+    
+    if total is None:
+        # Página depois do fim (sem linhas para trazer o total)
+        where_clause = f"WHERE year = {year}" if year else ""
+        count_query = f"SELECT COUNT(*) AS n FROM `{FULL_TABLE_ID}` {where_clause}"
+        total = next(iter(client.query(count_query).result())).n
+    return expenses, total
+
+
+def _float_sum(category: str) -> str:
+    field = category_to_field_name(category)
+    return f"COALESCE(SUM(CAST({field} AS FLOAT64)), 0) as {field}"
 
 
 def get_expenses_summary(year: int = None) -> Dict[str, Any]:
     """Retorna resumo consolidado das despesas por categoria"""
     client = get_bigquery_client()
     
-    # Construir lista de SUM para cada categoria
-    category_sums = [f"SUM({category_to_field_name(cat)}) as {category_to_field_name(cat)}" for cat in EXPENSE_CATEGORIES]
+    # SUM de cada categoria já como FLOAT64 sem NULL (categorias vêm primeiro na linha)
+    category_sums = [_float_sum(cat) for cat in EXPENSE_CATEGORIES]
     
     where_clause = f"WHERE year = {year}" if year else ""
     
     query = f"""
         SELECT 
             {', '.join(category_sums)},
-            SUM(total_expenses) as grand_total,
+            COALESCE(SUM(CAST(total_expenses AS FLOAT64)), 0) as grand_total,
             COUNT(*) as employee_count
         FROM `{FULL_TABLE_ID}`
         {where_clause}
@@ -131,18 +190,11 @@ def get_expenses_summary(year: int = None) -> Dict[str, Any]:
     try:
         result = client.query(query).result()
         for row in result:
-            summary = {
-                "grand_total": float(row.grand_total) if row.grand_total else 0.0,
+            return {
+                "grand_total": row.grand_total,
                 "employee_count": row.employee_count,
-                "by_category": {}
+                "by_category": dict(zip(EXPENSE_CATEGORIES, row.values()))
             }
-            
-            for cat in EXPENSE_CATEGORIES:
-                field_name = category_to_field_name(cat)
-                val = getattr(row, field_name, 0.0)
-                summary["by_category"][cat] = float(val) if val else 0.0
-            
-            return summary
     except Exception as e:
         print(f"[ERROR] Failed to fetch summary: {e}")
         return {"grand_total": 0, "employee_count": 0, "by_category": {}}
@@ -152,7 +204,7 @@ def get_expenses_by_employee_type(year: int = None) -> Dict[str, Any]:
     """Retorna despesas agrupadas por tipo de funcionário"""
     client = get_bigquery_client()
     
-    category_sums = [f"SUM({category_to_field_name(cat)}) as {category_to_field_name(cat)}" for cat in EXPENSE_CATEGORIES]
+    category_sums = [_float_sum(cat) for cat in EXPENSE_CATEGORIES]
     
     where_clause = f"WHERE year = {year}" if year else ""
     
@@ -160,7 +212,7 @@ def get_expenses_by_employee_type(year: int = None) -> Dict[str, Any]:
         SELECT 
             employee_type,
             {', '.join(category_sums)},
-            SUM(total_expenses) as total,
+            COALESCE(SUM(CAST(total_expenses AS FLOAT64)), 0) as total,
             COUNT(*) as employee_count
         FROM `{FULL_TABLE_ID}`
         {where_clause}
@@ -172,19 +224,13 @@ def get_expenses_by_employee_type(year: int = None) -> Dict[str, Any]:
         result = client.query(query).result()
         by_type = []
         for row in result:
-            type_data = {
+            by_type.append({
                 "employee_type": row.employee_type,
-                "total": float(row.total) if row.total else 0.0,
+                "total": row.total,
                 "employee_count": row.employee_count,
-                "categories": {}
-            }
-            
-            for cat in EXPENSE_CATEGORIES:
-                field_name = category_to_field_name(cat)
-                val = getattr(row, field_name, 0.0)
-                type_data["categories"][cat] = float(val) if val else 0.0
-            
-            by_type.append(type_data)
+                # Categorias vêm logo depois de employee_type
+                "categories": dict(zip(EXPENSE_CATEGORIES, row.values()[1:]))
+            })
         
         return by_type
     except Exception as e:
@@ -192,38 +238,112 @@ def get_expenses_by_employee_type(year: int = None) -> Dict[str, Any]:
         return []
 
 
+def get_expenses_bundle(year: int = None) -> Dict[str, Any]:
+    """
+    Dados da tela YTD numa única consulta: as despesas por funcionário, e o resumo por
+    categoria e por tipo (mesmo formato de get_expenses_summary / get_expenses_by_employee_type)
+    agregados a partir delas em Python. Anos vêm do cache.
+    """
+    expenses = list(iter_expenses(year))
+    
+    summary = {
+        "grand_total": 0.0,
+        "employee_count": len(expenses),
+        "by_category": dict.fromkeys(EXPENSE_CATEGORIES, 0.0)
+    }
+    types: Dict[Any, Dict[str, Any]] = {}
+    for expense in expenses:
+        type_data = types.get(expense["employee_type"])
+        if type_data is None:
+            type_data = types[expense["employee_type"]] = {
+                "employee_type": expense["employee_type"],
+                "total": 0.0,
+                "employee_count": 0,
+                "categories": dict.fromkeys(EXPENSE_CATEGORIES, 0.0)
+            }
+        type_data["total"] += expense["total"]
+        type_data["employee_count"] += 1
+        summary["grand_total"] += expense["total"]
+        for cat, val in expense["categories"].items():
+            summary["by_category"][cat] += val
+            type_data["categories"][cat] += val
+    
+    # Mesma ordem do ORDER BY employee_type (NULL primeiro)
+    by_type = sorted(types.values(), key=lambda t: (t["employee_type"] is not None, t["employee_type"] or ""))
+    
+    return {
+        "expenses": expenses,
+        "summary": summary,
+        "by_type": by_type,
+        "categories": EXPENSE_CATEGORIES,
+        "years": get_available_years()
+    }
+
+
 def get_expense_categories() -> List[str]:
     """Retorna lista de categorias de despesas"""
     return EXPENSE_CATEGORIES
 
 
-def get_available_years() -> List[int]:
-    """Retorna lista de anos disponíveis na tabela"""
-    client = get_bigquery_client()
-    
+@ttl_cache(YEARS_CACHE_TTL)
+def _query_available_years() -> List[int]:
+    """Anos distintos da tabela (cacheado; invalidado quando um ano ganha registros)"""
     query = f"""
         SELECT DISTINCT year
         FROM `{FULL_TABLE_ID}`
         WHERE year IS NOT NULL
         ORDER BY year DESC
     """
-    
+    return [row.year for row in get_bigquery_client().query(query).result()]
+
+
+def get_available_years() -> List[int]:
+    """Retorna lista de anos disponíveis na tabela"""
     try:
-        result = client.query(query).result()
-        years = [row.year for row in result]
+        years = _query_available_years()
         return years if years else [2025]  # Default to 2025 if no years found
     except Exception as e:
         print(f"[ERROR] Failed to fetch years: {e}")
         return [2025]
 
 
-def add_expenses_to_consolidated(transactions: List[Dict], year: int) -> Dict[str, Any]:
+def _no_valid_transactions(action: str, unknown_categories) -> str:
+    error = f"No valid transactions to {action}"
+    if unknown_categories:
+        error += f" (unknown categories: {', '.join(sorted(unknown_categories))})"
+    return error
+
+
+def _employee_rows_param(expenses_by_employee: Dict[str, Dict[str, float]]) -> bigquery.ArrayQueryParameter:
+    """
+    @rows: uma STRUCT por funcionário com o valor de cada campo de categoria
+    (NULL quando a categoria não veio nas transações) e o total enviado,
+    somado só das categorias que viram colunas.
+    """
+    rows = []
+    for employee_name, categories_amounts in expenses_by_employee.items():
+        fields = [bigquery.ScalarQueryParameter("employee_name", "STRING", employee_name)]
+        amounts = [categories_amounts.get(cat) for cat in EXPENSE_CATEGORIES]
+        fields.extend(
+            bigquery.ScalarQueryParameter(category_to_field_name(cat), "FLOAT64", amount)
+            for cat, amount in zip(EXPENSE_CATEGORIES, amounts)
+        )
+        total = sum(amount for amount in amounts if amount is not None)
+        fields.append(bigquery.ScalarQueryParameter("total", "FLOAT64", total))
+        rows.append(bigquery.StructQueryParameter(None, *fields))
+    return bigquery.ArrayQueryParameter("rows", "STRUCT", rows)
+
+
+def add_expenses_to_consolidated(transactions: List[Any], year: int) -> Dict[str, Any]:
     """
     Adiciona transações do cartão de crédito à base consolidada.
     Agrupa por funcionário e categoria, somando os valores.
+    Um único MERGE: soma nas linhas existentes e cria as que faltam
+    (employee_type vem de rippling_employees, Partner por padrão).
     
     Args:
-        transactions: Lista de transações com employee_name, category e amount
+        transactions: Lista de transações com os atributos employee_name, category e amount
+            (os próprios modelos da requisição, sem cópia)
         year: Ano para registrar as despesas
         
     Returns:
@@ -232,125 +352,76 @@ def add_expenses_to_consolidated(transactions: List[Dict], year: int) -> Dict[st
     client = get_bigquery_client()
     
     # Agrupar transações por funcionário e categoria
-    expenses_by_employee: Dict[str, Dict[str, float]] = {}
+    expenses_by_employee: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    unknown_categories = set()
     
-    for tx in transactions:
-        employee = tx.get('employee_name', '').strip()
-        category = tx.get('category', '').strip()
-        amount = float(tx.get('amount', 0))
+    for employee, category, amount in map(_transaction_fields, transactions):
+        employee = (employee or '').strip()
+        category = (category or '').strip()
+        amount = float(amount or 0)
         
         if not employee or not category:
             continue
-            
-        if employee not in expenses_by_employee:
-            expenses_by_employee[employee] = {}
+        if category not in _EXPENSE_CATEGORY_SET:
+            unknown_categories.add(category)
+            continue
         
-        if category not in expenses_by_employee[employee]:
-            expenses_by_employee[employee][category] = 0.0
-            
         expenses_by_employee[employee][category] += amount
     
     if not expenses_by_employee:
-        return {"success": False, "error": "No valid transactions to process"}
+        return {"success": False, "error": _no_valid_transactions("process", unknown_categories)}
+    
+    all_category_fields = [category_to_field_name(c) for c in EXPENSE_CATEGORIES]
+    # Total recalculado a partir dos valores atuais das categorias (antes do UPDATE)
+    total_calc = " + ".join([f"COALESCE(t.{f}, 0)" for f in all_category_fields])
+    set_clauses = [f"{f} = IF(s.{f} IS NULL, t.{f}, COALESCE(t.{f}, 0) + s.{f})" for f in all_category_fields]
+    insert_values = [f"COALESCE(s.{f}, 0)" for f in all_category_fields]
+    
+    merge_query = f"""
+        MERGE `{FULL_TABLE_ID}` t
+        USING (
+            SELECT s.*, COALESCE(e.employee_type, 'Partner') AS employee_type
+            FROM UNNEST(@rows) AS s
+            LEFT JOIN (
+                SELECT rippling_name, ANY_VALUE(employee_type) AS employee_type
+                FROM `{RIPPLING_EMPLOYEES_TABLE_ID}`
+                GROUP BY rippling_name
+            ) e ON e.rippling_name = s.employee_name
+        ) s
+        ON t.employee_name = s.employee_name AND t.year = @year
+        WHEN MATCHED THEN UPDATE SET
+            {', '.join(set_clauses)},
+            total_expenses = {total_calc} + s.total
+        WHEN NOT MATCHED THEN INSERT
+            (employee_name, employee_type, year, total_expenses, {', '.join(all_category_fields)})
+            VALUES (s.employee_name, s.employee_type, @year, s.total, {', '.join(insert_values)})
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            _employee_rows_param(expenses_by_employee),
+            bigquery.ScalarQueryParameter("year", "INT64", year),
+        ]
+    )
     
-    # Para cada funcionário, atualizar ou criar registro
     updated_count = 0
     created_count = 0
     errors = []
+    try:
+        job = client.query(merge_query, job_config=job_config)
+        job.result()
+        stats = job.dml_stats
+        if stats is not None:
+            updated_count = stats.updated_row_count or 0
+            created_count = stats.inserted_row_count or 0
+        else:
+            updated_count = job.num_dml_affected_rows or 0
+    except Exception as e:
+        errors.append(str(e))
+        print(f"[ERROR] Failed to merge consolidated expenses: {e}")
     
-    for employee_name, categories_amounts in expenses_by_employee.items():
-        try:
-            # Verificar se o funcionário já existe no ano
-            check_query = f"""
-                SELECT employee_name, employee_type
-                FROM `{FULL_TABLE_ID}`
-                WHERE employee_name = @employee_name AND year = @year
-            """
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("employee_name", "STRING", employee_name),
-                    bigquery.ScalarQueryParameter("year", "INT64", year),
-                ]
-            )
-            result = client.query(check_query, job_config=job_config).result()
-            existing = list(result)
-            
-            if existing:
-                # Atualizar registro existente - somar valores às categorias
-                set_clauses = []
-                params = [
-                    bigquery.ScalarQueryParameter("employee_name", "STRING", employee_name),
-                    bigquery.ScalarQueryParameter("year", "INT64", year),
-                ]
-                
-                for cat, amount in categories_amounts.items():
-                    field_name = category_to_field_name(cat)
-                    if field_name:
-                        param_name = f"amt_{field_name}"
-                        set_clauses.append(f"{field_name} = COALESCE({field_name}, 0) + @{param_name}")
-                        params.append(bigquery.ScalarQueryParameter(param_name, "FLOAT64", amount))
-                
-                # Recalcular o total
-                all_category_fields = [category_to_field_name(c) for c in EXPENSE_CATEGORIES]
-                total_calc = " + ".join([f"COALESCE({f}, 0)" for f in all_category_fields])
-                
-                if set_clauses:
-                    update_query = f"""
-                        UPDATE `{FULL_TABLE_ID}`
-                        SET {', '.join(set_clauses)},
-                            total_expenses = (SELECT {total_calc} FROM `{FULL_TABLE_ID}` WHERE employee_name = @employee_name AND year = @year) + {sum(categories_amounts.values())}
-                        WHERE employee_name = @employee_name AND year = @year
-                    """
-                    job_config = bigquery.QueryJobConfig(query_parameters=params)
-                    client.query(update_query, job_config=job_config).result()
-                    updated_count += 1
-            else:
-                # Criar novo registro para este funcionário
-                # Primeiro, buscar o employee_type da tabela rippling_employees
-                type_query = """
-                    SELECT employee_type
-                    FROM `automatic-bond-462415-h6.finance.rippling_employees`
-                    WHERE rippling_name = @employee_name
-                    LIMIT 1
-                """
-                type_config = bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ScalarQueryParameter("employee_name", "STRING", employee_name),
-                    ]
-                )
-                type_result = client.query(type_query, job_config=type_config).result()
-                type_rows = list(type_result)
-                employee_type = type_rows[0].employee_type if type_rows else "Partner"  # Default to Partner for cardholders
-                
-                # Construir campos para INSERT
-                fields = ["employee_name", "employee_type", "year", "total_expenses"]
-                values = [employee_name, employee_type, year, sum(categories_amounts.values())]
-                
-                for cat in EXPENSE_CATEGORIES:
-                    field_name = category_to_field_name(cat)
-                    fields.append(field_name)
-                    values.append(categories_amounts.get(cat, 0.0))
-                
-                # Usar SQL INSERT com parâmetros
-                placeholders = ", ".join([f"@p{i}" for i in range(len(values))])
-                insert_query = f"""
-                    INSERT INTO `{FULL_TABLE_ID}` ({', '.join(fields)})
-                    VALUES ({placeholders})
-                """
-                
-                params = [
-                    bigquery.ScalarQueryParameter(f"p{i}", 
-                        "STRING" if isinstance(v, str) else "INT64" if isinstance(v, int) and i == 2 else "FLOAT64", 
-                        v
-                    ) for i, v in enumerate(values)
-                ]
-                job_config = bigquery.QueryJobConfig(query_parameters=params)
-                client.query(insert_query, job_config=job_config).result()
-                created_count += 1
-                
-        except Exception as e:
-            errors.append(f"{employee_name}: {str(e)}")
-            print(f"[ERROR] Failed to update {employee_name}: {e}")
+    # Um ano novo pode ter ganho registros
+    if not errors:
+        _query_available_years.cache_clear()
     
     return {
         "success": len(errors) == 0,
@@ -358,6 +429,7 @@ def add_expenses_to_consolidated(transactions: List[Dict], year: int) -> Dict[st
         "created": created_count,
         "total_employees": len(expenses_by_employee),
         "total_transactions": len(transactions),
+        "unknown_categories": sorted(unknown_categories),
         "errors": errors
     }
 
@@ -366,9 +438,10 @@ def undo_expenses_from_consolidated(transactions: list, year: int) -> dict:
     """
     Undo/subtract the transactions from the consolidated database.
     This reverses the effect of add_expenses_to_consolidated.
+    All employees are updated by a single UPDATE ... FROM UNNEST(@rows).
     
     Args:
-        transactions: List of dicts with employee_name, category, and amount
+        transactions: List of objects with employee_name, category, and amount attributes
         year: The year for the expenses
         
     Returns:
@@ -380,69 +453,55 @@ def undo_expenses_from_consolidated(transactions: list, year: int) -> dict:
     client = get_bigquery_client()
     
     # Agrupar por funcionário e categoria, somando os valores
-    expenses_by_employee = {}
-    for tx in transactions:
-        employee = tx.get("employee_name")
-        category = tx.get("category")
-        amount = tx.get("amount", 0)
-        
+    expenses_by_employee = defaultdict(lambda: defaultdict(float))
+    unknown_categories = set()
+    for employee, category, amount in map(_transaction_fields, transactions):
         if not employee or not category:
             continue
-            
-        if employee not in expenses_by_employee:
-            expenses_by_employee[employee] = {}
+        if category not in _EXPENSE_CATEGORY_SET:
+            unknown_categories.add(category)
+            continue
         
-        if category not in expenses_by_employee[employee]:
-            expenses_by_employee[employee][category] = 0.0
-            
         expenses_by_employee[employee][category] += amount
     
     if not expenses_by_employee:
-        return {"success": False, "error": "No valid transactions to undo"}
+        return {"success": False, "error": _no_valid_transactions("undo", unknown_categories)}
+    
+    all_category_fields = [category_to_field_name(c) for c in EXPENSE_CATEGORIES]
+    total_calc = " + ".join([f"COALESCE(t.{f}, 0)" for f in all_category_fields])
+    # Subtrair ao invés de somar (sem deixar a categoria negativa)
+    set_clauses = [
+        f"{f} = IF(s.{f} IS NULL, t.{f}, GREATEST(0, COALESCE(t.{f}, 0) - s.{f}))" for f in all_category_fields
+    ]
+    
+    update_query = f"""
+        UPDATE `{FULL_TABLE_ID}` t
+        SET {', '.join(set_clauses)},
+            total_expenses = {total_calc} - s.total
+        FROM UNNEST(@rows) AS s
+        WHERE t.employee_name = s.employee_name AND t.year = @year
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            _employee_rows_param(expenses_by_employee),
+            bigquery.ScalarQueryParameter("year", "INT64", year),
+        ]
+    )
     
-    # Para cada funcionário, subtrair os valores
     updated_count = 0
     errors = []
-    
-    for employee_name, categories_amounts in expenses_by_employee.items():
-        try:
-            # Subtrair valores das categorias
-            set_clauses = []
-            params = [
-                bigquery.ScalarQueryParameter("employee_name", "STRING", employee_name),
-                bigquery.ScalarQueryParameter("year", "INT64", year),
-            ]
-            
-            for cat, amount in categories_amounts.items():
-                field_name = category_to_field_name(cat)
-                if field_name:
-                    param_name = f"amt_{field_name}"
-                    # Subtrair ao invés de somar
-                    set_clauses.append(f"{field_name} = GREATEST(0, COALESCE({field_name}, 0) - @{param_name})")
-                    params.append(bigquery.ScalarQueryParameter(param_name, "FLOAT64", amount))
-            
-            # Recalcular o total
-            all_category_fields = [category_to_field_name(c) for c in EXPENSE_CATEGORIES]
-            total_calc = " + ".join([f"COALESCE({f}, 0)" for f in all_category_fields])
-            
-            if set_clauses:
-                update_query = f"""
-                    UPDATE `{FULL_TABLE_ID}`
-                    SET {', '.join(set_clauses)},
-                        total_expenses = (SELECT {total_calc} FROM `{FULL_TABLE_ID}` WHERE employee_name = @employee_name AND year = @year) - {sum(categories_amounts.values())}
-                    WHERE employee_name = @employee_name AND year = @year
-                """
-                job_config = bigquery.QueryJobConfig(query_parameters=params)
-                client.query(update_query, job_config=job_config).result()
-                updated_count += 1
-                
-        except Exception as e:
-            errors.append(f"{employee_name}: {str(e)}")
-            print(f"[ERROR] Failed to undo for {employee_name}: {e}")
+    try:
+        job = client.query(update_query, job_config=job_config)
+        job.result()
+        updated_count = job.num_dml_affected_rows or 0
+    except Exception as e:
+        errors.append(str(e))
+        print(f"[ERROR] Failed to undo consolidated expenses: {e}")
     
     return {
         "success": len(errors) == 0,
         "updated": updated_count,
         "total_employees": len(expenses_by_employee),
+        "unknown_categories": sorted(unknown_categories),
         "errors": errors
     }
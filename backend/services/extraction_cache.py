@@ -0,0 +1,109 @@
+"""
+Cache dos resultados de extração de PDF: LRU em memória na frente de um cache em disco.
+A chave é o hash (blake2b) do conteúdo do arquivo + o tipo de cartão, então o
+"Extract" seguido de "Export" (ou um novo upload do mesmo extrato) não reprocessa o PDF.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import orjson
+
+EXTRACTION_CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "expenses_extraction_cache")
+)
+# Limite total do diretório; 0 desliga o cache
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Incrementar quando a saída dos extractors mudar, para invalidar resultados antigos
+EXTRACTION_CACHE_VERSION = "1"
+# Resultados mantidos em memória (por processo); 0 desliga
+EXTRACTION_MEMORY_CACHE_SIZE = int(os.getenv("EXTRACTION_MEMORY_CACHE_SIZE", "128"))
+
+_prune_lock = threading.Lock()
+_memory_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def file_digest(fileobj) -> str:
+    """Hash do arquivo aberto (lido em blocos); volta o cursor para o início"""
+    fileobj.seek(0)
+    digest = hashlib.file_digest(fileobj, "blake2b").hexdigest()
+    fileobj.seek(0)
+    return digest
+
+
+def _cache_path(card_type: str, digest: str) -> str:
+    return os.path.join(EXTRACTION_CACHE_DIR, f"v{EXTRACTION_CACHE_VERSION}-{card_type}-{digest}.json")
+
+
+def _remember(card_type: str, digest: str, result: dict):
+    if EXTRACTION_MEMORY_CACHE_SIZE <= 0:
+        return
+    key = (card_type, digest)
+    with _memory_lock:
+        _memory_cache[key] = result
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > EXTRACTION_MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def get_cached_extraction(card_type: str, digest: str) -> Optional[dict]:
+    """Resultado já extraído (o mesmo dict é compartilhado entre requisições: não alterar)"""
+    with _memory_lock:
+        result = _memory_cache.get((card_type, digest))
+        if result is not None:
+            _memory_cache.move_to_end((card_type, digest))
+            return result
+    
+    if EXTRACTION_CACHE_MAX_BYTES <= 0:
+        return None
+    path = _cache_path(card_type, digest)
+    try:
+        with open(path, "rb") as f:
+            result = orjson.loads(f.read())
+        # Marca como usado recentemente (a limpeza remove pelos mais antigos)
+        os.utime(path)
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    _remember(card_type, digest, result)
+    return result
+
+
+def store_extraction(card_type: str, digest: str, result: dict):
+    _remember(card_type, digest, result)
+    if EXTRACTION_CACHE_MAX_BYTES <= 0:
+        return
+    path = _cache_path(card_type, digest)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(result))
+        os.replace(tmp_path, path)
+    except (OSError, TypeError) as e:
+        print(f"[WARN] Could not cache extraction result: {e}")
+        return
+    _prune()
+
+
+def _prune():
+    """Remove os resultados mais antigos quando o diretório passa do limite"""
+    with _prune_lock:
+        try:
+            entries = [e for e in os.scandir(EXTRACTION_CACHE_DIR) if e.name.endswith(".json")]
+            stats = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= EXTRACTION_CACHE_MAX_BYTES:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
@@ -2,16 +2,22 @@
 Michael Credit Card processor - categorizes expenses using AI
 """
 import pandas as pd
+import tempfile
 from io import BytesIO
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union, BinaryIO
 import json
 import os
+import asyncio
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 
+from .xlsx_fast import write_sheet
+
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Mesmas categorias do categorizer.py
 EXPENSE_CATEGORIES = [
@@ -153,62 +159,109 @@ Example: ["Airfare", "Lodging", "Meals & Entertainment"]
     return prompt
 
 
+LLM_BATCH_SIZE = 25
+# Máximo de chamadas simultâneas ao modelo na versão async
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+
+def build_llm_request(batch: List[Dict]) -> Dict:
+    """Parâmetros da chamada de chat completion para um batch"""
+    return {
+        "model": "gpt-4.1",
+        "messages": [
+            {"role": "system", "content": "You are an expense categorization assistant. Respond ONLY with valid JSON arrays."},
+            {"role": "user", "content": build_llm_prompt(batch)}
+        ],
+        "temperature": 0.1,
+        "max_tokens": 2000,
+    }
+
+
+def parse_llm_batch(result_text: str, expected: int) -> List[str]:
+    """Lê o array JSON do modelo, ajustando para `expected` itens"""
+    batch_categories = json.loads(result_text.strip())
+    
+    if not isinstance(batch_categories, list):
+        raise ValueError("Response is not a JSON array")
+    
+    # Ajusta tamanho se necessário
+    if len(batch_categories) > expected:
+        batch_categories = batch_categories[:expected]
+    elif len(batch_categories) < expected:
+        batch_categories += ["Miscellaneous"] * (expected - len(batch_categories))
+    return batch_categories
+
+
 def categorize_with_llm(items: List[Dict]) -> List[str]:
     """Chama o LLM para categorizar itens"""
     if not items:
         return []
     
-    batch_size = 25
     all_categories = []
     
-    for i in range(0, len(items), batch_size):
-        batch = items[i:i + batch_size]
-        prompt = build_llm_prompt(batch)
+    for i in range(0, len(items), LLM_BATCH_SIZE):
+        batch = items[i:i + LLM_BATCH_SIZE]
         
         try:
-            response = client.chat.completions.create(
-                model="gpt-4.1",
-                messages=[
-                    {"role": "system", "content": "You are an expense categorization assistant. Respond ONLY with valid JSON arrays."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )
-            
-            result_text = response.choices[0].message.content.strip()
-            batch_categories = json.loads(result_text)
-            
-            if not isinstance(batch_categories, list):
-                raise ValueError("Response is not a JSON array")
-            
-            # Ajusta tamanho se necessário
-            if len(batch_categories) != len(batch):
-                if len(batch_categories) > len(batch):
-                    batch_categories = batch_categories[:len(batch)]
-                else:
-                    batch_categories += ["Miscellaneous"] * (len(batch) - len(batch_categories))
+            response = client.chat.completions.create(**build_llm_request(batch))
+            batch_categories = parse_llm_batch(response.choices[0].message.content, len(batch))
                     
         except Exception as e:
             print(f"[ERROR] LLM categorization failed: {e}")
             batch_categories = ["Miscellaneous"] * len(batch)
         
         all_categories.extend(batch_categories)
-        print(f"Categorized batch {i // batch_size + 1}: {len(batch_categories)} items")
+        print(f"Categorized batch {i // LLM_BATCH_SIZE + 1}: {len(batch_categories)} items")
     
     return all_categories
 
 
-def process_michael_file(file_content: bytes, filename: str) -> Dict[str, Any]:
+@retry(wait=wait_exponential(multiplier=1, max=30), stop=stop_after_attempt(3), reraise=True)
+async def _complete_async(batch: List[Dict]) -> str:
+    """Uma chamada ao modelo, com retry e backoff exponencial"""
+    response = await async_client.chat.completions.create(**build_llm_request(batch))
+    return response.choices[0].message.content
+
+
+async def categorize_with_llm_async(
+    items: List[Dict],
+    batch_size: int = LLM_BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY
+) -> List[str]:
+    """Como categorize_with_llm, mas com até `concurrency` batches em paralelo (ordem preservada)"""
+    if not items:
+        return []
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run_batch(batch_no: int, batch: List[Dict]) -> List[str]:
+        async with semaphore:
+            try:
+                batch_categories = parse_llm_batch(await _complete_async(batch), len(batch))
+            except Exception as e:
+                print(f"[ERROR] LLM categorization failed: {e}")
+                batch_categories = ["Miscellaneous"] * len(batch)
+        print(f"Categorized batch {batch_no}: {len(batch_categories)} items")
+        return batch_categories
+    
+    results = await asyncio.gather(*(
+        run_batch(i // batch_size + 1, items[i:i + batch_size])
+        for i in range(0, len(items), batch_size)
+    ))
+    return [category for batch in results for category in batch]
+
+
+def process_michael_file(file_content: Union[bytes, str, BinaryIO], filename: str) -> Dict[str, Any]:
     """
     Processa arquivo Excel do Michael e retorna transações com categorias originais.
     Se a categoria do arquivo for uma categoria válida do sistema, usa diretamente.
     """
-    # Ler arquivo
+    # Ler arquivo (bytes, caminho ou arquivo aberto, ex.: UploadFile.file)
+    source = BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
     if filename.endswith('.csv'):
-        df = pd.read_csv(BytesIO(file_content))
+        df = pd.read_csv(source)
     else:
-        df = pd.read_excel(BytesIO(file_content))
+        df = pd.read_excel(source)
     
     # Debug: mostrar colunas disponíveis
     print(f"[DEBUG] Colunas do arquivo: {df.columns.tolist()}")
@@ -225,64 +278,69 @@ def process_michael_file(file_content: bytes, filename: str) -> Dict[str, Any]:
     # Resetar índice para garantir IDs únicos
     df = df.reset_index(drop=True)
     
+    # Colunas já convertidas de uma vez (coluna ausente vira vazio)
+    n = len(df)
+    
+    def as_text(col: str, na: Optional[str] = None) -> pd.Series:
+        if col not in df.columns:
+            return pd.Series([''] * n, dtype=object)
+        values = df[col].map(str)
+        return values if na is None else values.where(df[col].notna(), na)
+    
+    amounts = df['Amount'].astype(float).fillna(0) if 'Amount' in df.columns else pd.Series([0.0] * n)
+    file_categories = as_text('Category', na='')
+    
+    # Categoria do arquivo já válida no sistema (ex: "Airfare", "Lodging") vira ai_category;
+    # senão (ex: "Travel-Airline") fica como amex_category para processar via AI
+    is_valid = file_categories.isin(valid_categories_set)
+    ai_categories = file_categories.where(is_valid, '')
+    amex_categories = file_categories.where(~is_valid, '')
+    notes = as_text('Unnamed: 0') if 'Unnamed: 0' in df.columns else as_text('Notes')
+    
     # Converter para lista de transações
-    transactions = []
-    for idx, row in df.iterrows():
-        ext_details = str(row.get('Extended Details', '')) if pd.notna(row.get('Extended Details')) else ''
-        file_category = str(row.get('Category', '')) if pd.notna(row.get('Category')) else ''
-        
-        # Verificar se a categoria do arquivo é uma categoria válida do sistema
-        # Se for (ex: "Airfare", "Lodging"), usa como ai_category
-        # Se não for (ex: "Travel-Airline"), guarda como amex_category para processar via AI
-        ai_category = ""
-        amex_category = ""
-        
-        if file_category in valid_categories_set:
-            # Categoria já é válida - usar diretamente
-            ai_category = file_category
-            print(f"[DEBUG] TX {idx+1}: Category '{file_category}' is valid, using as ai_category")
-        else:
-            # Categoria do Amex original - precisa ser mapeada/processada
-            amex_category = file_category
-            if idx < 3:
-                print(f"[DEBUG] TX {idx+1}: Category '{file_category}' needs mapping, stored as amex_category")
-        
-        tx = {
-            "id": idx + 1,
-            "date": str(row.get('Date', '')),
-            "description": str(row.get('Description', '')),
-            "notes": str(row.get('Unnamed: 0', row.get('Notes', ''))),
-            "amount": float(row.get('Amount', 0)) if pd.notna(row.get('Amount')) else 0,
+    transactions = [
+        {
+            "id": idx,
+            "date": date,
+            "description": description,
+            "notes": note,
+            "amount": amount,
             "extended_details": ext_details,
             "amex_category": amex_category,
-            "city_state": str(row.get('City/State', '')) if pd.notna(row.get('City/State')) else '',
+            "city_state": city_state,
             "ai_category": ai_category
         }
-        
-        transactions.append(tx)
+        for idx, date, description, note, amount, ext_details, amex_category, city_state, ai_category in zip(
+            range(1, n + 1),
+            as_text('Date').tolist(),
+            as_text('Description').tolist(),
+            notes.tolist(),
+            amounts.tolist(),
+            as_text('Extended Details', na='').tolist(),
+            amex_categories.tolist(),
+            as_text('City/State', na='').tolist(),
+            ai_categories.tolist()
+        )
+    ]
     
-    already_categorized = sum(1 for t in transactions if t["ai_category"])
+    already_categorized = int((ai_categories != '').sum())
     print(f"[DEBUG] Total: {len(transactions)} transactions, {already_categorized} already categorized from file")
     
     return {
         "transactions": transactions,
         "total_transactions": len(transactions),
-        "total_amount": sum(t["amount"] for t in transactions),
+        "total_amount": float(amounts.sum()),
         "already_categorized": already_categorized
     }
 
 
-def categorize_michael_transactions(transactions: List[Dict]) -> List[Dict]:
+def apply_rule_categories(transactions: List[Dict]) -> List[int]:
     """
-    Categoriza transações usando regras + AI.
-    Mantém categorias que já vieram preenchidas do arquivo.
+    1ª passada: regras determinísticas (apenas para os que não têm ai_category).
+    Retorna os índices que precisam do LLM.
     """
-    if not transactions:
-        return transactions
-    
     uncategorized_indices = []
     
-    # 1ª passada: regras determinísticas (apenas para os que não têm ai_category)
     for i, tx in enumerate(transactions):
         # Se já tem ai_category válida (veio do arquivo), mantém
         if tx.get("ai_category") and tx["ai_category"].strip():
@@ -299,96 +357,101 @@ def categorize_michael_transactions(transactions: List[Dict]) -> List[Dict]:
     
     already_done = len(transactions) - len([t for t in transactions if not t.get("ai_category")])
     print(f"Rule-based: {already_done} categorized (including from file), {len(uncategorized_indices)} need AI")
-    
-    if not uncategorized_indices:
-        return transactions
-    
-    # 2ª passada: LLM para os não categorizados
-    items_for_llm = [
+    return uncategorized_indices
+
+
+def items_for_llm(transactions: List[Dict], uncategorized_indices: List[int]) -> List[Dict]:
+    return [
         {
             "extended_details": transactions[i].get("extended_details", ""),
             "amex_category": transactions[i].get("amex_category", "")
         }
         for i in uncategorized_indices
     ]
-    
-    llm_categories = categorize_with_llm(items_for_llm)
-    
-    # 3ª passada: aplica categorias do LLM
+
+
+def apply_llm_categories(transactions: List[Dict], uncategorized_indices: List[int], llm_categories: List[str]):
+    """3ª passada: aplica categorias do LLM"""
     for idx, tx_index in enumerate(uncategorized_indices):
         raw_cat = llm_categories[idx] if idx < len(llm_categories) else "Miscellaneous"
         normalized = normalize_category(raw_cat)
         transactions[tx_index]["ai_category"] = normalized or "Miscellaneous"
-    
-    return transactions
 
 
-def export_michael_to_excel(transactions: List[Dict]) -> bytes:
+def categorize_michael_transactions(transactions: List[Dict]) -> List[Dict]:
     """
-    Exporta transações categorizadas para Excel
+    Categoriza transações usando regras + AI.
+    Mantém categorias que já vieram preenchidas do arquivo.
     """
-    # Criar DataFrame
-    df = pd.DataFrame(transactions)
-    
-    # Reordenar e renomear colunas
-    columns_order = ['date', 'description', 'notes', 'amount', 'extended_details', 'amex_category', 'ai_category', 'city_state']
-    columns_rename = {
-        'date': 'Date',
-        'description': 'Description',
-        'notes': 'Notes',
-        'amount': 'Amount',
-        'extended_details': 'Extended Details',
-        'amex_category': 'Original Category',
-        'ai_category': 'AI Category',
-        'city_state': 'City/State'
-    }
+    if not transactions:
+        return transactions
     
-    df = df[[c for c in columns_order if c in df.columns]]
-    df = df.rename(columns=columns_rename)
+    uncategorized_indices = apply_rule_categories(transactions)
+    if not uncategorized_indices:
+        return transactions
     
-    # Criar Excel
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Categorized Expenses')
-        
-        # Formatar
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from openpyxl.utils import get_column_letter
-        
-        worksheet = writer.sheets['Categorized Expenses']
-        
-        # Ajustar largura das colunas
-        for idx, col in enumerate(df.columns, 1):
-            max_length = max(
-                df[col].astype(str).apply(len).max(),
-                len(str(col))
-            ) + 2
-            worksheet.column_dimensions[get_column_letter(idx)].width = min(max_length, 40)
-        
-        # Header style
-        header_fill = PatternFill(start_color='1e3a5f', end_color='1e3a5f', fill_type='solid')
-        header_font = Font(color='FFFFFF', bold=True)
-        
-        for cell in worksheet[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-        
-        # Number format for Amount column
-        amount_col = None
-        for idx, col in enumerate(df.columns, 1):
-            if col == 'Amount':
-                amount_col = idx
-                break
-        
-        if amount_col:
-            for row in range(2, len(df) + 2):
-                cell = worksheet.cell(row=row, column=amount_col)
-                if isinstance(cell.value, (int, float)):
-                    cell.number_format = '#,##0.00'
+    # 2ª passada: LLM para os não categorizados
+    llm_categories = categorize_with_llm(items_for_llm(transactions, uncategorized_indices))
+    apply_llm_categories(transactions, uncategorized_indices, llm_categories)
+    
+    return transactions
+
+
+async def categorize_michael_transactions_async(
+    transactions: List[Dict],
+    batch_size: int = LLM_BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY
+) -> List[Dict]:
+    """Como categorize_michael_transactions, com os batches do LLM em paralelo"""
+    if not transactions:
+        return transactions
+    
+    uncategorized_indices = await asyncio.to_thread(apply_rule_categories, transactions)
+    if not uncategorized_indices:
+        return transactions
+    
+    llm_categories = await categorize_with_llm_async(
+        items_for_llm(transactions, uncategorized_indices), batch_size, concurrency
+    )
+    apply_llm_categories(transactions, uncategorized_indices, llm_categories)
     
-    output.seek(0)
-    return output.getvalue()
+    return transactions
+
+
+# Colunas do Excel exportado, na ordem, e seus títulos
+EXPORT_COLUMNS = ['date', 'description', 'notes', 'amount', 'extended_details', 'amex_category', 'ai_category', 'city_state']
+EXPORT_COLUMN_NAMES = {
+    'date': 'Date',
+    'description': 'Description',
+    'notes': 'Notes',
+    'amount': 'Amount',
+    'extended_details': 'Extended Details',
+    'amex_category': 'Original Category',
+    'ai_category': 'AI Category',
+    'city_state': 'City/State'
+}
+
+
+def export_michael_to_excel(transactions: List[Dict]) -> tempfile.SpooledTemporaryFile:
+    """
+    Exporta transações categorizadas para Excel (arquivo temporário; quem chama fecha)
+    """
+    # Linhas já com as colunas na ordem de saída (faltantes ficam vazias)
+    rows = [[tx.get(c) for c in EXPORT_COLUMNS] for tx in transactions]
+    headers = [EXPORT_COLUMN_NAMES[c] for c in EXPORT_COLUMNS]
+    
+    # Ajustar largura das colunas
+    widths = [
+        min(max([len(str(row[idx])) for row in rows if row[idx] is not None] + [len(col)]) + 2, 40)
+        for idx, col in enumerate(headers)
+    ]
+    
+    # Planilha de esquema fixo: XML gerado direto, Amount como moeda
+    return write_sheet(
+        'Categorized Expenses', headers, rows,
+        column_widths=widths,
+        money_columns=[EXPORT_COLUMNS.index('amount')]
+    )
 
 
 # =====================================================
@@ -398,6 +461,8 @@ from google.cloud import bigquery
 from datetime import datetime
 import uuid
 
+from .valor_expenses import clear_lookup_caches as clear_valor_lookup_caches
+
 PROJECT_ID = "automatic-bond-462415-h6"
 DATASET_ID = "finance"
 TABLE_ID = "michael_expenses"
@@ -679,6 +744,7 @@ def update_michael_expense(expense_id: str, updates: Dict[str, Any]) -> Dict[str
                 """
                 valor_config = bigquery.QueryJobConfig(query_parameters=valor_params)
                 get_bq_client().query(valor_query, job_config=valor_config).result()
+                clear_valor_lookup_caches()
                 synced_valor = True
     except Exception as e:
         print(f"Error syncing to valor: {e}")
@@ -721,6 +787,7 @@ def delete_michael_expense(expense_id: str) -> Dict[str, Any]:
                 query_parameters=[bigquery.ScalarQueryParameter("valor_id", "STRING", valor_expense_id)]
             )
             get_bq_client().query(valor_delete_query, job_config=valor_config).result()
+            clear_valor_lookup_caches()
         
         return {"success": True, "deleted_amount": amount}
         
@@ -765,6 +832,7 @@ def delete_michael_batch(batch_id: str) -> Dict[str, Any]:
                 WHERE id IN ({valor_ids_str})
                 """
                 get_bq_client().query(valor_delete_query).result()
+                clear_valor_lookup_caches()
         
         return {
             "success": True,
@@ -857,6 +925,7 @@ def sync_michael_to_valor(expense_ids: List[str] = None) -> Dict[str, Any]:
             
             get_bq_client().query(merge_query).result()
             total_synced += len(batch)
+        clear_valor_lookup_caches()
         
         # Mark all as synced in michael_expenses using UPDATE
         synced_ids = [row.id for row in results]
@@ -2,8 +2,11 @@
 Rippling expense report processor
 """
 import pandas as pd
+import tempfile
 from io import BytesIO
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Union, BinaryIO
+
+from .xlsx_fast import write_sheet
 
 # Mapeamento de nomes do Rippling para (displayName, type)
 EMPLOYEE_DATA: Dict[str, Tuple[str, str]] = {
@@ -132,15 +135,16 @@ def map_category(category: str) -> str:
     return "Miscellaneous"
 
 
-def process_rippling_file(file_content: bytes, filename: str) -> Dict[str, Any]:
+def process_rippling_file(file_content: Union[bytes, str, BinaryIO], filename: str) -> Dict[str, Any]:
     """
     Processa arquivo Rippling (CSV ou XLSX) e retorna dados agregados por funcionário e categoria
     """
-    # Ler arquivo
+    # Ler arquivo (bytes, caminho ou arquivo aberto, ex.: UploadFile.file)
+    source = BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
     if filename.endswith('.csv'):
-        df = pd.read_csv(BytesIO(file_content))
+        df = pd.read_csv(source)
     else:
-        df = pd.read_excel(BytesIO(file_content))
+        df = pd.read_excel(source)
     
     # Verificar colunas necessárias
     required_cols = ['Employee', 'Amount', 'Category name']
@@ -148,15 +152,20 @@ def process_rippling_file(file_content: bytes, filename: str) -> Dict[str, Any]:
         if col not in df.columns:
             raise ValueError(f"Coluna obrigatória não encontrada: {col}")
     
-    # Mapear nomes de funcionários e tipos
-    def get_employee_info(name):
-        display_name, emp_type = find_employee_data(name)
-        return pd.Series([display_name, emp_type])
-    
-    df[['Employee Name', 'Employee Type']] = df['Employee'].apply(get_employee_info)
-    
-    # Mapear categorias
-    df['Category'] = df['Category name'].apply(map_category)
+    # Mapear nomes de funcionários e tipos: uma busca por nome distinto e
+    # as duas colunas preenchidas de uma vez (reindex pelo nome de cada linha)
+    names = df['Employee'].unique()
+    employee_info = pd.DataFrame(
+        [find_employee_data(name) for name in names],
+        index=names,
+        columns=['Employee Name', 'Employee Type'],
+    )
+    df[['Employee Name', 'Employee Type']] = employee_info.reindex(df['Employee']).to_numpy()
+    
+    # Mapear categorias (uma vez por categoria distinta)
+    df['Category'] = df['Category name'].map(
+        {category: map_category(category) for category in df['Category name'].unique()}
+    )
     
     # Converter Amount para numérico
     df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce').fillna(0)
@@ -198,72 +207,34 @@ def process_rippling_file(file_content: bytes, filename: str) -> Dict[str, Any]:
     }
 
 
-def export_rippling_to_excel(data: Dict[str, Any]) -> bytes:
+def export_rippling_to_excel(data: Dict[str, Any]) -> tempfile.SpooledTemporaryFile:
     """
-    Exporta dados processados do Rippling para Excel
+    Exporta dados processados do Rippling para Excel (arquivo temporário; quem chama fecha)
     """
     records = data['records']
     totals = data['totals']
     categories = data['categories']
     
-    # Criar DataFrame
-    df = pd.DataFrame(records)
-    
     # Reordenar colunas: Employee Name, Employee Type, categorias ordenadas, Total
     cols = ['Employee Name', 'Employee Type'] + sorted(categories) + ['Total']
     # Filtrar apenas colunas que existem
-    cols = [c for c in cols if c in df.columns]
-    df = df[cols]
-    
-    # Adicionar linha de totais
-    totals_row = pd.DataFrame([totals])
-    totals_row = totals_row[cols]
-    df = pd.concat([df, totals_row], ignore_index=True)
-    
-    # Criar Excel
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Rippling Report')
-        
-        # Formatar
-        worksheet = writer.sheets['Rippling Report']
-        
-        # Ajustar largura das colunas
-        for idx, col in enumerate(df.columns, 1):
-            max_length = max(
-                df[col].astype(str).apply(len).max(),
-                len(str(col))
-            ) + 2
-            worksheet.column_dimensions[chr(64 + idx) if idx <= 26 else f'A{chr(64 + idx - 26)}'].width = min(max_length, 20)
-        
-        # Formatar valores como moeda (colunas de categoria e Total)
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-        
-        # Header style
-        header_fill = PatternFill(start_color='1e3a5f', end_color='1e3a5f', fill_type='solid')
-        header_font = Font(color='FFFFFF', bold=True)
-        
-        for cell in worksheet[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-        
-        # Total row style
-        total_row = len(df) + 1
-        total_fill = PatternFill(start_color='e6f2ff', end_color='e6f2ff', fill_type='solid')
-        total_font = Font(bold=True)
-        
-        for cell in worksheet[total_row]:
-            cell.fill = total_fill
-            cell.font = total_font
-        
-        # Number format for currency columns
-        for row in range(2, len(df) + 2):
-            for col in range(3, len(cols) + 1):  # Começando da coluna 3 (categorias)
-                cell = worksheet.cell(row=row, column=col)
-                if isinstance(cell.value, (int, float)):
-                    cell.number_format = '#,##0.00'
-    
-    output.seek(0)
-    return output.getvalue()
+    present = set().union(*records) if records else set()
+    cols = [c for c in cols if c in present]
+    
+    # Linhas por funcionário + linha de totais
+    rows = [[r.get(c) for c in cols] for r in records]
+    rows.append([totals.get(c) for c in cols])
+    
+    # Ajustar largura das colunas
+    widths = [
+        min(max([len(str(row[idx])) for row in rows] + [len(str(col))]) + 2, 20)
+        for idx, col in enumerate(cols)
+    ]
+    
+    # Planilha de esquema fixo: XML gerado direto, valores como moeda a partir da coluna 3
+    return write_sheet(
+        'Rippling Report', cols, rows,
+        column_widths=widths,
+        money_columns=range(2, len(cols)),
+        total_last_row=True
+    )
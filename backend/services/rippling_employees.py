@@ -3,7 +3,7 @@ Rippling employees service - Gerencia mapeamento de funcionários no BigQuery
 """
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Literal, Optional, Tuple, get_args
 from datetime import datetime
 import hashlib
 import os
@@ -14,17 +14,33 @@ from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
 TABLE_ID = "rippling_employees"
 FULL_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
-# Tipos de funcionários válidos
-EMPLOYEE_TYPES = ["Partner", "Employee", "Contractor", "Advisor"]
+# Tipos de funcionários válidos (o Literal valida a entrada na própria API)
+EmployeeType = Literal["Partner", "Employee", "Contractor", "Advisor"]
+EMPLOYEE_TYPES = list(get_args(EmployeeType))
 
 
 # get_bigquery_client is now imported from bigquery_client module
 
 
-def get_all_employees() -> List[Dict[str, Any]]:
-    """Busca todos os funcionários da tabela"""
+def get_all_employees(limit: Optional[int] = None, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Busca os funcionários da tabela (todos, ou uma página com limit/offset).
+    Retorna (funcionários, total de registros na tabela).
+    """
     client = get_bigquery_client()
     
+    # Com paginação o total vem na própria consulta (janela sobre todas as linhas)
+    page_clause = ""
+    total_column = ""
+    params = []
+    if limit is not None:
+        page_clause = "LIMIT @limit OFFSET @offset"
+        total_column = ", COUNT(*) OVER () AS total_count"
+        params = [
+            bigquery.ScalarQueryParameter("limit", "INT64", limit),
+            bigquery.ScalarQueryParameter("offset", "INT64", offset),
+        ]
+    
     query = f"""
         SELECT 
             id,
@@ -33,13 +49,16 @@ def get_all_employees() -> List[Dict[str, Any]]:
             employee_type,
             created_at,
             updated_at
+            {total_column}
         FROM `{FULL_TABLE_ID}`
         ORDER BY display_name, rippling_name
+        {page_clause}
     """
     
     try:
-        result = client.query(query).result()
+        result = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result()
         employees = []
+        total = None
         for row in result:
             employees.append({
                 "id": row.id,
@@ -49,10 +68,20 @@ def get_all_employees() -> List[Dict[str, Any]]:
                 "created_at": row.created_at.isoformat() if row.created_at else None,
                 "updated_at": row.updated_at.isoformat() if row.updated_at else None,
             })
-        return employees
+            if total is None and limit is not None:
+                total = row.total_count
+        if total is None:
+            # Sem paginação, ou página depois do fim (sem linhas para trazer o total)
+            total = len(employees) if limit is None else _count_employees(client)
+        return employees, total
     except Exception as e:
         print(f"[ERROR] Failed to fetch employees: {e}")
-        return []
+        return [], 0
+
+
+def _count_employees(client) -> int:
+    rows = client.query(f"SELECT COUNT(*) AS n FROM `{FULL_TABLE_ID}`").result()
+    return next(iter(rows)).n
 
 
 def get_unique_display_names() -> List[Dict[str, Any]]:
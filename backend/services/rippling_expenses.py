@@ -11,11 +11,12 @@ import uuid
 import json
 import io
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union, BinaryIO
 import pandas as pd
 from io import BytesIO
 
 from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
+from .valor_expenses import clear_lookup_caches as clear_valor_lookup_caches
 
 # BigQuery configuration
 RIPPLING_TABLE = "rippling_expenses"
@@ -63,17 +64,19 @@ def normalize_name(name: str) -> str:
     return name.strip().lower()
 
 
-def parse_rippling_file(file_content: bytes, filename: str) -> List[Dict]:
+def parse_rippling_file(file_content: Union[bytes, BinaryIO], filename: str) -> List[Dict]:
     """
     Parse arquivo Rippling (xlsx ou csv).
     Formato esperado:
     Employee | Vendor name | Amount - Currency | Amount | Category name | Purchase date | Object type | Approval state | Receipt filepath
     """
     try:
+        # Aceita bytes ou o arquivo do upload já aberto
+        source = BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
         if filename.lower().endswith('.csv'):
-            df = pd.read_csv(BytesIO(file_content))
+            df = pd.read_csv(source)
         else:
-            df = pd.read_excel(BytesIO(file_content))
+            df = pd.read_excel(source)
         
         # Mapear colunas
         column_mapping = {
@@ -293,6 +296,7 @@ def upload_rippling_expenses(transactions: List[Dict], year: int = None) -> Dict
         
         valor_job = client.load_table_from_file(valor_file, FULL_VALOR_TABLE, job_config=job_config)
         valor_job.result()
+        clear_valor_lookup_caches()
         
         return {
             "success": True,
@@ -437,6 +441,7 @@ def delete_rippling_batch(batch_id: str) -> Dict:
                 ]
             )
             client.query(delete_valor, job_config=job_config).result()
+            clear_valor_lookup_caches()
         
         return {
             "success": True,
@@ -475,6 +480,7 @@ def delete_rippling_expense(expense_id: str) -> Dict:
         # 2. Deletar de valor_expenses
         if valor_id:
             client.query(f"DELETE FROM `{FULL_VALOR_TABLE}` WHERE id = '{valor_id}'").result()
+            clear_valor_lookup_caches()
         
         return {"success": True, "synced_valor": valor_id is not None}
         
@@ -546,6 +552,7 @@ def update_rippling_expense(expense_id: str, updates: Dict) -> Dict:
             WHERE id = '{valor_id}'
         """
         client.query(update_valor).result()
+        clear_valor_lookup_caches()
         
         return {"success": True, "synced_valor": True}
         
@@ -708,6 +715,7 @@ def resync_all_rippling_to_valor() -> Dict:
             
             client.query(merge_query).result()
             total_synced += len(batch)
+        clear_valor_lookup_caches()
         
         # Atualizar valor_expense_id no rippling_expenses para manter o link
         for row in result:
@@ -3,20 +3,22 @@ Uber expenses service - Upload incremental para BigQuery com conversão BRL→US
 Sincroniza com valor_expenses (tabela principal)
 """
 import pandas as pd
-from io import BytesIO, StringIO
-from typing import Dict, List, Any, Optional
+from io import BytesIO
+from typing import Dict, List, Any, Optional, Union, BinaryIO
 import requests
 from datetime import datetime, timedelta
 import re
 import uuid
 import json
 import io
+import contextlib
 
 from google.cloud import bigquery
 from google.oauth2 import service_account
 import os
 
 from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
+from .valor_expenses import clear_lookup_caches as clear_valor_lookup_caches
 
 # Configurações BigQuery
 TABLE_ID = "uber_expenses"
@@ -144,7 +146,17 @@ def normalize_uber_name(first_name: str, last_name: str) -> tuple:
     return first_name, last_name
 
 
-def parse_uber_csv(file_content: bytes) -> pd.DataFrame:
+def _open_csv_source(source: Union[bytes, str, BinaryIO]):
+    """Abre o CSV em modo binário a partir dos bytes, de um caminho ou de um arquivo já aberto (que não é fechado aqui)"""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb')
+    source.seek(0)
+    return contextlib.nullcontext(source)
+
+
+def parse_uber_csv(file_content: Union[bytes, str, BinaryIO]) -> pd.DataFrame:
     """
     Parseia CSV do Uber, pulando as linhas de cabeçalho especial.
     O CSV tem 5 linhas antes dos headers reais:
@@ -154,27 +166,26 @@ def parse_uber_csv(file_content: bytes) -> pd.DataFrame:
     - linha vazia
     - "Transactions"
     """
-    # Decodifica o conteúdo
-    try:
-        content = file_content.decode('utf-8')
-    except:
-        content = file_content.decode('latin-1')
-    
-    # Pula as 5 primeiras linhas
-    lines = content.split('\n')
-    
-    # Encontra onde começa os dados reais (linha com "Trip/Eats ID")
-    header_line = 0
-    for i, line in enumerate(lines):
-        if 'Trip/Eats ID' in line or 'trip_eats_id' in line.lower():
-            header_line = i
-            break
-    
-    # Reconstrói o CSV a partir da linha do header
-    clean_csv = '\n'.join(lines[header_line:])
-    
-    # Lê o DataFrame
-    df = pd.read_csv(StringIO(clean_csv))
+    with _open_csv_source(file_content) as f:
+        # Encontra onde começa os dados reais (linha com "Trip/Eats ID"),
+        # lendo linha a linha sem decodificar o arquivo inteiro
+        header_offset = 0
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if b'Trip/Eats ID' in line or b'trip_eats_id' in line.lower():
+                header_offset = offset
+                break
+        
+        # Lê o DataFrame a partir da linha do header
+        try:
+            f.seek(header_offset)
+            df = pd.read_csv(f, encoding='utf-8')
+        except UnicodeDecodeError:
+            f.seek(header_offset)
+            df = pd.read_csv(f, encoding='latin-1')
     
     # Limpa nomes das colunas
     df.columns = [clean_column_name(col) for col in df.columns]
@@ -182,20 +193,30 @@ def parse_uber_csv(file_content: bytes) -> pd.DataFrame:
     return df
 
 
-def get_existing_trip_ids() -> set:
-    """Busca todos os trip_eats_id existentes na tabela do BigQuery"""
+def get_existing_trip_ids(candidate_ids) -> set:
+    """
+    Busca, entre os trip_eats_id do CSV, os que já existem na tabela do BigQuery.
+    Só os IDs do arquivo vão na consulta, então o custo não cresce com a base.
+    """
+    ids = sorted({str(i) for i in candidate_ids if pd.notna(i) and i != ''})
+    if not ids:
+        return set()
+    
     client = get_bigquery_client()
     
     query = f"""
         SELECT DISTINCT trip_eats_id 
         FROM `{FULL_TABLE_ID}`
-        WHERE trip_eats_id IS NOT NULL
+        WHERE trip_eats_id IN UNNEST(@ids)
     """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", ids)]
+    )
     
     try:
-        result = client.query(query).result()
+        result = client.query(query, job_config=job_config).result()
         existing_ids = {row.trip_eats_id for row in result}
-        print(f"[INFO] {len(existing_ids)} trip IDs existentes no BigQuery")
+        print(f"[INFO] {len(existing_ids)} de {len(ids)} trip IDs já existem no BigQuery")
         return existing_ids
     except Exception as e:
         print(f"[WARN] Erro ao buscar IDs existentes: {e}")
@@ -214,8 +235,8 @@ def convert_brl_to_usd(df: pd.DataFrame) -> pd.DataFrame:
         return df
     
     # Extrair datas únicas
-    df['_temp_date'] = pd.to_datetime(df[timestamp_col], errors='coerce').dt.strftime('%Y-%m-%d')
-    unique_dates = df['_temp_date'].dropna().unique()
+    dates = pd.to_datetime(df[timestamp_col], errors='coerce').dt.strftime('%Y-%m-%d')
+    unique_dates = dates.dropna().unique()
     
     # Buscar cotações
     cotacoes = {}
@@ -223,33 +244,18 @@ def convert_brl_to_usd(df: pd.DataFrame) -> pd.DataFrame:
         if pd.notna(data) and data != 'NaT':
             cotacoes[data] = get_cotacao_dolar_ptax(data)
     
-    # Aplicar conversão
-    def convert_row(row):
-        date = row['_temp_date']
-        try:
-            brl_amount = float(row[brl_col]) if pd.notna(row[brl_col]) else None
-        except:
-            brl_amount = None
-        
-        if pd.isna(date) or brl_amount is None:
-            return pd.Series({'transaction_amount_usd': None, 'ptax_rate': None})
-        
-        rate = cotacoes.get(date)
-        if rate and rate > 0:
-            usd_amount = round(brl_amount / rate, 2)
-            return pd.Series({'transaction_amount_usd': usd_amount, 'ptax_rate': rate})
-        
-        return pd.Series({'transaction_amount_usd': None, 'ptax_rate': None})
+    # Aplicar conversão em bloco (sem df.apply linha a linha)
+    brl_amounts = pd.to_numeric(df[brl_col], errors='coerce')
+    rates = pd.to_numeric(dates.map(cotacoes), errors='coerce')
+    valid = brl_amounts.notna() & (rates > 0)
     
-    converted = df.apply(convert_row, axis=1)
-    df['transaction_amount_usd'] = converted['transaction_amount_usd']
-    df['ptax_rate'] = converted['ptax_rate']
-    df = df.drop(columns=['_temp_date'])
+    df['transaction_amount_usd'] = (brl_amounts / rates).round(2).where(valid)
+    df['ptax_rate'] = rates.where(valid)
     
     return df
 
 
-def process_uber_csv(file_content: bytes, filename: str) -> Dict[str, Any]:
+def process_uber_csv(file_content: Union[bytes, str, BinaryIO], filename: str) -> Dict[str, Any]:
     """
     Processa CSV do Uber:
     1. Parseia o CSV
@@ -263,12 +269,10 @@ def process_uber_csv(file_content: bytes, filename: str) -> Dict[str, Any]:
     
     print(f"[INFO] CSV parseado: {total_rows} linhas, {len(df.columns)} colunas")
     
-    # 2. Buscar IDs existentes
-    existing_ids = get_existing_trip_ids()
-    
-    # 3. Filtrar apenas novas linhas
+    # 2-3. Buscar quais IDs do CSV já existem e filtrar apenas novas linhas
     if 'trip_eats_id' in df.columns:
-        df_new = df[~df['trip_eats_id'].isin(existing_ids)]
+        existing_ids = get_existing_trip_ids(df['trip_eats_id'])
+        df_new = df[~df['trip_eats_id'].astype(str).isin(existing_ids)]
     else:
         df_new = df  # Se não tem a coluna, considera tudo como novo
     
@@ -304,13 +308,13 @@ def process_uber_csv(file_content: bytes, filename: str) -> Dict[str, Any]:
     }
 
 
-def upload_new_rows_to_bigquery(file_content: bytes, projects_map: Dict[str, str] = None) -> Dict[str, Any]:
+def upload_new_rows_to_bigquery(file_content: Union[bytes, str, BinaryIO], projects_map: Dict[str, str] = None) -> Dict[str, Any]:
     """
     Faz upload das novas linhas para o BigQuery usando MERGE para evitar duplicados.
     Também sincroniza com valor_expenses (tabela principal).
     
     Args:
-        file_content: bytes do arquivo CSV
+        file_content: bytes do CSV, caminho ou arquivo aberto (ex.: UploadFile.file)
         projects_map: dict mapeando trip_eats_id para o valor do project (preenchido pelo usuário)
     """
     if projects_map is None:
@@ -327,8 +331,8 @@ def upload_new_rows_to_bigquery(file_content: bytes, projects_map: Dict[str, str
             "synced_to_valor": 0
         }
     
-    # 2. Buscar IDs existentes para saber quais são novos
-    existing_ids = get_existing_trip_ids()
+    # 2. Buscar quais IDs do CSV já existem para saber quais são novos
+    existing_ids = get_existing_trip_ids(df['trip_eats_id']) if 'trip_eats_id' in df.columns else set()
     
     # 3. Converter BRL para USD
     df = convert_brl_to_usd(df)
@@ -344,7 +348,7 @@ def upload_new_rows_to_bigquery(file_content: bytes, projects_map: Dict[str, str
     
     # Identificar novas linhas antes de converter para string
     if 'trip_eats_id' in df.columns:
-        new_mask = ~df['trip_eats_id'].isin(existing_ids)
+        new_mask = ~df['trip_eats_id'].astype(str).isin(existing_ids)
         df_new_for_valor = df[new_mask].copy()
     else:
         df_new_for_valor = df.copy()
@@ -417,6 +421,75 @@ def upload_new_rows_to_bigquery(file_content: bytes, projects_map: Dict[str, str
         }
 
 
+VALOR_SYNC_SCHEMA = [
+    bigquery.SchemaField("id", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("amount", "FLOAT64"),
+    bigquery.SchemaField("category", "STRING"),
+    bigquery.SchemaField("date", "STRING"),
+    bigquery.SchemaField("vendor", "STRING"),
+    bigquery.SchemaField("year", "INT64"),
+    bigquery.SchemaField("month", "INT64"),
+    bigquery.SchemaField("source", "STRING"),
+    bigquery.SchemaField("project", "STRING"),
+]
+
+
+def merge_rows_into_valor(valor_rows: List[Dict[str, Any]], client) -> int:
+    """
+    Upsert das linhas em valor_expenses: um load job (NDJSON) para uma tabela
+    temporária e um único MERGE, em vez de um MERGE com VALUES a cada 100 linhas.
+    """
+    ndjson = "\n".join(
+        json.dumps({
+            **row,
+            "name": row["name"] or "",
+            "category": row["category"] or "",
+            "vendor": row["vendor"] or "",
+            "project": row["project"] or "",
+            "date": row["date"] or "1900-01-01",
+            "year": row["year"] or 2024,
+            "month": row["month"] or 1,
+        })
+        for row in valor_rows
+    )
+    temp_table_id = f"{PROJECT_ID}.{DATASET_ID}.uber_valor_sync_temp_{uuid.uuid4().hex}"
+    
+    try:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            schema=VALOR_SYNC_SCHEMA,
+        )
+        client.load_table_from_file(io.BytesIO(ndjson.encode('utf-8')), temp_table_id, job_config=job_config).result()
+        
+        merge_query = f"""
+            MERGE `{FULL_VALOR_TABLE_ID}` AS target
+            USING `{temp_table_id}` AS source
+            ON target.id = source.id
+            WHEN MATCHED THEN
+                UPDATE SET
+                    name = source.name,
+                    amount = source.amount,
+                    category = source.category,
+                    date = PARSE_DATE('%Y-%m-%d', source.date),
+                    vendor = source.vendor,
+                    year = source.year,
+                    month = source.month,
+                    source = source.source,
+                    project = source.project
+            WHEN NOT MATCHED THEN
+                INSERT (id, created_at, name, amount, category, date, vendor, year, month, source, project)
+                VALUES (source.id, CURRENT_TIMESTAMP(), source.name, source.amount, source.category, 
+                        PARSE_DATE('%Y-%m-%d', source.date), source.vendor, source.year, source.month, source.source, source.project)
+        """
+        client.query(merge_query).result()
+        clear_valor_lookup_caches()
+        return len(valor_rows)
+    finally:
+        client.delete_table(temp_table_id, not_found_ok=True)
+
+
 def sync_uber_to_valor(df_new: pd.DataFrame, client=None) -> int:
     """
     Sincroniza dados do Uber com a tabela valor_expenses usando MERGE (upsert).
@@ -496,57 +569,7 @@ def sync_uber_to_valor(df_new: pd.DataFrame, client=None) -> int:
     
     try:
         # Use MERGE to upsert - prevents duplicates!
-        batch_size = 100
-        total_synced = 0
-        
-        for i in range(0, len(valor_rows), batch_size):
-            batch = valor_rows[i:i+batch_size]
-            
-            values_parts = []
-            for row in batch:
-                # Escape single quotes
-                name = (row["name"] or "").replace("'", "\\'")
-                vendor = (row["vendor"] or "").replace("'", "\\'")
-                category = (row["category"] or "").replace("'", "\\'")
-                project = (row["project"] or "").replace("'", "\\'")
-                date_str = row["date"] or "1900-01-01"
-                year = row["year"] or 2024
-                month = row["month"] or 1
-                
-                values_parts.append(f"""
-                    ('{row["id"]}', '{name}', {row["amount"]}, '{category}', '{date_str}', '{vendor}', {year}, {month}, '{row["source"]}', '{project}')
-                """)
-            
-            values_sql = ",".join(values_parts)
-            
-            merge_query = f"""
-                MERGE `{FULL_VALOR_TABLE_ID}` AS target
-                USING (
-                    SELECT * FROM UNNEST([
-                        STRUCT<id STRING, name STRING, amount FLOAT64, category STRING, date STRING, vendor STRING, year INT64, month INT64, source STRING, project STRING>
-                        {values_sql}
-                    ])
-                ) AS source
-                ON target.id = source.id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        name = source.name,
-                        amount = source.amount,
-                        category = source.category,
-                        date = PARSE_DATE('%Y-%m-%d', source.date),
-                        vendor = source.vendor,
-                        year = source.year,
-                        month = source.month,
-                        source = source.source,
-                        project = source.project
-                WHEN NOT MATCHED THEN
-                    INSERT (id, created_at, name, amount, category, date, vendor, year, month, source, project)
-                    VALUES (source.id, CURRENT_TIMESTAMP(), source.name, source.amount, source.category, 
-                            PARSE_DATE('%Y-%m-%d', source.date), source.vendor, source.year, source.month, source.source, source.project)
-            """
-            
-            client.query(merge_query).result()
-            total_synced += len(batch)
+        total_synced = merge_rows_into_valor(valor_rows, client)
         
         print(f"[INFO] {total_synced} linhas sincronizadas com valor_expenses (MERGE)")
         return total_synced
@@ -810,6 +833,7 @@ def update_uber_expense(trip_id: str, updates: Dict[str, Any]) -> Dict[str, Any]
         """
         try:
             client.query(valor_query).result()
+            clear_valor_lookup_caches()
         except Exception as e:
             errors.append(f"Erro ao atualizar valor_expenses: {str(e)}")
     
@@ -845,6 +869,7 @@ def delete_uber_expense(trip_id: str) -> Dict[str, Any]:
     """
     try:
         client.query(valor_query).result()
+        clear_valor_lookup_caches()
     except Exception as e:
         errors.append(f"Erro ao deletar valor_expenses: {str(e)}")
     
@@ -924,54 +949,8 @@ def resync_all_uber_to_valor() -> Dict[str, Any]:
                 "project": project,
             })
         
-        # Use MERGE em batches
-        batch_size = 100
-        total_synced = 0
-        
-        for i in range(0, len(valor_rows), batch_size):
-            batch = valor_rows[i:i+batch_size]
-            
-            values_parts = []
-            for r in batch:
-                name = (r["name"] or "").replace("'", "\\'")
-                vendor = (r["vendor"] or "").replace("'", "\\'")
-                category = (r["category"] or "").replace("'", "\\'")
-                project = (r["project"] or "").replace("'", "\\'")
-                
-                values_parts.append(f"""
-                    ('{r["id"]}', '{name}', {r["amount"]}, '{category}', '{r["date"]}', '{vendor}', {r["year"]}, {r["month"]}, '{r["source"]}', '{project}')
-                """)
-            
-            values_sql = ",".join(values_parts)
-            
-            merge_query = f"""
-                MERGE `{FULL_VALOR_TABLE_ID}` AS target
-                USING (
-                    SELECT * FROM UNNEST([
-                        STRUCT<id STRING, name STRING, amount FLOAT64, category STRING, date STRING, vendor STRING, year INT64, month INT64, source STRING, project STRING>
-                        {values_sql}
-                    ])
-                ) AS source
-                ON target.id = source.id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        name = source.name,
-                        amount = source.amount,
-                        category = source.category,
-                        date = PARSE_DATE('%Y-%m-%d', source.date),
-                        vendor = source.vendor,
-                        year = source.year,
-                        month = source.month,
-                        source = source.source,
-                        project = source.project
-                WHEN NOT MATCHED THEN
-                    INSERT (id, created_at, name, amount, category, date, vendor, year, month, source, project)
-                    VALUES (source.id, CURRENT_TIMESTAMP(), source.name, source.amount, source.category, 
-                            PARSE_DATE('%Y-%m-%d', source.date), source.vendor, source.year, source.month, source.source, source.project)
-            """
-            
-            client.query(merge_query).result()
-            total_synced += len(batch)
+        # Um único MERGE a partir de uma tabela temporária
+        total_synced = merge_rows_into_valor(valor_rows, client)
         
         return {
             "success": True,
@@ -1015,6 +994,7 @@ def delete_uber_expenses_batch(trip_ids: List[str]) -> Dict[str, Any]:
     """
     try:
         client.query(valor_query).result()
+        clear_valor_lookup_caches()
     except Exception as e:
         errors.append(f"Erro ao deletar valor_expenses: {str(e)}")
     
@@ -4,31 +4,54 @@ Table: valor_expenses with columns: id, name, amount, category, date, vendor, ye
 """
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Iterator, Optional
 import os
 import uuid
-import json
 import io
-from io import BytesIO
+import tempfile
 from datetime import datetime
 
+import orjson
+
 from .bigquery_client import get_bigquery_client, PROJECT_ID, DATASET_ID
+from .excel_export import SPOOL_MAX_SIZE
+from .cache import ttl_cache
 
 # BigQuery configuration
 TABLE_ID = "valor_expenses"
 FULL_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
+# Resumo e listas dos filtros (anos, categorias, nomes, vendors) ficam em cache por
+# LOOKUP_CACHE_TTL segundos; as funções que gravam na tabela chamam clear_lookup_caches().
+# Só o cache do worker que gravou é limpo: nos outros o dado antigo dura até o TTL
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL", "300"))
+
 
 # get_bigquery_client is now imported from bigquery_client module
 
 
-def get_all_expenses(year: Optional[int] = None, month: Optional[int] = None, 
-                     name: Optional[str] = None, category: Optional[str] = None,
-                     start_date: Optional[str] = None, end_date: Optional[str] = None,
-                     limit: int = 5000) -> List[Dict[str, Any]]:
+def _expense_from_row(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "amount": float(row.amount) if row.amount else 0.0,
+        "category": row.category,
+        "date": str(row.date) if row.date else None,
+        "vendor": row.vendor or "",
+        "year": row.year,
+        "month": row.month,
+        "source": row.source or "",
+        "project": row.project or "",
+    }
+
+
+def iter_expenses(year: Optional[int] = None, month: Optional[int] = None, 
+                  name: Optional[str] = None, category: Optional[str] = None,
+                  start_date: Optional[str] = None, end_date: Optional[str] = None,
+                  limit: int = 5000) -> Iterator[Dict[str, Any]]:
     """
-    Get all expenses with optional filters.
-    If start_date/end_date are provided, year filter is ignored.
+    Run the expenses query (errors are raised here) and return an iterator over the rows,
+    converted as BigQuery pages are fetched. Same filters as get_all_expenses.
     """
     client = get_bigquery_client()
     
@@ -61,34 +84,36 @@ def get_all_expenses(year: Optional[int] = None, month: Optional[int] = None,
         LIMIT {limit}
     """
     
-    try:
-        result = client.query(query).result()
-        expenses = []
-        for row in result:
-            expenses.append({
-                "id": row.id,
-                "name": row.name,
-                "amount": float(row.amount) if row.amount else 0.0,
-                "category": row.category,
-                "date": str(row.date) if row.date else None,
-                "vendor": row.vendor or "",
-                "year": row.year,
-                "month": row.month,
-                "source": row.source or "",
-                "project": row.project or "",
-            })
-        return expenses
-    except Exception as e:
-        print(f"Error getting expenses: {e}")
-        return []
+    return map(_expense_from_row, client.query(query).result())
 
 
-def get_expenses_by_employee(year: Optional[int] = None, 
-                              start_date: Optional[str] = None, 
-                              end_date: Optional[str] = None) -> List[Dict[str, Any]]:
+def get_all_expenses(year: Optional[int] = None, month: Optional[int] = None, 
+                     name: Optional[str] = None, category: Optional[str] = None,
+                     start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     limit: int = 5000) -> List[Dict[str, Any]]:
     """
-    Get expenses aggregated by employee (name) and category.
+    Get all expenses with optional filters.
     If start_date/end_date are provided, year filter is ignored.
+    Query errors are raised, as in iter_expenses (the API turns them into a 500).
+    """
+    return list(iter_expenses(year, month, name, category, start_date, end_date, limit))
+
+
+def _employee_from_row(row) -> Dict[str, Any]:
+    return {
+        "employee_name": row.name,
+        "employee_type": "Partner",  # Default, can be extended later
+        "total": row.total,
+        "categories": {item["category"]: item["total"] for item in row.categories}
+    }
+
+
+def iter_expenses_by_employee(year: Optional[int] = None, 
+                              start_date: Optional[str] = None, 
+                              end_date: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the per-employee aggregation (errors are raised here) and return an iterator
+    with one entry per employee. Same filters as get_expenses_by_employee.
     """
     client = get_bigquery_client()
     
@@ -103,44 +128,41 @@ def get_expenses_by_employee(year: Optional[int] = None,
     
     where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     
+    # Pivot done in BigQuery: one row per employee with the per-category totals as an array
     query = f"""
         SELECT 
             name,
-            category,
-            SUM(amount) as total_amount
-        FROM `{FULL_TABLE_ID}`
-        {where_clause}
-        GROUP BY name, category
-        ORDER BY name, category
+            SUM(total) as total,
+            ARRAY_AGG(STRUCT(category, total) ORDER BY category) as categories
+        FROM (
+            SELECT 
+                name,
+                category,
+                COALESCE(SUM(CAST(amount AS FLOAT64)), 0) as total
+            FROM `{FULL_TABLE_ID}`
+            {where_clause}
+            GROUP BY name, category
+        )
+        GROUP BY name
+        ORDER BY name
     """
     
-    try:
-        result = client.query(query).result()
-        
-        # Aggregate by employee
-        by_employee = {}
-        for row in result:
-            name = row.name
-            if name not in by_employee:
-                by_employee[name] = {
-                    "employee_name": name,
-                    "employee_type": "Partner",  # Default, can be extended later
-                    "total": 0.0,
-                    "categories": {}
-                }
-            by_employee[name]["categories"][row.category] = float(row.total_amount)
-            by_employee[name]["total"] += float(row.total_amount)
-        
-        return list(by_employee.values())
-    except Exception as e:
-        print(f"Error getting expenses by employee: {e}")
-        return []
+    return map(_employee_from_row, client.query(query).result())
 
 
-def get_summary(year: Optional[int] = None) -> Dict[str, Any]:
+def get_expenses_by_employee(year: Optional[int] = None, 
+                              start_date: Optional[str] = None, 
+                              end_date: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    Get summary statistics
+    Get expenses aggregated by employee (name) and category.
+    If start_date/end_date are provided, year filter is ignored.
+    Query errors are raised, as in iter_expenses_by_employee (the API turns them into a 500).
     """
+    return list(iter_expenses_by_employee(year, start_date, end_date))
+
+
+@ttl_cache(LOOKUP_CACHE_TTL)
+def _query_summary(year: Optional[int] = None) -> Dict[str, Any]:
     client = get_bigquery_client()
     
     where_clause = f"WHERE year = {year}" if year else ""
@@ -164,39 +186,65 @@ def get_summary(year: Optional[int] = None) -> Dict[str, Any]:
         ORDER BY total DESC
     """
     
+    result = list(client.query(query).result())[0]
+    cat_result = client.query(cat_query).result()
+    
+    by_category = {}
+    for row in cat_result:
+        by_category[row.category] = float(row.total)
+    
+    return {
+        "grand_total": float(result.grand_total) if result.grand_total else 0.0,
+        "employee_count": result.employee_count or 0,
+        "transaction_count": result.transaction_count or 0,
+        "by_category": by_category
+    }
+
+
+def get_summary(year: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Get summary statistics
+    """
     try:
-        result = list(client.query(query).result())[0]
-        cat_result = client.query(cat_query).result()
-        
-        by_category = {}
-        for row in cat_result:
-            by_category[row.category] = float(row.total)
-        
-        return {
-            "grand_total": float(result.grand_total) if result.grand_total else 0.0,
-            "employee_count": result.employee_count or 0,
-            "transaction_count": result.transaction_count or 0,
-            "by_category": by_category
-        }
+        return _query_summary(year)
     except Exception as e:
         print(f"Error getting summary: {e}")
         return {"grand_total": 0, "employee_count": 0, "transaction_count": 0, "by_category": {}}
 
 
-def get_available_years() -> List[int]:
-    """Get list of years with data"""
-    client = get_bigquery_client()
-    
+@ttl_cache(LOOKUP_CACHE_TTL)
+def _query_years() -> List[int]:
     query = f"""
         SELECT DISTINCT year
         FROM `{FULL_TABLE_ID}`
         WHERE year IS NOT NULL
         ORDER BY year DESC
     """
-    
+    return [row.year for row in get_bigquery_client().query(query).result()]
+
+
+@ttl_cache(LOOKUP_CACHE_TTL)
+def _query_distinct(column: str) -> List[str]:
+    """Distinct non-empty values of a text column, sorted"""
+    query = f"""
+        SELECT DISTINCT {column}
+        FROM `{FULL_TABLE_ID}`
+        WHERE {column} IS NOT NULL AND {column} != ''
+        ORDER BY {column}
+    """
+    return [row[0] for row in get_bigquery_client().query(query).result()]
+
+
+def clear_lookup_caches():
+    """Invalidate the cached summary and filter lists (call after writing to valor_expenses)"""
+    for cached in (_query_summary, _query_years, _query_distinct):
+        cached.cache_clear()
+
+
+def get_available_years() -> List[int]:
+    """Get list of years with data"""
     try:
-        result = client.query(query).result()
-        return [row.year for row in result]
+        return _query_years()
     except Exception as e:
         print(f"Error getting years: {e}")
         return [2025]
@@ -204,18 +252,8 @@ def get_available_years() -> List[int]:
 
 def get_categories() -> List[str]:
     """Get list of unique categories"""
-    client = get_bigquery_client()
-    
-    query = f"""
-        SELECT DISTINCT category
-        FROM `{FULL_TABLE_ID}`
-        WHERE category IS NOT NULL AND category != ''
-        ORDER BY category
-    """
-    
     try:
-        result = client.query(query).result()
-        return [row.category for row in result]
+        return _query_distinct("category")
     except Exception as e:
         print(f"Error getting categories: {e}")
         return []
@@ -223,18 +261,8 @@ def get_categories() -> List[str]:
 
 def get_names() -> List[str]:
     """Get list of unique employee names"""
-    client = get_bigquery_client()
-    
-    query = f"""
-        SELECT DISTINCT name
-        FROM `{FULL_TABLE_ID}`
-        WHERE name IS NOT NULL AND name != ''
-        ORDER BY name
-    """
-    
     try:
-        result = client.query(query).result()
-        return [row.name for row in result]
+        return _query_distinct("name")
     except Exception as e:
         print(f"Error getting names: {e}")
         return []
@@ -242,18 +270,8 @@ def get_names() -> List[str]:
 
 def get_vendors() -> List[str]:
     """Get list of unique vendors"""
-    client = get_bigquery_client()
-    
-    query = f"""
-        SELECT DISTINCT vendor
-        FROM `{FULL_TABLE_ID}`
-        WHERE vendor IS NOT NULL AND vendor != ''
-        ORDER BY vendor
-    """
-    
     try:
-        result = client.query(query).result()
-        return [row.vendor for row in result]
+        return _query_distinct("vendor")
     except Exception as e:
         print(f"Error getting vendors: {e}")
         return []
@@ -306,6 +324,8 @@ def add_expenses(expenses: List[Dict[str, Any]]) -> Dict[str, Any]:
     client = get_bigquery_client()
     
     rows = []
+    # Same insertion timestamp for the whole batch
+    created_at = datetime.utcnow().isoformat()
     for exp in expenses:
         date_str = exp.get("date")
         if date_str:
@@ -322,7 +342,7 @@ def add_expenses(expenses: List[Dict[str, Any]]) -> Dict[str, Any]:
         
         rows.append({
             "id": str(uuid.uuid4()),
-            "created_at": datetime.utcnow().isoformat(),
+            "created_at": created_at,
             "name": exp.get("name", ""),
             "amount": float(exp.get("amount", 0)),
             "category": exp.get("category", ""),
@@ -333,9 +353,8 @@ def add_expenses(expenses: List[Dict[str, Any]]) -> Dict[str, Any]:
         })
     
     try:
-        # Use NDJSON for robust insertion
-        ndjson_data = "\n".join(json.dumps(row) for row in rows)
-        json_file = io.BytesIO(ndjson_data.encode('utf-8'))
+        # Use NDJSON for robust insertion: one load job for all rows, serialized by orjson
+        json_file = io.BytesIO(b"".join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows))
         
         job_config = bigquery.LoadJobConfig(
             source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
@@ -348,6 +367,7 @@ def add_expenses(expenses: List[Dict[str, Any]]) -> Dict[str, Any]:
             job_config=job_config
         )
         load_job.result()
+        clear_lookup_caches()
         
         return {"success": True, "inserted": len(rows)}
     except Exception as e:
@@ -365,6 +385,7 @@ def delete_expense(expense_id: str) -> Dict[str, Any]:
     
     try:
         client.query(query).result()
+        clear_lookup_caches()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -385,6 +406,7 @@ def clear_vendor_for_credit_card_expenses() -> Dict[str, Any]:
     
     try:
         result = client.query(query).result()
+        clear_lookup_caches()
         return {"success": True, "message": "Cleared vendor for all Credit Card expenses"}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -429,6 +451,8 @@ def fix_category_case() -> Dict[str, Any]:
         except Exception as e:
             errors.append(f"Error fixing {wrong}: {str(e)}")
     
+    clear_lookup_caches()
+    
     return {
         "success": True,
         "message": f"Fixed category case issues",
@@ -480,6 +504,7 @@ def update_expense(expense_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
     
     try:
         client.query(query).result()
+        clear_lookup_caches()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -492,22 +517,25 @@ def delete_expenses_batch(expense_ids: List[str]) -> Dict[str, Any]:
     
     client = get_bigquery_client()
     
-    # Build IN clause with escaped IDs
-    ids_list = ", ".join([f"'{eid}'" for eid in expense_ids])
-    
+    # IDs go as a single array parameter (no quoting, no query text growing with the batch)
     query = f"""
         DELETE FROM `{FULL_TABLE_ID}`
-        WHERE id IN ({ids_list})
+        WHERE id IN UNNEST(@ids)
     """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", expense_ids)]
+    )
     
     try:
-        client.query(query).result()
-        return {"success": True, "deleted_count": len(expense_ids)}
+        job = client.query(query, job_config=job_config)
+        job.result()
+        clear_lookup_caches()
+        return {"success": True, "deleted_count": job.num_dml_affected_rows or 0}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def export_consolidated_by_category(year: int) -> BytesIO:
+def export_consolidated_by_category(year: int) -> tempfile.SpooledTemporaryFile:
     """
     Export consolidated expenses by category to Excel with multiple sheets:
     - Summary: Total by category
@@ -542,8 +570,8 @@ def export_consolidated_by_category(year: int) -> BytesIO:
     
     df = pd.DataFrame(expenses)
     
-    # Create Excel file with multiple sheets
-    output = BytesIO()
+    # Create Excel file with multiple sheets (spills to disk when large; caller closes it)
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
     
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         # Summary sheet - totals by category
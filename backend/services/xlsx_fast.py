@@ -0,0 +1,227 @@
+"""
+Escrita direta de .xlsx (OOXML) para as planilhas de esquema fixo (relatório Rippling,
+despesas do Michael): o XML da aba é formatado a partir das linhas e compactado aqui,
+sem passar por uma biblioteca de workbook.
+Uma aba por arquivo, cabeçalho + linhas, com um conjunto fixo de estilos.
+"""
+
+import re
+import tempfile
+import zipfile
+from numbers import Integral, Real
+from typing import Dict, Iterable, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from .excel_export import SPOOL_MAX_SIZE
+
+# Índices em cellXfs do STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1
+STYLE_MONEY = 2
+STYLE_TOTAL = 3
+STYLE_TOTAL_MONEY = 4
+
+# Linhas acumuladas antes de cada escrita no zip
+ROW_FLUSH_SIZE = 500
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+CONTENT_TYPES_XML = (
+    _XML_DECL
+    + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    _XML_DECL
+    + f'<Relationships xmlns="{_NS_PKG_REL}">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_RELS_XML = (
+    _XML_DECL
+    + f'<Relationships xmlns="{_NS_PKG_REL}">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+    f'<Relationship Id="rId3" Type="{_NS_REL}/sharedStrings" Target="sharedStrings.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = (
+    _XML_DECL
+    + f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+# Cabeçalho azul-escuro com fonte branca, moeda "#,##0.00", linha de total em azul-claro
+STYLES_XML = (
+    _XML_DECL
+    + f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="#,##0.00"/></numFmts>'
+    '<fonts count="3">'
+    '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    '<fills count="4">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF1E3A5F"/><bgColor indexed="64"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFE6F2FF"/><bgColor indexed="64"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="3" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+    '<xf numFmtId="164" fontId="2" fillId="3" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1" applyFill="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# Caracteres de controle não são permitidos em XML 1.0
+_ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def column_letter(idx: int) -> str:
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _text_xml(value: str) -> str:
+    value = escape(_ILLEGAL_XML_CHARS.sub("", value))
+    if value != value.strip():
+        return f'<t xml:space="preserve">{value}</t>'
+    return f"<t>{value}</t>"
+
+
+class _SharedStrings:
+    """Tabela sharedStrings.xml: cada texto distinto é gravado uma única vez"""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.count = 0
+
+    def get(self, value: str) -> int:
+        self.count += 1
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.index)
+        return idx
+
+    def to_xml(self) -> str:
+        items = "".join(f"<si>{_text_xml(s)}</si>" for s in self.index)
+        return (
+            _XML_DECL
+            + f'<sst xmlns="{_NS_MAIN}" count="{self.count}" uniqueCount="{len(self.index)}">{items}</sst>'
+        )
+
+
+def _cell_xml(ref: str, value, style: int, strings: _SharedStrings) -> str:
+    s = f' s="{style}"' if style else ""
+    if value is None:
+        return f'<c r="{ref}"{s}/>' if style else ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, Integral):
+        return f'<c r="{ref}"{s}><v>{int(value)}</v></c>'
+    if isinstance(value, Real):
+        value = float(value)
+        # NaN/inf não existem no formato; ficam como célula vazia
+        if value != value or value in (float("inf"), float("-inf")):
+            return f'<c r="{ref}"{s}/>' if style else ""
+        return f'<c r="{ref}"{s}><v>{value!r}</v></c>'
+    return f'<c r="{ref}"{s} t="s"><v>{strings.get(str(value))}</v></c>'
+
+
+def write_sheet(
+    sheet_name: str,
+    headers: Sequence[str],
+    rows: Iterable[Sequence],
+    column_widths: Optional[Sequence[float]] = None,
+    money_columns: Iterable[int] = (),
+    total_last_row: bool = False,
+) -> tempfile.SpooledTemporaryFile:
+    """
+    Gera o .xlsx de uma aba num SpooledTemporaryFile (vai para disco acima de SPOOL_MAX_SIZE),
+    posicionado no início; quem chama fecha.
+    Valores numéricos nas colunas `money_columns` saem como moeda; com `total_last_row`
+    a última linha recebe o estilo de total (negrito, fundo azul-claro).
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    money_columns = set(money_columns)
+    letters = [column_letter(i) for i in range(len(headers))]
+    strings = _SharedStrings()
+    total_row = len(rows) if total_last_row else -1
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", ROOT_RELS_XML)
+        zf.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML)
+        zf.writestr("xl/workbook.xml", WORKBOOK_XML.format(name=escape(sheet_name[:31], {'"': "&quot;"})))
+        zf.writestr("xl/styles.xml", STYLES_XML)
+
+        with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            parts = [_XML_DECL, f'<worksheet xmlns="{_NS_MAIN}">']
+            if column_widths:
+                parts.append("<cols>")
+                parts.extend(
+                    f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+                    for i, width in enumerate(column_widths, start=1)
+                )
+                parts.append("</cols>")
+            parts.append('<sheetData><row r="1">')
+            parts.extend(
+                _cell_xml(f"{letter}1", header, STYLE_HEADER, strings)
+                for letter, header in zip(letters, headers)
+            )
+            parts.append("</row>")
+
+            for row_no, row in enumerate(rows, start=1):
+                r = row_no + 1
+                is_total = row_no == total_row
+                cells = []
+                for col_idx, value in enumerate(row):
+                    money = col_idx in money_columns and isinstance(value, Real) and not isinstance(value, bool)
+                    if is_total:
+                        style = STYLE_TOTAL_MONEY if money else STYLE_TOTAL
+                    else:
+                        style = STYLE_MONEY if money else STYLE_DEFAULT
+                    cells.append(_cell_xml(f"{letters[col_idx]}{r}", value, style, strings))
+                parts.append(f'<row r="{r}">{"".join(cells)}</row>')
+                if len(parts) >= ROW_FLUSH_SIZE:
+                    sheet.write("".join(parts).encode("utf-8"))
+                    parts.clear()
+
+            parts.append("</sheetData></worksheet>")
+            sheet.write("".join(parts).encode("utf-8"))
+
+        zf.writestr("xl/sharedStrings.xml", strings.to_xml())
+
+    output.seek(0)
+    return output